@@ -91,3 +91,48 @@ def time_2d_sia_large():
     mb = massbalance.LinearMassBalance(450., grad=3)
     sdmodel = Upstream2D(bed_2d, dx=200, mb_model=mb, y0=0.)
     sdmodel.run_until(2000)
+
+
+class _StepCountingModel(flowline.FluxBasedModel):
+    """Counts the calls to step()."""
+
+    n_steps = 0
+
+    def step(self, dt):
+        self.n_steps += 1
+        return super(_StepCountingModel, self).step(dt)
+
+
+def _n_steps_slow_glacier(time_stepping):
+
+    fls = dummy_constant_bed()
+    mb = massbalance.LinearMassBalance(2600.)
+
+    # Low glen_a: slow ice, large CFL time steps
+    model = _StepCountingModel(fls, mb_model=mb, y0=0., glen_a=2.4e-25,
+                               time_stepping=time_stepping)
+    model.run_until(300)
+    return model.n_steps
+
+
+def track_1d_flux_slow_glacier_n_steps_monthly():
+    return _n_steps_slow_glacier('monthly')
+
+
+def track_1d_flux_slow_glacier_n_steps_events():
+    return _n_steps_slow_glacier('events')
+
+
+track_1d_flux_slow_glacier_n_steps_monthly.unit = 'steps'
+track_1d_flux_slow_glacier_n_steps_events.unit = 'steps'
+
+
+def time_1d_flux_slow_glacier_events():
+
+        fls = dummy_constant_bed()
+        mb = massbalance.LinearMassBalance(2600.)
+
+        model = flowline.FluxBasedModel(fls, mb_model=mb, y0=0.,
+                                        glen_a=2.4e-25,
+                                        time_stepping='events')
+        model.run_until(300)
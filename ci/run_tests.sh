@@ -27,6 +27,7 @@ fi
 [[ -d .git ]] || export SETUPTOOLS_SCM_PRETEND_VERSION="g$GITHUB_SHA"
 
 $PIP install --upgrade coverage coveralls git+https://github.com/fmaussion/salem.git
+$PIP install --upgrade "zarr<3"
 $PIP install -e .
 
 export COVERAGE_RCFILE="$PWD/.coveragerc"
@@ -287,6 +287,10 @@ _doc = ('A netcdf file containing the model diagnostics (volume, '
         'mass-balance, length...).')
 BASENAMES['model_diagnostics'] = ('model_diagnostics.nc', _doc)
 
+_doc = ('The state of an unfinished model run, written regularly so that the '
+        'run can be resumed if interrupted.')
+BASENAMES['model_checkpoint'] = ('model_checkpoint.pkl', _doc)
+
 _doc = "A table containing the Huss&Farinotti 2012 squeezed flowlines."
 BASENAMES['elevation_band_flowline'] = ('elevation_band_flowline.csv', _doc)
 
@@ -454,6 +458,9 @@ def initialize_minimal(file=None, logging_level='INFO', params=None):
         log.workflow('Multiprocessing: using the requested number of '
                      'processors (N={})'.format(mpp))
     PARAMS['mp_processes'] = mpp
+    PARAMS['mp_scheduling'] = cp['mp_scheduling']
+    PARAMS['mp_threads'] = cp.as_int('mp_threads')
+    PARAMS['mp_shared_inputs'] = cp.as_bool('mp_shared_inputs')
 
     # Size of LRU cache
     try:
@@ -463,6 +470,8 @@ def initialize_minimal(file=None, logging_level='INFO', params=None):
     except KeyError:
         lru_maxsize = cp.as_int('lru_maxsize')
     PARAMS['lru_maxsize'] = lru_maxsize
+    PARAMS['use_grid_cell_cache'] = cp.as_bool('use_grid_cell_cache')
+    PARAMS['use_point_series_store'] = cp.as_bool('use_point_series_store')
 
     # Some non-trivial params
     PARAMS['continue_on_error'] = cp.as_bool('continue_on_error')
@@ -472,6 +481,7 @@ def initialize_minimal(file=None, logging_level='INFO', params=None):
     PARAMS['use_compression'] = cp.as_bool('use_compression')
     PARAMS['border'] = cp.as_int('border')
     PARAMS['mpi_recv_buf_size'] = cp.as_int('mpi_recv_buf_size')
+    PARAMS['mpi_chunksize'] = cp.as_int('mpi_chunksize')
     PARAMS['use_multiple_flowlines'] = cp.as_bool('use_multiple_flowlines')
     PARAMS['filter_min_slope'] = cp.as_bool('filter_min_slope')
     PARAMS['auto_skip_task'] = cp.as_bool('auto_skip_task')
@@ -516,6 +526,11 @@ def initialize_minimal(file=None, logging_level='INFO', params=None):
     # Flowline model
     k = 'use_shape_factor_for_fluxbasedmodel'
     PARAMS[k] = cp[k]
+    PARAMS['flowline_kernel'] = cp['flowline_kernel']
+    PARAMS['flowline_time_stepping'] = cp['flowline_time_stepping']
+    PARAMS['ela_diagnostic'] = cp['ela_diagnostic']
+    PARAMS['output_format'] = cp['output_format']
+    PARAMS['run_output_container'] = cp.as_bool('run_output_container')
 
     # Delete non-floats
     ltr = ['working_dir', 'dem_file', 'climate_file', 'use_tar_shapefiles',
@@ -533,7 +548,11 @@ def initialize_minimal(file=None, logging_level='INFO', params=None):
            'use_shape_factor_for_fluxbasedmodel', 'baseline_climate',
            'calving_line_extension', 'use_kcalving_for_run', 'lru_maxsize',
            'free_board_marine_terminating', 'use_kcalving_for_inversion',
-           'error_when_glacier_reaches_boundaries']
+           'error_when_glacier_reaches_boundaries', 'flowline_kernel',
+           'ela_diagnostic', 'flowline_time_stepping', 'mp_scheduling',
+           'mp_shared_inputs', 'mpi_chunksize', 'mp_threads',
+           'output_format', 'run_output_container', 'use_grid_cell_cache',
+           'use_point_series_store']
     for k in ltr:
         cp.pop(k, None)
 
@@ -766,12 +785,32 @@ def reset_working_dir():
         os.makedirs(PATHS['working_dir'])
 
 
-def pack_config():
-    """Pack the entire configuration in one pickleable dict."""
+def pack_config(shared_dir=None):
+    """Pack the entire configuration in one pickleable dict.
+
+    Parameters
+    ----------
+    shared_dir : str, optional
+        if set, the large read-only data of the configuration (currently:
+        all DataFrames in PARAMS, e.g. the intersects and the reference t*)
+        are written to memory-mapped files in this directory (see
+        :py:class:`oggm.utils.SharedDataFrame`). The processes unpacking
+        the config then share the same memory instead of holding a copy.
+    """
+
+    params = PARAMS
+    if shared_dir is not None:
+        from oggm.utils import SharedDataFrame
+        params = ParamsLoggingDict()
+        for k, v in PARAMS.items():
+            if isinstance(v, pd.DataFrame) and len(v) > 0:
+                v = SharedDataFrame(v, os.path.join(shared_dir, k))
+            # Bypass the config modified check
+            OrderedDict.__setitem__(params, k, v)
 
     return {
         'IS_INITIALIZED': IS_INITIALIZED,
-        'PARAMS': PARAMS,
+        'PARAMS': params,
         'PATHS': PATHS,
         'LRUHANDLERS': LRUHANDLERS,
         'DATA': DATA,
@@ -929,6 +929,8 @@ def local_t_star(gdir, *, ref_df=None, tstar=None, bias=None):
                                'might have to run the calibration manually.')
                         raise MassBalanceCalibrationError(msg)
                 ref_df = cfg.PARAMS['oggm_ref_tstars_rgi{}_{}'.format(v, s)]
+                if isinstance(ref_df, utils.SharedDataFrame):
+                    ref_df = ref_df.to_dataframe()
             else:
                 # Use the the local calibration
                 fp = os.path.join(cfg.PATHS['working_dir'], 'ref_tstars.csv')
@@ -10,17 +10,29 @@ from functools import partial
 from time import gmtime, strftime
 import os
 import shutil
+import gzip
+import pickle
+import numbers
 
 # External libs
 import numpy as np
 import shapely.geometry as shpg
 import xarray as xr
+from scipy.linalg import solve_banded
 
 # Optional libs
 try:
     import salem
 except ImportError:
     pass
+try:
+    import numba
+except ImportError:
+    numba = None
+try:
+    import zarr
+except ImportError:
+    zarr = None
 
 # Locals
 from oggm import __version__
@@ -28,7 +40,8 @@ import oggm.cfg as cfg
 from oggm import utils
 from oggm import entity_task
 from oggm.exceptions import InvalidParamsError, InvalidWorkflowError
-from oggm.core.massbalance import (MultipleFlowlineMassBalance,
+from oggm.core.massbalance import (MassBalanceModel,
+                                   MultipleFlowlineMassBalance,
                                    ConstantMassBalance,
                                    PastMassBalance,
                                    RandomMassBalance)
@@ -496,7 +509,7 @@ class FlowlineModel(object):
                  fs=None, inplace=False, smooth_trib_influx=True,
                  is_tidewater=False, is_lake_terminating=False,
                  mb_elev_feedback='annual', check_for_boundaries=None,
-                 water_level=None):
+                 water_level=None, time_stepping=None):
         """Create a new flowline model from the flowlines and a MB model.
 
         Parameters
@@ -532,6 +545,14 @@ class FlowlineModel(object):
             whether the model should raise an error when the glacier exceeds
             the domain boundaries. The default is to follow
             PARAMS['error_when_glacier_reaches_boundaries']
+        time_stepping : str
+            'monthly': the numerical solver lands on every month boundary.
+            'events': it lands only on the dates where something changes
+            (MB updates, flux gate changes and output times), and the
+            adaptive time step is free in between. This is faster for slow
+            glaciers, but the results then depend (slightly) on the output
+            frequency. The default is to follow
+            PARAMS['flowline_time_stepping']
         """
 
         self.is_tidewater = is_tidewater
@@ -574,6 +595,14 @@ class FlowlineModel(object):
                                                'boundaries')]
         self.check_for_boundaries = check_for_boundaries
 
+        if time_stepping is None:
+            time_stepping = cfg.PARAMS['flowline_time_stepping']
+        if time_stepping not in ['monthly', 'events']:
+            raise InvalidParamsError('time_stepping should be one of '
+                                     '`monthly` or `events`, got: '
+                                     '{}'.format(time_stepping))
+        self.time_stepping = time_stepping
+
         # we keep glen_a as input, but for optimisation we stick to "fd"
         self._fd = 2. / (cfg.PARAMS['glen_n']+2) * self.glen_a
 
@@ -767,6 +796,24 @@ class FlowlineModel(object):
         finally:
             ds.close()
 
+    def to_zarr(self, path):
+        """Same as :py:meth:`to_netcdf`, but as a Zarr directory store."""
+
+        flows_to_id = []
+        for trib in self._tributary_indices:
+            flows_to_id.append(trib[0] if trib[0] is not None else -1)
+
+        ds = xr.Dataset()
+        ds.attrs['description'] = 'OGGM model output'
+        ds.attrs['oggm_version'] = __version__
+        ds.attrs['calendar'] = '365-day no leap'
+        ds.attrs['creation_date'] = strftime("%Y-%m-%d %H:%M:%S", gmtime())
+        ds['flowlines'] = ('flowlines', np.arange(len(flows_to_id)))
+        ds['flows_to_id'] = ('flowlines', flows_to_id)
+        ds.to_zarr(path, mode='w')
+        for i, fl in enumerate(self.fls):
+            fl.to_dataset().to_zarr(path, mode='a', group='fl_{}'.format(i))
+
     def check_domain_end(self):
         """Returns False if the glacier reaches the domains bound."""
         return np.isclose(self.fls[-1].thick[-1], 0)
@@ -795,6 +842,39 @@ class FlowlineModel(object):
         """
         raise NotImplementedError
 
+    def get_step_boundaries(self, y1, y0=None):
+        """The dates the numerical solver has to land on until y1.
+
+        Per default (``time_stepping='monthly'``) we force timesteps to
+        monthly frequencies for consistent results among use cases (monthly
+        or yearly output) and also to prevent "too large" steps in the
+        adaptive scheme. With ``time_stepping='events'``, only the dates
+        where the MB is updated are forced.
+
+        Parameters
+        ----------
+        y1 : float
+            the end date
+        y0 : float
+            the start date (default: the current model date)
+
+        Returns
+        -------
+        an array of dates (floating years), ending with y1
+        """
+
+        if y0 is None:
+            y0 = self.yr
+
+        if self.time_stepping == 'monthly' or self.mb_step == 'monthly':
+            ts = utils.monthly_timeseries(y0, y1)
+        else:
+            # The annual MB changes at the start of each year only
+            ts = np.arange(np.floor(y0) + 1, y1)
+
+        # Add the last date to be sure we end on it
+        return np.append(ts, y1)
+
     def run_until(self, y1):
         """Runs the model from the current year up to a given year date y1.
 
@@ -808,13 +888,8 @@ class FlowlineModel(object):
             Upper time span for how long the model should run
         """
 
-        # We force timesteps to monthly frequencies for consistent results
-        # among use cases (monthly or yearly output) and also to prevent
-        # "too large" steps in the adaptive scheme.
-        ts = utils.monthly_timeseries(self.yr, y1)
-
-        # Add the last date to be sure we end on it
-        ts = np.append(ts, y1)
+        # The dates where the steps have to land
+        ts = self.get_step_boundaries(y1)
 
         # Loop over the steps we want to meet
         for y in ts:
@@ -836,8 +911,89 @@ class FlowlineModel(object):
                     raise FloatingPointError('NaN in numerical solution, '
                                              'at year: {}'.format(self.yr))
 
+    def save_checkpoint(self, path, **kwargs):
+        """Write the full model state to a file, to restart a run later.
+
+        The state includes the flowlines (sections, calving buckets...), the
+        model time, the calving and flux gate counters, the mass-balance
+        model (incl. its random generators) and the cached mass-balance.
+        The file is replaced atomically, so that it is always a valid
+        checkpoint even if the program is killed while writing.
+
+        Parameters
+        ----------
+        path : str
+            path to the checkpoint file
+        **kwargs :
+            any other (picklable) variable to store along with the model
+            state, e.g. the state of the run loop. They are returned by
+            :py:meth:`load_checkpoint`.
+        """
+        _open = gzip.open if cfg.PARAMS['use_compression'] else open
+        tmp_path = path + '.tmp'
+        with _open(tmp_path, 'wb') as f:
+            pickle.dump(dict(model_class=type(self).__name__,
+                             model_state=self.__dict__,
+                             extra=kwargs), f, protocol=-1)
+        os.replace(tmp_path, path)
+
+    def load_checkpoint(self, path, fingerprint=None):
+        """Restore the model state from a checkpoint file.
+
+        Parameters
+        ----------
+        path : str
+            path to the checkpoint file written by :py:meth:`save_checkpoint`
+        fingerprint : str
+            if given, the checkpoint must have been saved with this
+            ``fingerprint`` (see :py:meth:`checkpoint_fingerprint`), or an
+            InvalidWorkflowError is raised
+
+        Returns
+        -------
+        a dict with the other variables stored with the checkpoint
+        """
+        ckpt = _read_checkpoint(path)
+        if ckpt['model_class'] != type(self).__name__:
+            raise InvalidWorkflowError('The checkpoint was written by a {} '
+                                       'and cannot be used by a '
+                                       '{}.'.format(ckpt['model_class'],
+                                                    type(self).__name__))
+        if (fingerprint is not None and
+                ckpt['extra'].get('fingerprint') != fingerprint):
+            raise InvalidWorkflowError('The checkpoint {} was written by a '
+                                       'run with other arguments (model '
+                                       'parameters, mass-balance model, '
+                                       'initial state or end '
+                                       'year).'.format(path))
+        self.__dict__.update(ckpt['model_state'])
+        return ckpt['extra']
+
+    def checkpoint_fingerprint(self, *args):
+        """A key identifying a run started from the current model state.
+
+        It is computed from the model class, its parameters, its flowlines
+        and its mass-balance model (class and parameters), together with
+        the given arguments of the run (e.g. the end year). A checkpoint is
+        only resumed by a run with the same fingerprint.
+
+        Parameters
+        ----------
+        *args :
+            the arguments of the run
+
+        Returns
+        -------
+        the fingerprint (a str)
+        """
+        parts = _fingerprint_parts(self)
+        parts.append([_fingerprint_parts(fl) for fl in self.fls])
+        return utils.GridCellCache.make_key(parts, args)
+
     def run_until_and_store(self, y1, run_path=None, diag_path=None,
-                            store_monthly_step=None):
+                            store_monthly_step=None, ela_diagnostic=None,
+                            flush_interval=None, checkpoint_path=None,
+                            checkpoint_interval=None, output_format=None):
         """Runs the model and returns intermediate steps in xarray datasets.
 
         This function repeatedly calls FlowlineModel.run_until for either
@@ -856,6 +1012,33 @@ class FlowlineModel(object):
             If True (False)  model diagnostics will be stored monthly (yearly).
             If unspecified, we follow the update of the MB model, which
             defaults to yearly (see __init__).
+        ela_diagnostic : str
+            how to compute the ELA diagnostic: 'exact' (root finding with
+            the MB model), 'interpolated' (linear interpolation of the
+            annual MB along the main flowline, NaN if the MB does not change
+            sign on the flowline) or 'off' (NaN). Defaults to
+            cfg.PARAMS['ela_diagnostic'].
+        flush_interval : int
+            if > 0 and ``run_path`` is given, the output is streamed to disk
+            while the model runs: at most ``flush_interval`` output time steps
+            are kept in memory before being appended to ``run_path`` (and
+            ``diag_path``) along an unlimited time dimension. The files have
+            the same content as when written at the end of the run. Defaults
+            to cfg.PARAMS['run_output_flush_interval'].
+        checkpoint_path : str
+            path to a checkpoint file. If the file exists, the run is resumed
+            from it (the output files of the interrupted run must still be
+            there). The file is removed at the end of the run.
+        checkpoint_interval : float
+            if > 0 and ``checkpoint_path`` is given, the state of the model
+            and of the output is written to ``checkpoint_path`` every
+            ``checkpoint_interval`` years of model time. Defaults to
+            cfg.PARAMS['model_checkpoint_interval'].
+        output_format : str
+            'netcdf' or 'zarr': with 'zarr', ``run_path`` and ``diag_path``
+            are written as Zarr directory stores (with the same groups and
+            variables as the netCDF files). Defaults to
+            cfg.PARAMS['output_format'].
 
         Returns
         -------
@@ -863,12 +1046,72 @@ class FlowlineModel(object):
             stores the entire glacier geometry. It is useful to visualize the
             glacier geometry or to restart a new run from a modelled geometry.
             The glacier state is stored at the begining of each hydrological
-            year (not in between in order to spare disk space).
+            year (not in between in order to spare disk space). None if the
+            output was streamed to ``run_path``.
         diag_ds : xarray.Dataset
             stores a few diagnostic variables such as the volume, area, length
             and ELA of the glacier.
         """
 
+        if checkpoint_interval is None:
+            checkpoint_interval = cfg.PARAMS['model_checkpoint_interval']
+
+        fingerprint = None
+        if checkpoint_path is not None:
+            fingerprint = self.checkpoint_fingerprint('run_until_and_store',
+                                                      y1, store_monthly_step)
+        if checkpoint_path is not None and os.path.exists(checkpoint_path):
+            out = self.load_checkpoint(checkpoint_path,
+                                       fingerprint=fingerprint)['run_output']
+            if out['monthly_time'][-1] != y1:
+                raise InvalidWorkflowError('The checkpoint {} is not for a '
+                                           'run until year '
+                                           '{}.'.format(checkpoint_path, y1))
+        else:
+            out = self._init_run_output(y1, run_path=run_path,
+                                        diag_path=diag_path,
+                                        store_monthly_step=store_monthly_step,
+                                        ela_diagnostic=ela_diagnostic,
+                                        flush_interval=flush_interval,
+                                        output_format=output_format)
+
+        # Run
+        nm = len(out['monthly_time'])
+        last_checkpoint = self.yr
+        for i in range(out['i'], nm):
+            self.run_until(out['monthly_time'][i])
+            self._store_run_output(out, i)
+            if (checkpoint_path is not None and checkpoint_interval > 0 and
+                    i < nm - 1 and
+                    self.yr - last_checkpoint >= checkpoint_interval):
+                if out['stream'] and out['i0'] < i + 1:
+                    # The files need to be consistent with the checkpoint
+                    self._flush_run_output(out, i + 1)
+                out['i'] = i + 1
+                self.save_checkpoint(checkpoint_path, run_output=out,
+                                     fingerprint=fingerprint)
+                last_checkpoint = self.yr
+
+        res = self._write_run_output(out, run_path=run_path,
+                                     diag_path=diag_path)
+        if checkpoint_path is not None and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        return res
+
+    def _init_run_output(self, y1, run_path=None, diag_path=None,
+                         store_monthly_step=None, ela_diagnostic=None,
+                         flush_interval=None, output_format=None):
+        """Prepare the containers used by run_until_and_store.
+
+        This is split from the run loop so that other drivers (e.g. the
+        BatchedFluxBasedModel) can reuse the same output logic.
+
+        Returns
+        -------
+        a dict with the time axes and the output containers, to be passed
+        to :py:meth:`_store_run_output` and :py:meth:`_write_run_output`.
+        """
+
         if int(y1) != y1:
             raise InvalidParamsError('run_until_and_store only accepts '
                                      'integer year dates.')
@@ -877,6 +1120,20 @@ class FlowlineModel(object):
             raise InvalidParamsError('run_until_and_store needs a '
                                      'mass-balance model with an unambiguous '
                                      'hemisphere.')
+
+        if ela_diagnostic is None:
+            ela_diagnostic = cfg.PARAMS['ela_diagnostic']
+        if ela_diagnostic not in ['exact', 'interpolated', 'off']:
+            raise InvalidParamsError('ela_diagnostic not understood: '
+                                     '{}'.format(ela_diagnostic))
+
+        if flush_interval is None:
+            flush_interval = cfg.PARAMS['run_output_flush_interval']
+        flush_interval = int(flush_interval)
+        stream = flush_interval > 0 and run_path is not None
+
+        output_format = utils.get_output_format(output_format)
+
         # time
         yearly_time = np.arange(np.floor(self.yr), np.floor(y1)+1)
 
@@ -895,7 +1152,9 @@ class FlowlineModel(object):
                                                         start_month=sm)
 
         # init output
-        if run_path is not None:
+        if run_path is not None and output_format == 'zarr':
+            self.to_zarr(run_path)
+        elif run_path is not None:
             self.to_netcdf(run_path)
         ny = len(yearly_time)
         if ny == 1:
@@ -904,9 +1163,11 @@ class FlowlineModel(object):
             months = [months]
             cmonths = [cmonths]
         nm = len(monthly_time)
-        sects = [(np.zeros((ny, fl.nx)) * np.NaN) for fl in self.fls]
-        widths = [(np.zeros((ny, fl.nx)) * np.NaN) for fl in self.fls]
-        bucket = [(np.zeros(ny) * np.NaN) for _ in self.fls]
+        # When streaming, the geometry is buffered until the next flush
+        nb = min(ny, flush_interval) if stream else ny
+        sects = [(np.zeros((nb, fl.nx)) * np.NaN) for fl in self.fls]
+        widths = [(np.zeros((nb, fl.nx)) * np.NaN) for fl in self.fls]
+        bucket = [(np.zeros(nb) * np.NaN) for _ in self.fls]
         diag_ds = xr.Dataset()
 
         # Global attributes
@@ -966,25 +1227,39 @@ class FlowlineModel(object):
             diag_ds['calving_rate_myr'].attrs['description'] = 'Calving rate'
             diag_ds['calving_rate_myr'].attrs['unit'] = 'm yr-1'
 
-        # Run
-        j = 0
-        for i, (yr, mo) in enumerate(zip(monthly_time, months)):
-            self.run_until(yr)
-            # Model run
-            if mo == 1:
-                for s, w, b, fl in zip(sects, widths, bucket, self.fls):
-                    s[j, :] = fl.section
-                    w[j, :] = fl.widths_m
-                    if self.is_tidewater:
-                        try:
-                            b[j] = fl.calving_bucket_m3
-                        except AttributeError:
-                            pass
-                j += 1
-            # Diagnostics
-            diag_ds['volume_m3'].data[i] = self.volume_m3
-            diag_ds['area_m2'].data[i] = self.area_m2
-            diag_ds['length_m'].data[i] = self.length_m
+        return dict(yearly_time=yearly_time, monthly_time=monthly_time,
+                    months=months, sects=sects, widths=widths, bucket=bucket,
+                    diag_ds=diag_ds, j=0, ela_diagnostic=ela_diagnostic,
+                    ela_yr=None, ela_m=np.NaN, stream=stream,
+                    flush_interval=flush_interval, run_path=run_path,
+                    diag_path=diag_path, output_format=output_format,
+                    i=0, i0=0, j0=0)
+
+    def _store_run_output(self, out, i):
+        """Store the current model state at the i-th output time step."""
+
+        yr = out['monthly_time'][i]
+        diag_ds = out['diag_ds']
+
+        # Model run
+        if out['months'][i] == 1:
+            j = out['j']
+            for s, w, b, fl in zip(out['sects'], out['widths'],
+                                   out['bucket'], self.fls):
+                s[j, :] = fl.section
+                w[j, :] = fl.widths_m
+                if self.is_tidewater:
+                    try:
+                        b[j] = fl.calving_bucket_m3
+                    except AttributeError:
+                        pass
+            out['j'] = j + 1
+
+        # Diagnostics
+        diag_ds['volume_m3'].data[i] = self.volume_m3
+        diag_ds['area_m2'].data[i] = self.area_m2
+        diag_ds['length_m'].data[i] = self.length_m
+        if out['ela_diagnostic'] == 'exact':
             try:
                 ela_m = self.mb_model.get_ela(year=yr, fls=self.fls,
                                               fl_id=len(self.fls)-1)
@@ -992,17 +1267,48 @@ class FlowlineModel(object):
             except BaseException:
                 # We really don't want to stop the model for some ELA issues
                 diag_ds['ela_m'].data[i] = np.NaN
+        elif out['ela_diagnostic'] == 'interpolated':
+            # The annual MB is the same for all months of the year
+            if out['ela_yr'] != np.floor(yr):
+                out['ela_yr'] = np.floor(yr)
+                out['ela_m'] = self._get_interpolated_ela(yr)
+            diag_ds['ela_m'].data[i] = out['ela_m']
 
-            if self.is_tidewater:
-                diag_ds['calving_m3'].data[i] = self.calving_m3_since_y0
-                diag_ds['calving_rate_myr'].data[i] = self.calving_rate_myr
-                if self.is_marine_terminating:
-                    diag_ds['volume_bsl_m3'].data[i] = self.volume_bsl_m3
-                    diag_ds['volume_bwl_m3'].data[i] = self.volume_bwl_m3
+        if self.is_tidewater:
+            diag_ds['calving_m3'].data[i] = self.calving_m3_since_y0
+            diag_ds['calving_rate_myr'].data[i] = self.calving_rate_myr
+            if self.is_marine_terminating:
+                diag_ds['volume_bsl_m3'].data[i] = self.volume_bsl_m3
+                diag_ds['volume_bwl_m3'].data[i] = self.volume_bwl_m3
 
-        # to datasets
+        if out['stream'] and (i + 1 - out['i0']) >= out['flush_interval']:
+            self._flush_run_output(out, i + 1)
+
+    def _get_interpolated_ela(self, year):
+        """ELA from the annual MB on the main flowline at this year.
+
+        If the model uses the annual MB anyway, the MB is computed through
+        the model cache so that the next model step can reuse it.
+        """
+
+        fl_id = len(self.fls) - 1
+        fl = self.fls[fl_id]
+        if self.mb_step == 'annual':
+            heights = self._mb_current_heights.get(fl_id, fl.surface_h)
+            mb = self.get_mb(fl.surface_h, year=year, fl_id=fl_id,
+                             fls=self.fls)
+        else:
+            heights = fl.surface_h
+            mb = self.mb_model.get_annual_mb(heights, year=year, fl_id=fl_id,
+                                             fls=self.fls)
+        return _interpolate_ela(heights, mb)
+
+    def _get_run_datasets(self, out, yearly_time):
+        """Geometry datasets from the first rows of the output containers."""
+
+        n = len(yearly_time)
         run_ds = []
-        for (s, w, b) in zip(sects, widths, bucket):
+        for (s, w, b) in zip(out['sects'], out['widths'], out['bucket']):
             ds = xr.Dataset()
             ds.attrs['description'] = 'OGGM model output'
             ds.attrs['oggm_version'] = __version__
@@ -1013,16 +1319,96 @@ class FlowlineModel(object):
             ds['time'].attrs['description'] = 'Floating hydrological year'
             varcoords = OrderedDict(time=('time', yearly_time),
                                     year=('time', yearly_time))
-            ds['ts_section'] = xr.DataArray(s, dims=('time', 'x'),
+            ds['ts_section'] = xr.DataArray(s[:n], dims=('time', 'x'),
                                             coords=varcoords)
-            ds['ts_width_m'] = xr.DataArray(w, dims=('time', 'x'),
+            ds['ts_width_m'] = xr.DataArray(w[:n], dims=('time', 'x'),
                                             coords=varcoords)
             if self.is_tidewater:
-                ds['ts_calving_bucket_m3'] = xr.DataArray(b, dims=('time', ),
+                ds['ts_calving_bucket_m3'] = xr.DataArray(b[:n],
+                                                          dims=('time', ),
                                                           coords=varcoords)
             run_ds.append(ds)
+        return run_ds
+
+    def _flush_run_output(self, out, i1, final=False):
+        """Append the buffered output up to the i1-th time step to disk."""
+
+        run_path = out['run_path']
+        diag_path = out['diag_path']
+        i0, j0, nj = out['i0'], out['j0'], out['j']
+        first = i0 == 0
+
+        # Years never stored (e.g. when starting during the year) are NaN
+        j1 = len(out['yearly_time']) if final else j0 + nj
+        if j1 - j0 > nj:
+            for k, fl in enumerate(self.fls):
+                pad = np.zeros((j1 - j0 - nj, fl.nx)) * np.NaN
+                out['sects'][k] = np.concatenate([out['sects'][k][:nj], pad])
+                out['widths'][k] = np.concatenate([out['widths'][k][:nj],
+                                                   pad])
+                out['bucket'][k] = np.append(out['bucket'][k][:nj], pad[:, 0])
+
+        run_ds = self._get_run_datasets(out, out['yearly_time'][j0:j1])
+        diag_ds = out['diag_ds'].isel(time=slice(i0, i1))
+
+        zarr_format = out.get('output_format') == 'zarr'
+        if first and zarr_format:
+            for k, ds in enumerate(run_ds):
+                _update_zarr(run_path, ds, group='fl_{}'.format(k))
+            _update_zarr(run_path, diag_ds)
+            if diag_path is not None:
+                diag_ds.to_zarr(diag_path, mode='w')
+        elif first:
+            encode = {'ts_section': {'zlib': True, 'complevel': 5},
+                      'ts_width_m': {'zlib': True, 'complevel': 5},
+                      }
+            for k, ds in enumerate(run_ds):
+                ds.to_netcdf(run_path, 'a', group='fl_{}'.format(k),
+                             encoding=encode, unlimited_dims=['time'])
+            diag_ds.to_netcdf(run_path, 'a', unlimited_dims=['time'])
+            if diag_path is not None:
+                diag_ds.to_netcdf(diag_path, unlimited_dims=['time'])
+        else:
+            append = _append_to_zarr if zarr_format else _append_to_netcdf
+            dss = OrderedDict(('fl_{}'.format(k), (ds, j0))
+                              for k, ds in enumerate(run_ds))
+            dss[None] = (diag_ds, i0)
+            append(run_path, dss)
+            if diag_path is not None:
+                append(diag_path, {None: (diag_ds, i0)})
+
+        # Reset the buffers
+        for s, w, b in zip(out['sects'], out['widths'], out['bucket']):
+            s[:] = np.NaN
+            w[:] = np.NaN
+            b[:] = np.NaN
+        out['i0'] = i1
+        out['j0'] = j1
+        out['j'] = 0
+
+    def _write_run_output(self, out, run_path=None, diag_path=None):
+        """Make the output datasets and write them to disk if asked to."""
+
+        diag_ds = out['diag_ds']
+
+        if out['stream']:
+            # Everything else is on disk already
+            self._flush_run_output(out, len(out['monthly_time']), final=True)
+            return None, diag_ds
+
+        # to datasets
+        run_ds = self._get_run_datasets(out, out['yearly_time'])
 
         # write output?
+        if out.get('output_format') == 'zarr':
+            if run_path is not None:
+                for i, ds in enumerate(run_ds):
+                    _update_zarr(run_path, ds, group='fl_{}'.format(i))
+                _update_zarr(run_path, diag_ds)
+            if diag_path is not None:
+                diag_ds.to_zarr(diag_path, mode='w')
+            return run_ds, diag_ds
+
         if run_path is not None:
             encode = {'ts_section': {'zlib': True, 'complevel': 5},
                       'ts_width_m': {'zlib': True, 'complevel': 5},
@@ -1038,18 +1424,35 @@ class FlowlineModel(object):
 
         return run_ds, diag_ds
 
-    def run_until_equilibrium(self, rate=0.001, ystep=5, max_ite=200):
+    def run_until_equilibrium(self, rate=0.001, ystep=5, max_ite=200,
+                              checkpoint_path=None, checkpoint_interval=None):
         """ Runs the model until an equilibrium state is reached.
 
         Be careful: This only works for CONSTANT (not time-dependant)
         mass-balance models.
         Otherwise the returned state will not be in equilibrium! Don't try to
         calculate an equilibrium state with a RandomMassBalance model!
+
+        See :py:meth:`run_until_and_store` for the ``checkpoint_path`` and
+        ``checkpoint_interval`` arguments.
         """
 
+        if checkpoint_interval is None:
+            checkpoint_interval = cfg.PARAMS['model_checkpoint_interval']
+
         ite = 0
         was_close_zero = 0
         t_rate = 1
+        fingerprint = None
+        if checkpoint_path is not None:
+            fingerprint = self.checkpoint_fingerprint('run_until_equilibrium',
+                                                      rate, ystep, max_ite)
+        if checkpoint_path is not None and os.path.exists(checkpoint_path):
+            extra = self.load_checkpoint(checkpoint_path,
+                                         fingerprint=fingerprint)
+            ite, was_close_zero, t_rate = extra['equilibrium_loop']
+
+        last_checkpoint = self.yr
         while (t_rate > rate) and (ite <= max_ite) and (was_close_zero < 5):
             ite += 1
             v_bef = self.volume_m3
@@ -1060,10 +1463,249 @@ class FlowlineModel(object):
                 was_close_zero += 1
             else:
                 t_rate = np.abs(v_af - v_bef) / v_bef
+            if (checkpoint_path is not None and checkpoint_interval > 0 and
+                    self.yr - last_checkpoint >= checkpoint_interval):
+                self.save_checkpoint(checkpoint_path,
+                                     equilibrium_loop=(ite, was_close_zero,
+                                                       t_rate),
+                                     fingerprint=fingerprint)
+                last_checkpoint = self.yr
+
+        if checkpoint_path is not None and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
         if ite > max_ite:
             raise RuntimeError('Did not find equilibrium.')
 
 
+def _stag_flux_kernel(surface_h, thick, section, sf_stag, is_trib, sh_trib,
+                      dx, fd, fs, glen_n, rhog, slope_stag, thick_stag,
+                      section_stag, u_stag, flux_stag):
+    """Staggered slope, thickness, velocity and flux in a single pass.
+
+    This is the loop version of the numpy code in
+    :py:meth:`FluxBasedModel.step`, to be compiled with numba. The staggered
+    arrays are updated in place. For tributaries, ``sh_trib`` is the surface
+    elevation of the additional grid point in the downstream branch.
+
+    Returns
+    -------
+    the maximum absolute staggered velocity (for the CFL criterion)
+    """
+
+    nx = surface_h.shape[0]
+    ns = slope_stag.shape[0]
+    maxu = 0.
+    for i in range(ns):
+        if i == 0:
+            slope = 0.
+            th = thick[0]
+            se = section[0]
+        elif i < nx:
+            slope = (surface_h[i-1] - surface_h[i]) / dx
+            th = (thick[i-1] + thick[i]) / 2.
+            se = (section[i-1] + section[i]) / 2.
+        elif is_trib and i == nx:
+            slope = (surface_h[nx-1] - sh_trib) / dx
+            th = thick[nx-1]
+            se = section[nx-1]
+        else:
+            slope = slope_stag[i-1]
+            th = thick[nx-1]
+            se = section[nx-1]
+
+        rhogh = (rhog * slope)**glen_n
+        u = ((th**(glen_n+1)) * fd * rhogh * sf_stag[i]**glen_n +
+             (th**(glen_n-1)) * fs * rhogh)
+
+        slope_stag[i] = slope
+        thick_stag[i] = th
+        section_stag[i] = se
+        u_stag[i] = u
+        flux_stag[i] = u * se
+        if abs(u) > maxu:
+            maxu = abs(u)
+    return maxu
+
+
+def _section_update_kernel(section, flux_stag, trib_flux, mb, widths, dt,
+                           dx, out):
+    """Mass transport and mass-balance for one flowline, in a single pass.
+
+    This is the loop version of the numpy code in
+    :py:meth:`FluxBasedModel.step`, to be compiled with numba. The new
+    (positive) section is written to ``out``.
+    """
+
+    for i in range(section.shape[0]):
+        w = widths[i]
+        # Allow parabolic beds to grow
+        if mb[i] > 0. and w == 0:
+            w = 10.
+        new_section = (section[i] + (flux_stag[i] - flux_stag[i+1])*dt/dx +
+                       trib_flux[i]*dt/dx + dt * mb[i] * w)
+        out[i] = new_section if new_section > 0 else 0.
+
+
+_numba_kernels = None
+
+
+def _get_numba_kernels():
+    """Compile the flowline kernels with numba (only once)."""
+    global _numba_kernels
+    if _numba_kernels is None:
+        if numba is None:
+            raise ImportError("cfg.PARAMS['flowline_kernel'] = 'numba' "
+                              "needs numba to be installed.")
+        jit = numba.njit(cache=True, nogil=True)
+        _numba_kernels = (jit(_stag_flux_kernel),
+                          jit(_section_update_kernel))
+    return _numba_kernels
+
+
+def _read_checkpoint(path):
+    """Read a checkpoint file written by FlowlineModel.save_checkpoint."""
+    _open = gzip.open if cfg.PARAMS['use_compression'] else open
+    with _open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def _fingerprint_parts(obj):
+    """The class and simple attributes of an object, to identify a run.
+
+    Numbers, strings and arrays are used as they are, mass-balance models
+    (and lists of them) recursively. Anything else (flowlines, random
+    generators, glacier directories...) is ignored.
+    """
+
+    parts = [type(obj).__name__]
+    for k, v in sorted(vars(obj).items()):
+        if isinstance(v, (numbers.Number, str, np.ndarray)) or v is None:
+            parts.append((k, v))
+        elif isinstance(v, MassBalanceModel):
+            parts.append((k, _fingerprint_parts(v)))
+        elif (isinstance(v, (list, tuple)) and len(v) > 0 and
+              all(isinstance(m, MassBalanceModel) for m in v)):
+            parts.append((k, [_fingerprint_parts(m) for m in v]))
+    return parts
+
+
+def _append_to_netcdf(path, dss, dim='time'):
+    """Append datasets to the variables of an existing netCDF file.
+
+    The datasets are written along ``dim``, which has to be an unlimited
+    dimension of the file. They are written at a given start index rather
+    than at the end of the file, so that a resumed run can overwrite what
+    has been written after its checkpoint.
+
+    Parameters
+    ----------
+    path : str
+        the file to append to
+    dss : dict
+        the (dataset, start index) tuples to write, keyed by group name
+        (None for the root group)
+    dim : str
+        the dimension to append along
+    """
+
+    with utils.ncDataset(path, 'a') as nc:
+        for group, (ds, n0) in dss.items():
+            grp = nc if group is None else nc.groups[group]
+            n = ds.dims[dim]
+            if n == 0:
+                continue
+            for k, v in ds.variables.items():
+                if dim not in v.dims:
+                    continue
+                grp.variables[k][n0:n0+n, ...] = v.values
+
+
+def _update_zarr(path, ds, group=None):
+    """Add the variables of a dataset to an existing Zarr store.
+
+    Unlike ``ds.to_zarr(path, mode='a')``, which replaces the attributes of
+    the group, the attributes already in the store are kept (and updated
+    with the ones of the dataset), like when writing to a netCDF file in
+    append mode.
+
+    Parameters
+    ----------
+    path : str
+        the store to write to
+    ds : :py:class:`xarray.Dataset`
+        the dataset to write
+    group : str
+        the group to write to (None for the root group)
+    """
+
+    root = zarr.open_group(path, mode='a')
+    if group is None or group in root:
+        grp = root if group is None else root[group]
+        attrs = dict(grp.attrs)
+        attrs.update(ds.attrs)
+        ds = ds.copy()
+        ds.attrs = attrs
+    ds.to_zarr(path, mode='a', group=group)
+
+
+def _append_to_zarr(path, dss, dim='time'):
+    """Append datasets to the variables of an existing Zarr store.
+
+    Same as :py:func:`_append_to_netcdf`, but the arrays are resized to
+    the end of the written datasets (anything written after them before
+    is discarded).
+
+    Parameters
+    ----------
+    path : str
+        the store to append to
+    dss : dict
+        the (dataset, start index) tuples to write, keyed by group name
+        (None for the root group)
+    dim : str
+        the dimension to append along
+    """
+
+    root = zarr.open_group(path, mode='a')
+    for group, (ds, n0) in dss.items():
+        grp = root if group is None else root[group]
+        n = ds.dims[dim]
+        if n == 0:
+            continue
+        for k, v in ds.variables.items():
+            if dim not in v.dims:
+                continue
+            arr = grp[k]
+            axis = v.dims.index(dim)
+            shape = list(arr.shape)
+            shape[axis] = n0 + n
+            arr.resize(*shape)
+            slices = [slice(None)] * arr.ndim
+            slices[axis] = slice(n0, n0 + n)
+            arr[tuple(slices)] = v.values
+    zarr.consolidate_metadata(path)
+
+
+def _interpolate_ela(heights, mb):
+    """Lowest altitude where the MB profile crosses zero.
+
+    The ELA is linearly interpolated between the two points bracketing the
+    zero crossing, and is NaN if the MB does not change sign on the profile.
+    """
+
+    srt = np.argsort(heights, kind='stable')
+    heights = np.asarray(heights)[srt]
+    mb = np.asarray(mb)[srt]
+    pos = mb >= 0
+    if not np.all(np.isfinite(mb)) or not np.any(pos) or mb[0] > 0:
+        return np.NaN
+    k = np.argmax(pos)
+    if k == 0:
+        return heights[0]
+    h0, h1 = heights[k-1], heights[k]
+    return h0 + (h1 - h0) * mb[k-1] / (mb[k-1] - mb[k])
+
+
 def flux_gate_with_build_up(year, flux_value=None, flux_gate_yr=None):
     """Default scalar flux gate with build up period"""
     fac = 1 - (flux_gate_yr - year) / flux_gate_yr
@@ -1090,7 +1732,7 @@ class FluxBasedModel(FlowlineModel):
                  flux_gate=None, flux_gate_build_up=100,
                  do_kcalving=None, calving_k=None, calving_use_limiter=None,
                  calving_limiter_frac=None, water_level=None,
-                 **kwargs):
+                 kernel=None, **kwargs):
         """Instanciate the model.
 
         Parameters
@@ -1171,6 +1813,11 @@ class FluxBasedModel(FlowlineModel):
             The best way to set the water level for real glaciers is to use
             the same as used for the inversion (this is what
             `robust_model_run` does for you)
+        kernel : str
+            the implementation of the numerics: 'numpy' (the reference
+            implementation) or 'numba' (compiled loops, faster but needs
+            numba to be installed). Defaults to
+            cfg.PARAMS['flowline_kernel'].
         """
         super(FluxBasedModel, self).__init__(flowlines, mb_model=mb_model,
                                              y0=y0, glen_a=glen_a, fs=fs,
@@ -1186,6 +1833,17 @@ class FluxBasedModel(FlowlineModel):
         self.min_dt = min_dt
         self.cfl_number = cfl_number
 
+        # Numerical kernel
+        if kernel is None:
+            kernel = cfg.PARAMS['flowline_kernel']
+        if kernel not in ['numpy', 'numba']:
+            raise InvalidParamsError('kernel should be one of `numpy` or '
+                                     '`numba`, got: {}'.format(kernel))
+        if kernel == 'numba':
+            # Compile now rather than at the first step
+            _get_numba_kernels()
+        self.kernel = kernel
+
         # Do we want to use shape factors?
         self.sf_func = None
         use_sf = cfg.PARAMS.get('use_shape_factor_for_fluxbasedmodel')
@@ -1257,10 +1915,12 @@ class FluxBasedModel(FlowlineModel):
         self.shapefac_stag = []
         self.flux_stag = []
         self.trib_flux = []
+        self.new_section = []
         for fl, trib in zip(self.fls, self._tributary_indices):
             nx = fl.nx
             # This is not staggered
             self.trib_flux.append(np.zeros(nx))
+            self.new_section.append(np.zeros(nx))
             # We add an additional fake grid point at the end of tributaries
             if trib[0] is not None:
                 nx = fl.nx + 1
@@ -1272,6 +1932,19 @@ class FluxBasedModel(FlowlineModel):
             self.shapefac_stag.append(np.ones(nx+1))  # beware the ones!
             self.flux_stag.append(np.zeros(nx+1))
 
+    def get_step_boundaries(self, y1, y0=None):
+
+        ts = super(FluxBasedModel, self).get_step_boundaries(y1, y0=y0)
+        if self.time_stepping == 'events':
+            if y0 is None:
+                y0 = self.yr
+            # The default flux gate stops building up at a given year
+            for fg in self.flux_gate:
+                fg_yr = getattr(fg, 'keywords', {}).get('flux_gate_yr')
+                if fg_yr is not None and y0 < fg_yr < y1:
+                    ts = np.union1d(ts, [fg_yr])
+        return ts
+
     def step(self, dt):
         """Advance one step."""
 
@@ -1282,6 +1955,9 @@ class FluxBasedModel(FlowlineModel):
         # Simple container
         mbs = []
 
+        if self.kernel == 'numba':
+            stag_flux_kernel, section_update_kernel = _get_numba_kernels()
+
         # Loop over tributaries to determine the flux rate
         for fl_id, fl in enumerate(self.fls):
 
@@ -1305,13 +1981,7 @@ class FluxBasedModel(FlowlineModel):
             # If it is a tributary, we use the branch it flows into to compute
             # the slope of the last grid point
             is_trib = trib[0] is not None
-            if is_trib:
-                fl_to = self.fls[trib[0]]
-                ide = fl.flows_to_indice
-                surface_h = np.append(surface_h, fl_to.surface_h[ide])
-                thick = np.append(thick, thick[-1])
-                section = np.append(section, section[-1])
-            elif self.do_calving and self.calving_use_limiter:
+            if not is_trib and self.do_calving and self.calving_use_limiter:
                 # We lower the max possible ice deformation
                 # by clipping the surface slope here. It is completely
                 # arbitrary but reduces ice deformation at the calving front.
@@ -1322,15 +1992,6 @@ class FluxBasedModel(FlowlineModel):
                 # Note that 0 is arbitrary, it could be any value below SL
                 surface_h = utils.clip_min(surface_h, self.water_level)
 
-            # Staggered gradient
-            slope_stag[0] = 0
-            slope_stag[1:-1] = (surface_h[0:-1] - surface_h[1:]) / dx
-            slope_stag[-1] = slope_stag[-2]
-
-            # Staggered thick
-            thick_stag[1:-1] = (thick[0:-1] + thick[1:]) / 2.
-            thick_stag[[0, -1]] = thick[[0, -1]]
-
             if self.sf_func is not None:
                 # TODO: maybe compute new shape factors only every year?
                 sf = self.sf_func(fl.widths_m, fl.thick, fl.is_rectangular)
@@ -1340,19 +2001,48 @@ class FluxBasedModel(FlowlineModel):
                 sf_stag[1:-1] = (sf[0:-1] + sf[1:]) / 2.
                 sf_stag[[0, -1]] = sf[[0, -1]]
 
-            # Staggered velocity (Deformation + Sliding)
-            # _fd = 2/(N+2) * self.glen_a
-            N = self.glen_n
-            rhogh = (self.rho*G*slope_stag)**N
-            u_stag[:] = (thick_stag**(N+1)) * self._fd * rhogh * sf_stag**N + \
-                        (thick_stag**(N-1)) * self.fs * rhogh
-
-            # Staggered section
-            section_stag[1:-1] = (section[0:-1] + section[1:]) / 2.
-            section_stag[[0, -1]] = section[[0, -1]]
-
-            # Staggered flux rate
-            flux_stag[:] = u_stag * section_stag
+            if self.kernel == 'numba':
+                # Same as below but in one pass
+                sh_trib = np.NaN
+                if is_trib:
+                    sh_trib = self.fls[trib[0]].surface_h[fl.flows_to_indice]
+                maxu = stag_flux_kernel(surface_h, thick, section, sf_stag,
+                                        is_trib, sh_trib, dx, self._fd,
+                                        self.fs, self.glen_n, self.rho*G,
+                                        slope_stag, thick_stag, section_stag,
+                                        u_stag, flux_stag)
+            else:
+                if is_trib:
+                    fl_to = self.fls[trib[0]]
+                    ide = fl.flows_to_indice
+                    surface_h = np.append(surface_h, fl_to.surface_h[ide])
+                    thick = np.append(thick, thick[-1])
+                    section = np.append(section, section[-1])
+
+                # Staggered gradient
+                slope_stag[0] = 0
+                slope_stag[1:-1] = (surface_h[0:-1] - surface_h[1:]) / dx
+                slope_stag[-1] = slope_stag[-2]
+
+                # Staggered thick
+                thick_stag[1:-1] = (thick[0:-1] + thick[1:]) / 2.
+                thick_stag[[0, -1]] = thick[[0, -1]]
+
+                # Staggered velocity (Deformation + Sliding)
+                # _fd = 2/(N+2) * self.glen_a
+                N = self.glen_n
+                rhogh = (self.rho*G*slope_stag)**N
+                u_stag[:] = ((thick_stag**(N+1)) * self._fd * rhogh *
+                             sf_stag**N +
+                             (thick_stag**(N-1)) * self.fs * rhogh)
+
+                # Staggered section
+                section_stag[1:-1] = (section[0:-1] + section[1:]) / 2.
+                section_stag[[0, -1]] = section[[0, -1]]
+
+                # Staggered flux rate
+                flux_stag[:] = u_stag * section_stag
+                maxu = None
 
             # Add boundary condition
             if flux_gate is not None:
@@ -1360,7 +2050,8 @@ class FluxBasedModel(FlowlineModel):
 
             # CFL condition
             if not self.fixed_dt:
-                maxu = np.max(np.abs(u_stag))
+                if maxu is None:
+                    maxu = np.max(np.abs(u_stag))
                 if maxu > cfg.FLOAT_EPS:
                     cfl_dt = self.cfl_number * dx / maxu
                 else:
@@ -1408,15 +2099,25 @@ class FluxBasedModel(FlowlineModel):
             # Mass-balance
             widths = fl.widths_m
             mb = mbs[fl_id]
-            # Allow parabolic beds to grow
-            mb = dt * mb * np.where((mb > 0.) & (widths == 0), 10., widths)
 
-            # Update section with ice flow and mass balance
-            new_section = (fl.section + (flx_stag[0:-1] - flx_stag[1:])*dt/dx +
-                           trib_flux*dt/dx + mb)
+            if self.kernel == 'numba':
+                # Same as below but in one pass
+                new_section = self.new_section[fl_id]
+                section_update_kernel(fl.section, flx_stag, trib_flux, mb,
+                                      widths, dt, dx, new_section)
+                fl.section = new_section
+            else:
+                # Allow parabolic beds to grow
+                mb = dt * mb * np.where((mb > 0.) & (widths == 0), 10.,
+                                        widths)
 
-            # Keep positive values only and store
-            fl.section = utils.clip_min(new_section, 0)
+                # Update section with ice flow and mass balance
+                new_section = (fl.section +
+                               (flx_stag[0:-1] - flx_stag[1:])*dt/dx +
+                               trib_flux*dt/dx + mb)
+
+                # Keep positive values only and store
+                fl.section = utils.clip_min(new_section, 0)
 
             # If we use a flux-gate, store the total volume that came in
             self.flux_gate_m3_since_y0 += flx_stag[0] * dt
@@ -1577,6 +2278,669 @@ class MassConservationChecker(FluxBasedModel):
             self.total_mass += np.sum(mb * dx)
 
 
+class SemiImplicitModel(FluxBasedModel):
+    """A semi-implicit variant of the FluxBasedModel.
+
+    The ice flux is written as a (non-linear) diffusion of the surface
+    elevation. The flux is linearized around the current glacier state (with
+    respect to the surface slope) and the change of ice section is obtained
+    by solving a tridiagonal system for each flowline. The scheme is stable
+    for time steps much larger than the CFL criterion of the explicit solver
+    (a month or more), which makes it attractive for stiff, fast-flowing
+    glaciers.
+
+    Tributaries are solved first (the lines are sorted in order) and their
+    outflow (computed with the new state) is given as a source term to the
+    flowline they flow into.
+
+    This model works with all bed shapes, but k-calving is not implemented.
+    """
+
+    def __init__(self, flowlines, mb_model=None, y0=0., glen_a=None, fs=0.,
+                 inplace=False, max_dt=None, **kwargs):
+        """Instanciate the model.
+
+        Parameters
+        ----------
+        max_dt : float
+            the maximum time step (in seconds) of the solver. Defaults to
+            cfg.PARAMS['implicit_max_dt']. The time steps are also bounded
+            by the time stepping scheme of the model run (see
+            :py:meth:`FlowlineModel.get_step_boundaries`).
+        kwargs : dict
+            all other keyword arguments are passed to
+            :py:class:`FluxBasedModel`
+        """
+        super(SemiImplicitModel, self).__init__(flowlines, mb_model=mb_model,
+                                                y0=y0, glen_a=glen_a, fs=fs,
+                                                inplace=inplace, **kwargs)
+        if self.do_calving:
+            raise InvalidParamsError('The SemiImplicitModel does not '
+                                     'implement k-calving. Set '
+                                     '`do_kcalving` to False.')
+        if max_dt is None:
+            max_dt = cfg.PARAMS['implicit_max_dt']
+        if max_dt <= 0:
+            raise InvalidParamsError('max_dt needs to be strictly positive')
+        self.max_dt = max_dt
+
+    def step(self, dt):
+        """Advance one step."""
+
+        # Just a check to avoid useless computations
+        if dt <= 0:
+            raise InvalidParamsError('dt needs to be strictly positive')
+
+        dt = min(dt, self.max_dt)
+        if self.fixed_dt:
+            dt = min(dt, self.fixed_dt)
+
+        # We compute the MB before mass-redistribution occurs, as for
+        # the explicit scheme
+        mbs = []
+        for fl_id, fl in enumerate(self.fls):
+            self.trib_flux[fl_id][:] = 0
+            mbs.append(self.get_mb(fl.surface_h, self.yr,
+                                   fl_id=fl_id, fls=self.fls))
+
+        N = self.glen_n
+        rhog = (self.rho * G) ** N
+        for fl_id, fl in enumerate(self.fls):
+
+            trib = self._tributary_indices[fl_id]
+            slope_stag = self.slope_stag[fl_id]
+            thick_stag = self.thick_stag[fl_id]
+            section_stag = self.section_stag[fl_id]
+            sf_stag = self.shapefac_stag[fl_id]
+            flux_stag = self.flux_stag[fl_id]
+            trib_flux = self.trib_flux[fl_id]
+            u_stag = self.u_stag[fl_id]
+            flux_gate = self.flux_gate[fl_id]
+
+            # Flowline state
+            surface_h = fl.surface_h
+            thick = fl.thick
+            section = fl.section
+            widths = fl.widths_m
+            dx = fl.dx_meter
+            nx = fl.nx
+
+            # Tributaries get the surface of the line they flow into as
+            # (fixed) downstream boundary
+            is_trib = trib[0] is not None
+
+            if self.sf_func is not None:
+                sf = self.sf_func(widths, thick, fl.is_rectangular)
+                if is_trib:
+                    sf = np.append(sf, 1.)
+                sf_stag[1:-1] = (sf[0:-1] + sf[1:]) / 2.
+                sf_stag[[0, -1]] = sf[[0, -1]]
+
+            if is_trib:
+                fl_to = self.fls[trib[0]]
+                ide = fl.flows_to_indice
+                surface_h = np.append(surface_h, fl_to.surface_h[ide])
+                thick = np.append(thick, thick[-1])
+                section = np.append(section, section[-1])
+
+            # Staggered variables, as in the explicit scheme
+            slope_stag[0] = 0
+            slope_stag[1:-1] = (surface_h[0:-1] - surface_h[1:]) / dx
+            slope_stag[-1] = slope_stag[-2]
+            thick_stag[1:-1] = (thick[0:-1] + thick[1:]) / 2.
+            thick_stag[[0, -1]] = thick[[0, -1]]
+            section_stag[1:-1] = (section[0:-1] + section[1:]) / 2.
+            section_stag[[0, -1]] = section[[0, -1]]
+
+            # Diffusivity such that flux = diff * slope
+            diff = ((thick_stag**(N+1)) * self._fd * sf_stag**N +
+                    (thick_stag**(N-1)) * self.fs)
+            diff *= rhog * np.abs(slope_stag)**(N-1) * section_stag
+            u_stag[:] = diff * slope_stag / np.where(section_stag > 0,
+                                                     section_stag, 1.)
+            flux_stag[:] = diff * slope_stag
+            if flux_gate is not None:
+                flux_stag[0] = flux_gate(self.yr)
+
+            # Derivative of the flux with respect to the slope (the thickness
+            # is lagged). Only the fluxes between two grid points are
+            # implicit: the upstream boundary is the flux gate and the
+            # downstream one is the (explicit) outflow - unless we are a
+            # tributary.
+            diff_imp = diff[:nx+1] * N
+            diff_imp[0] = 0
+            if not is_trib:
+                diff_imp[-1] = 0
+
+            # Change of surface elevation per change of section
+            # (allow parabolic beds to grow)
+            inv_w = 1 / utils.clip_min(widths, 10.)
+
+            # Tridiagonal system for the change of section
+            a = dt / dx**2
+            ab = np.zeros((3, nx))
+            ab[0, 1:] = - a * diff_imp[1:nx] * inv_w[1:]
+            ab[1, :] = 1 + a * (diff_imp[:-1] + diff_imp[1:]) * inv_w
+            ab[2, :-1] = - a * diff_imp[1:nx] * inv_w[:-1]
+
+            mb = mbs[fl_id]
+            mb = dt * mb * np.where((mb > 0.) & (widths == 0), 10., widths)
+            rhs = (flux_stag[:nx] - flux_stag[1:nx+1] + trib_flux) * dt / dx
+            rhs += mb
+            d_section = solve_banded((1, 1), ab, rhs)
+
+            # New fluxes, for the tributary transfer and the diagnostics
+            d_surf = d_section * inv_w
+            flux_stag[1:nx] += diff_imp[1:nx] * (d_surf[:-1] - d_surf[1:]) / dx
+            if is_trib:
+                flux_stag[nx] += diff_imp[nx] * d_surf[-1] / dx
+
+            # Keep positive values only and store
+            fl.section = utils.clip_min(fl.section + d_section, 0)
+
+            # If we use a flux-gate, store the total volume that came in
+            self.flux_gate_m3_since_y0 += flux_stag[0] * dt
+
+            # Add the last flux to the tributary
+            # this works because the lines are sorted in order
+            if is_trib:
+                self.trib_flux[trib[0]][trib[1]:trib[2]] += \
+                    utils.clip_min(flux_stag[nx], 0) * trib[3]
+
+        self.calving_rate_myr = 0.
+
+        # Next step
+        self.t += dt
+        return dt
+
+
+class BatchedFluxBasedModel(object):
+    """Run many FluxBasedModel glaciers at once, sharing the numerics.
+
+    With tens of thousands of small glaciers, most of the time spent by
+    :py:class:`FluxBasedModel` goes into the Python overhead of small numpy
+    calls, not into the numerics. This model packs the flowlines of all
+    glaciers as the rows of padded 2D arrays and advances them together.
+    Each glacier keeps its own adaptive (CFL) time step: glaciers which
+    already reached the target date of the current step are simply masked
+    out until all others have caught up.
+
+    The results are the same as running each FluxBasedModel on its own (up
+    to floating point accuracy). The flowlines and the models are updated
+    in place, so that they can be used as usual after the run.
+
+    k-calving and shape factors are not supported (yet).
+    """
+
+    def __init__(self, models):
+        """Instanciate.
+
+        Parameters
+        ----------
+        models : list
+            a list of :py:class:`FluxBasedModel` instances, all starting at
+            the same date. Their flowlines will be modified at run time.
+        """
+
+        self.models = list(models)
+        if len(self.models) == 0:
+            raise InvalidParamsError('Need at least one model to run.')
+
+        yrs = np.array([m.yr for m in self.models])
+        if np.any(yrs != yrs[0]):
+            raise InvalidParamsError('All models need to start at the same '
+                                     'date.')
+        self.yr = yrs[0]
+
+        for m in self.models:
+            if (not isinstance(m, FluxBasedModel) or
+                    isinstance(m, SemiImplicitModel)):
+                raise InvalidParamsError('BatchedFluxBasedModel only works '
+                                         'with FluxBasedModel instances.')
+            if m.do_calving:
+                raise InvalidParamsError('BatchedFluxBasedModel does not '
+                                         'support k-calving.')
+            if m.sf_func is not None:
+                raise InvalidParamsError('BatchedFluxBasedModel does not '
+                                         'support shape factors.')
+            if (m.glen_n != self.models[0].glen_n or
+                    m.rho != self.models[0].rho):
+                raise InvalidParamsError('All models need the same glen_n '
+                                         'and ice density.')
+        self.glen_n = self.models[0].glen_n
+        self.rho = self.models[0].rho
+
+        # One exception per glacier if the run failed
+        self.errors = [None] * len(self.models)
+
+        # Per glacier
+        ng = len(self.models)
+        self._y0 = np.array([m.y0 for m in self.models], dtype=float)
+        self._t = np.array([m.t for m in self.models], dtype=float)
+        self._ok = np.ones(ng, dtype=bool)
+        self._fixed_dt = np.array([m.fixed_dt if m.fixed_dt else 0.
+                                   for m in self.models], dtype=float)
+        self._cfl_number = np.array([m.cfl_number for m in self.models])
+        self._min_dt = np.array([m.min_dt for m in self.models])
+        self._mb_always = np.array([m.mb_elev_feedback == 'always'
+                                    for m in self.models])
+        self._mb_monthly = np.array([m.mb_step == 'monthly'
+                                     for m in self.models])
+        self._mb_key = np.full(ng, np.iinfo(np.int64).min)
+        self._flux_gate_m3 = np.array([m.flux_gate_m3_since_y0
+                                       for m in self.models], dtype=float)
+
+        # Per flowline (i.e. rows of the 2D arrays)
+        rows = []
+        for g, m in enumerate(self.models):
+            for fl_id, fl in enumerate(m.fls):
+                rows.append((g, fl_id, fl))
+        nr = len(rows)
+        self._nx = np.array([fl.nx for _, _, fl in rows])
+        nxmax = np.max(self._nx)
+        self._row_glacier = np.array([g for g, _, _ in rows])
+        self._row_fl_id = np.array([fl_id for _, fl_id, _ in rows])
+        new_g = np.diff(np.append(-1, self._row_glacier))
+        self._g_first_row = np.nonzero(new_g)[0]
+        self._g_last_row = np.append(self._g_first_row[1:] - 1, nr - 1)
+
+        self._dx = np.array([fl.dx_meter for _, _, fl in rows])
+        self._fd = np.array([self.models[g]._fd for g, _, _ in rows])[:, None]
+        self._fs = np.array([self.models[g].fs for g, _, _ in rows])[:, None]
+        self._check_bounds = np.array([m.check_for_boundaries
+                                       for m in self.models], dtype=bool)
+
+        # Geometry in the "mixed bed" representation. Padded values
+        # are parabolic with zero thickness (i.e. no ice, no width)
+        shape = (nr, nxmax)
+        self._mask = np.arange(nxmax)[None, :] < self._nx[:, None]
+        self._bed_h = np.zeros(shape)
+        self._thick = np.zeros(shape)
+        self._bed_shape = np.ones(shape)
+        self._w0_m = np.zeros(shape)
+        self._lambdas = np.zeros(shape)
+        is_trap = np.zeros(shape, dtype=bool)
+        for r, (_, _, fl) in enumerate(rows):
+            nx = fl.nx
+            self._bed_h[r, :nx] = fl.bed_h
+            self._thick[r, :nx] = fl.thick
+            if isinstance(fl, MixedBedFlowline):
+                pt = fl.is_trapezoid
+                self._bed_shape[r, :nx][~pt] = fl.bed_shape[~pt]
+                self._w0_m[r, :nx][pt] = fl._w0_m[pt]
+                self._lambdas[r, :nx][pt] = fl._lambdas[pt]
+                is_trap[r, :nx] = pt
+            elif isinstance(fl, ParabolicBedFlowline):
+                self._bed_shape[r, :nx] = fl.bed_shape
+            elif isinstance(fl, RectangularBedFlowline):
+                self._w0_m[r, :nx] = fl._widths * fl.map_dx
+                is_trap[r, :nx] = True
+            elif isinstance(fl, TrapezoidalBedFlowline):
+                self._w0_m[r, :nx] = fl._w0_m
+                self._lambdas[r, :nx] = fl._lambdas
+                is_trap[r, :nx] = True
+            else:
+                raise InvalidParamsError('Flowline type not understood: '
+                                         '{}'.format(type(fl)))
+        self._sqrt_bed = np.sqrt(self._bed_shape)
+        self._do_trapeze = np.any(is_trap)
+        self._ptrap = np.nonzero(is_trap)
+        self._prec = np.nonzero(is_trap & (self._lambdas == 0))
+
+        # Tributaries: they get an additional grid point at the end
+        self._is_trib = np.zeros(nr, dtype=bool)
+        trib_rows, trib_to, trib_ide = [], [], []
+        trib_src, trib_dst, trib_w = [], [], []
+        for r, (g, fl_id, fl) in enumerate(rows):
+            tr = self.models[g]._tributary_indices[fl_id]
+            if tr[0] is None:
+                continue
+            self._is_trib[r] = True
+            r_to = self._g_first_row[g] + tr[0]
+            trib_rows.append(r)
+            trib_to.append(r_to)
+            trib_ide.append(fl.flows_to_indice)
+            gk = np.atleast_1d(tr[3])
+            trib_src.append(np.repeat(r, len(gk)))
+            nx_to = self.models[g].fls[tr[0]].nx
+            trib_dst.append(r_to * nxmax + np.arange(nx_to)[tr[1]:tr[2]])
+            trib_w.append(gk)
+        self._trib_rows = np.array(trib_rows, dtype=int)
+        self._trib_to = np.array(trib_to, dtype=int)
+        self._trib_ide = np.array(trib_ide, dtype=int)
+        if trib_rows:
+            self._trib_src = np.concatenate(trib_src)
+            self._trib_dst = np.concatenate(trib_dst)
+            self._trib_w = np.concatenate(trib_w)
+
+        # Last grid point on the staggered grid
+        self._n_stag = self._nx + self._is_trib
+        self._stag_pad = (np.arange(nxmax + 2)[None, :] >
+                          self._n_stag[:, None])
+
+        # Flux gates
+        self._flux_gate = [(r, self.models[g].flux_gate[fl_id])
+                           for r, (g, fl_id, _) in enumerate(rows)
+                           if self.models[g].flux_gate[fl_id] is not None]
+
+        # Optim
+        self._mb = np.zeros(shape)
+        self._ext = np.zeros((3, nr, nxmax + 1))
+        self._slope_stag = np.zeros((nr, nxmax + 2))
+        self._thick_stag = np.zeros((nr, nxmax + 2))
+        self._section_stag = np.zeros((nr, nxmax + 2))
+
+    def _widths_m(self, thick):
+        """Compute the widths out of H and shape."""
+        out = np.sqrt(4 * thick / self._bed_shape)
+        if self._do_trapeze:
+            pt = self._ptrap
+            out[pt] = self._w0_m[pt] + self._lambdas[pt] * thick[pt]
+        return out
+
+    def _section(self, widths, thick):
+        """Compute the section out of widths and H."""
+        out = 2./3. * widths * thick
+        if self._do_trapeze:
+            pt = self._ptrap
+            out[pt] = (widths[pt] + self._w0_m[pt]) / 2 * thick[pt]
+        return out
+
+    def _thick_from_section(self, val):
+        """Compute H out of the section."""
+        out = (0.75 * val * self._sqrt_bed)**(2./3.)
+        if self._do_trapeze:
+            pt = self._ptrap
+            b = 2 * self._w0_m[pt]
+            a = 2 * self._lambdas[pt]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                out[pt] = (np.sqrt(b ** 2 + 4 * a * val[pt]) - b) / a
+            pr = self._prec
+            out[pr] = val[pr] / self._w0_m[pr]
+        return utils.clip_min(out, 0)
+
+    def _sync_glacier(self, g):
+        """Update the flowlines and the model of glacier g."""
+        m = self.models[g]
+        for r in range(self._g_first_row[g], self._g_last_row[g] + 1):
+            m.fls[self._row_fl_id[r]].thick = self._thick[r, :self._nx[r]]
+        m.t = self._t[g]
+        m.flux_gate_m3_since_y0 = self._flux_gate_m3[g]
+
+    def _fail(self, g, err):
+        """Stop a glacier from running any further."""
+        self._ok[g] = False
+        self.errors[g] = err
+
+    def _update_mb(self, surface_h, yrs, todo):
+        """Call the MB models of the glaciers which need it."""
+
+        # Same logic as FlowlineModel.get_mb, but vectorized
+        sec, y = np.modf(yrs)
+        sec = np.round(sec * SEC_IN_YEAR)
+        y = y.astype(np.int64) + (sec == SEC_IN_YEAR)
+        sec = np.where(sec == SEC_IN_YEAR, 0, sec)
+        m = (sec / cfg.SEC_IN_MONTH).astype(np.int64)
+        key = y * 12 + np.where(self._mb_monthly, m, 0)
+
+        to_update = todo & ((key != self._mb_key) | self._mb_always)
+        self._mb_key = np.where(to_update, key, self._mb_key)
+        for g in np.nonzero(to_update)[0]:
+            self._sync_glacier(g)
+            model = self.models[g]
+            for r in range(self._g_first_row[g], self._g_last_row[g] + 1):
+                nx = self._nx[r]
+                self._mb[r, :nx] = model.get_mb(surface_h[r, :nx], yrs[g],
+                                                fl_id=self._row_fl_id[r],
+                                                fls=model.fls)
+
+    def step(self, dt):
+        """Advance one step for all glaciers.
+
+        Parameters
+        ----------
+        dt : ndarray
+            the desired step length (in seconds) of each glacier. Glaciers
+            with a dt of zero are not updated.
+
+        Returns
+        -------
+        the actual dt chosen for each glacier.
+        """
+
+        dt = np.asarray(dt, dtype=float)
+        todo = dt > 0
+        yrs = self._y0 + self._t / SEC_IN_YEAR
+
+        # Flowline state
+        thick = self._thick
+        widths = self._widths_m(thick)
+        section = self._section(widths, thick)
+        surface_h = self._bed_h + thick
+        nxmax = thick.shape[1]
+
+        # We add an additional fake grid point at the end of tributaries,
+        # which uses the branch it flows into to compute the slope
+        sh_e, th_e, se_e = self._ext
+        sh_e[:, :-1] = surface_h
+        th_e[:, :-1] = thick
+        se_e[:, :-1] = section
+        if len(self._trib_rows) > 0:
+            tr, nx = self._trib_rows, self._nx[self._trib_rows]
+            sh_e[tr, nx] = surface_h[self._trib_to, self._trib_ide]
+            th_e[tr, nx] = thick[tr, nx - 1]
+            se_e[tr, nx] = section[tr, nx - 1]
+
+        rows = np.arange(len(self._nx))
+        n = self._n_stag
+
+        # Staggered gradient
+        slope_stag = self._slope_stag
+        slope_stag[:, 0] = 0
+        slope_stag[:, 1:-1] = (sh_e[:, 0:-1] - sh_e[:, 1:]) / self._dx[:, None]
+        slope_stag[rows, n] = slope_stag[rows, n - 1]
+
+        # Staggered thick
+        thick_stag = self._thick_stag
+        thick_stag[:, 1:-1] = (th_e[:, 0:-1] + th_e[:, 1:]) / 2.
+        thick_stag[:, 0] = th_e[:, 0]
+        thick_stag[rows, n] = th_e[rows, n - 1]
+
+        # Staggered velocity (Deformation + Sliding)
+        N = self.glen_n
+        rhogh = (self.rho*G*slope_stag)**N
+        u_stag = ((thick_stag**(N+1)) * self._fd * rhogh +
+                  (thick_stag**(N-1)) * self._fs * rhogh)
+        u_stag[self._stag_pad] = 0
+
+        # Staggered section
+        section_stag = self._section_stag
+        section_stag[:, 1:-1] = (se_e[:, 0:-1] + se_e[:, 1:]) / 2.
+        section_stag[:, 0] = se_e[:, 0]
+        section_stag[rows, n] = se_e[rows, n - 1]
+
+        # Staggered flux rate
+        flux_stag = u_stag * section_stag
+
+        # Add boundary condition
+        for r, flux_gate in self._flux_gate:
+            flux_stag[r, 0] = flux_gate(yrs[self._row_glacier[r]])
+
+        # CFL condition, per glacier
+        maxu = np.max(np.abs(u_stag), axis=1)
+        with np.errstate(divide='ignore'):
+            cfl_dt = np.where(maxu > cfg.FLOAT_EPS,
+                              self._cfl_number[self._row_glacier] *
+                              self._dx / maxu, np.inf)
+        cfl_dt = np.minimum.reduceat(cfl_dt, self._g_first_row)
+        cfl_dt[self._fixed_dt > 0] = np.inf
+        for g in np.nonzero(todo & (cfl_dt < dt) &
+                            (cfl_dt < self._min_dt))[0]:
+            self._fail(g, RuntimeError('CFL error: required time step '
+                                       'smaller than the minimum allowed: '
+                                       '{:.1f}s vs {:.1f}s.'
+                                       .format(cfl_dt[g], self._min_dt[g])))
+        todo &= self._ok
+        dt = np.where(todo, np.minimum(dt, cfl_dt), 0.)
+
+        # Time step
+        fixed = (self._fixed_dt > 0) & (self._fixed_dt < dt)
+        dt[fixed] = self._fixed_dt[fixed]
+
+        # MB before mass-redistribution occurs
+        self._update_mb(surface_h, yrs, todo)
+
+        # Tributary flux
+        trib_flux = np.zeros(thick.size)
+        if len(self._trib_rows) > 0:
+            src = self._trib_src
+            np.add.at(trib_flux, self._trib_dst,
+                      utils.clip_min(flux_stag[src, self._nx[src]], 0) *
+                      self._trib_w)
+        trib_flux = trib_flux.reshape(thick.shape)
+
+        # Mass-balance
+        dtr = dt[self._row_glacier][:, None]
+        dx = self._dx[:, None]
+        mb = self._mb
+        # Allow parabolic beds to grow
+        mb = dtr * mb * np.where((mb > 0.) & (widths == 0), 10., widths)
+
+        # Update section with ice flow and mass balance
+        new_section = (section + (flux_stag[:, 0:nxmax] -
+                                  flux_stag[:, 1:nxmax+1])*dtr/dx +
+                       trib_flux*dtr/dx + mb)
+        new_section[~self._mask] = 0
+
+        # Keep positive values only and store
+        new_thick = self._thick_from_section(utils.clip_min(new_section, 0))
+        self._thick = np.where(todo[self._row_glacier][:, None],
+                               new_thick, thick)
+
+        # If we use a flux-gate, store the total volume that came in
+        np.add.at(self._flux_gate_m3, self._row_glacier,
+                  flux_stag[:, 0] * dtr[:, 0])
+
+        # Next step
+        self._t += dt
+        return dt
+
+    def run_until(self, y1):
+        """Runs all glaciers from the current year up to a given date y1.
+
+        Glaciers which fail on the way (CFL, NaNs, domain boundaries) are
+        stopped and their error is stored in ``self.errors``. The others
+        carry on.
+
+        Parameters
+        ----------
+        y1 : float
+            Upper time span for how long the model should run
+        """
+
+        # Land on the dates needed by any of the models (monthly by default)
+        ts = [m.get_step_boundaries(y1, y0=self.yr) for m in self.models]
+        ts = np.unique(np.concatenate(ts)) if len(ts) > 1 else ts[0]
+
+        for y in ts:
+            t = (y - self._y0) * SEC_IN_YEAR
+            while True:
+                todo = self._ok & (self._t < t)
+                if not np.any(todo):
+                    break
+                self.step(np.where(todo, t - self._t, 0.))
+
+            # Check for domain bounds
+            last = self._g_last_row
+            out = self._thick[last, self._nx[last] - 1] > 10
+            for g in np.nonzero(self._ok & self._check_bounds & out)[0]:
+                self._fail(g, RuntimeError('Glacier exceeds domain '
+                                           'boundaries, at year: '
+                                           '{}'.format(y)))
+
+            # Check for NaNs
+            nans = np.any(~np.isfinite(self._thick), axis=1)
+            nans = np.logical_or.reduceat(nans, self._g_first_row)
+            for g in np.nonzero(self._ok & nans)[0]:
+                self._fail(g, FloatingPointError('NaN in numerical '
+                                                 'solution, at year: '
+                                                 '{}'.format(y)))
+
+            self.yr = y
+
+        for g in range(len(self.models)):
+            self._sync_glacier(g)
+
+    def run_until_and_store(self, y1, run_paths=None, diag_paths=None,
+                            store_monthly_step=None, ela_diagnostic=None,
+                            flush_interval=None):
+        """Runs all glaciers and returns intermediate steps in datasets.
+
+        This is the batched equivalent of
+        :py:meth:`FlowlineModel.run_until_and_store`.
+
+        Parameters
+        ----------
+        y1 : int
+            Upper time span for how long the model should run (needs to be
+            a full year)
+        run_paths : list of str
+            Path and filename where to store the model run dataset of each
+            glacier (None for no output)
+        diag_paths : list of str
+            Path and filename where to store the model diagnostics dataset
+            of each glacier (None for no output)
+        store_monthly_step : Bool
+            If True (False)  model diagnostics will be stored monthly (yearly).
+            If unspecified, we follow the update of the MB model.
+        ela_diagnostic : str
+            how to compute the ELA diagnostic (see
+            :py:meth:`FlowlineModel.run_until_and_store`)
+        flush_interval : int
+            stream the output to disk (see
+            :py:meth:`FlowlineModel.run_until_and_store`)
+
+        Returns
+        -------
+        a list of (run_ds, diag_ds) tuples, one per glacier, or None for the
+        glaciers which failed (see ``self.errors``).
+        """
+
+        ng = len(self.models)
+        run_paths = utils.tolist(run_paths, length=ng)
+        diag_paths = utils.tolist(diag_paths, length=ng)
+
+        outs = []
+        for m, run_path, diag_path in zip(self.models, run_paths,
+                                          diag_paths):
+            out = m._init_run_output(y1, run_path=run_path,
+                                     diag_path=diag_path,
+                                     store_monthly_step=store_monthly_step,
+                                     ela_diagnostic=ela_diagnostic,
+                                     flush_interval=flush_interval)
+            outs.append(out)
+        monthly_time = outs[0]['monthly_time']
+        for out in outs:
+            if not np.array_equal(out['monthly_time'], monthly_time):
+                raise InvalidParamsError('All models need to have the same '
+                                         'output time steps.')
+
+        # Run
+        for i, yr in enumerate(monthly_time):
+            self.run_until(yr)
+            for g in np.nonzero(self._ok)[0]:
+                self.models[g]._store_run_output(outs[g], i)
+
+        results = []
+        for g, (m, out) in enumerate(zip(self.models, outs)):
+            if not self._ok[g]:
+                results.append(None)
+                continue
+            results.append(m._write_run_output(out, run_path=run_paths[g],
+                                               diag_path=diag_paths[g]))
+        return results
+
+
 class KarthausModel(FlowlineModel):
     """The actual model"""
 
@@ -1670,21 +3034,28 @@ class KarthausModel(FlowlineModel):
 class FileModel(object):
     """Duck FlowlineModel which actually reads the stuff out of a nc file."""
 
-    def __init__(self, path):
+    def __init__(self, path, group=None):
         """ Instanciate.
 
         Parameters
         ----------
+        path : str
+            the model_run file
+        group : str
+            the group of the file where the model run is stored, if not at
+            the root (e.g. in a run output container, see
+            :py:func:`oggm.utils.get_run_output_location`)
 
         Properties
         ----------
         #TODO: document properties
         """
 
-        self.fls = glacier_from_netcdf(path)
+        self.fls = glacier_from_netcdf(path, group=group)
+        prefix = '' if group is None else group + '/'
         dss = []
         for flid, fl in enumerate(self.fls):
-            ds = xr.open_dataset(path, group='fl_{}'.format(flid))
+            ds = xr.open_dataset(path, group=prefix + 'fl_{}'.format(flid))
             ds.load()
             dss.append(ds)
 
@@ -1693,7 +3064,7 @@ class FileModel(object):
 
         # Calving diags
         try:
-            with xr.open_dataset(path) as ds:
+            with xr.open_dataset(path, group=group) as ds:
                 self._calving_m3_since_y0 = ds.calving_m3.load()
                 self.do_calving = True
         except AttributeError:
@@ -1829,13 +3200,15 @@ def flowline_from_dataset(ds):
     return cl(**args)
 
 
-def glacier_from_netcdf(path):
+def glacier_from_netcdf(path, group=None):
     """Instanciates a list of flowlines from an xarray Dataset."""
 
-    with xr.open_dataset(path) as ds:
+    prefix = '' if group is None else group + '/'
+    with xr.open_dataset(path, group=group) as ds:
         fls = []
         for flid in ds['flowlines'].values:
-            with xr.open_dataset(path, group='fl_{}'.format(flid)) as _ds:
+            with xr.open_dataset(path,
+                                 group=prefix + 'fl_{}'.format(flid)) as _ds:
                 fls.append(flowline_from_dataset(_ds))
 
         for i, fid in enumerate(ds['flows_to_id'].values):
@@ -2085,8 +3458,8 @@ def init_present_time_glacier(gdir):
 def robust_model_run(gdir, output_filesuffix=None, mb_model=None,
                      ys=None, ye=None, zero_initial_glacier=False,
                      init_model_fls=None, store_monthly_step=False,
-                     water_level=None,
-                     **kwargs):
+                     water_level=None, batch=None,
+                     evolution_model=FluxBasedModel, **kwargs):
     """Runs a model simulation with the default time stepping scheme.
 
     Parameters
@@ -2117,19 +3490,40 @@ def robust_model_run(gdir, output_filesuffix=None, mb_model=None,
         - other uncertainties
         The default is to take the water level obtained from the ice
         thickness inverion.
+    batch : list
+        if provided, the model is not run: instead, it is appended to this
+        list (as a dict together with the output paths and end year) so that
+        it can be run later together with other glaciers with a
+        :py:class:`BatchedFluxBasedModel` (see
+        :py:func:`oggm.workflow.execute_batched_model_run`). Models other
+        than the FluxBasedModel are run alone.
+    evolution_model : class
+        the FlowlineModel class to use for the run, e.g.
+        :py:class:`FluxBasedModel` (the default) or
+        :py:class:`SemiImplicitModel`
     kwargs : dict
-        kwargs to pass to the FluxBasedModel instance
+        kwargs to pass to the evolution_model instance
+
+    Notes
+    -----
+    If cfg.PARAMS['model_checkpoint_interval'] is > 0, the model state is
+    regularly written to the glacier directory ('model_checkpoint' file).
+    If the run is interrupted, calling the task again resumes it from the
+    latest checkpoint. A checkpoint written by a run with other arguments
+    (mass-balance model, initial state, start or end year...), or whose
+    output files are gone, is discarded and the run starts from scratch.
+
+    If cfg.PARAMS['run_output_container'] is True, the output files are not
+    written to the glacier directory but to a netCDF file shared by all
+    glaciers run by the same process (see
+    :py:func:`oggm.utils.get_run_output_location` to find them). With
+    checkpoints, the output files of a run in progress are written to the
+    glacier directory, and moved to the container at the end of the run.
      """
 
     kwargs.setdefault('fs', cfg.PARAMS['fs'])
     kwargs.setdefault('glen_a', cfg.PARAMS['glen_a'])
 
-    run_path = gdir.get_filepath('model_run', filesuffix=output_filesuffix,
-                                 delete=True)
-    diag_path = gdir.get_filepath('model_diagnostics',
-                                  filesuffix=output_filesuffix,
-                                  delete=True)
-
     if init_model_fls is None:
         fls = gdir.read_pickle('model_flowlines')
     else:
@@ -2150,19 +3544,89 @@ def robust_model_run(gdir, output_filesuffix=None, mb_model=None,
                                        '`False` or set `water_level` '
                                        'to prevent this error.')
 
-    model = FluxBasedModel(fls, mb_model=mb_model, y0=ys,
-                           inplace=True,
-                           is_tidewater=gdir.is_tidewater,
-                           is_lake_terminating=gdir.is_lake_terminating,
-                           water_level=water_level,
-                           **kwargs)
+    model = evolution_model(fls, mb_model=mb_model, y0=ys,
+                            inplace=True,
+                            is_tidewater=gdir.is_tidewater,
+                            is_lake_terminating=gdir.is_lake_terminating,
+                            water_level=water_level,
+                            **kwargs)
+
+    # Resume an interrupted run?
+    checkpoint_path = None
+    resume = False
+    if cfg.PARAMS['model_checkpoint_interval'] > 0 and batch is None:
+        checkpoint_path = gdir.get_filepath('model_checkpoint',
+                                            filesuffix=output_filesuffix)
+        resume = os.path.exists(checkpoint_path)
+
+    run_path = gdir.get_filepath('model_run', filesuffix=output_filesuffix,
+                                 delete=not resume)
+    diag_path = gdir.get_filepath('model_diagnostics',
+                                  filesuffix=output_filesuffix,
+                                  delete=not resume)
+    if utils.get_output_format() == 'zarr':
+        run_path = os.path.splitext(run_path)[0] + '.zarr'
+        diag_path = os.path.splitext(diag_path)[0] + '.zarr'
+
+    # The outputs are written to node-local files first, and moved to the
+    # run output container when the run is done. With checkpoints, they
+    # stay next to the checkpoint instead, so that the run can be resumed
+    # from another node
+    container_key = None
+    if cfg.PARAMS['run_output_container']:
+        if utils.get_output_format() == 'zarr':
+            raise InvalidParamsError("PARAMS['run_output_container'] is "
+                                     "not available with the zarr output "
+                                     "format.")
+        container_key = gdir.rgi_id + (output_filesuffix or '')
+        if checkpoint_path is None:
+            tmp_dir = utils.gettempdir('run_outputs')
+            run_path = os.path.join(tmp_dir, container_key + '_model_run.nc')
+            diag_path = os.path.join(tmp_dir,
+                                     container_key + '_diagnostics.nc')
+            for p in [run_path, diag_path]:
+                if os.path.exists(p):
+                    os.remove(p)
+
+    # Only resume a run started with the same arguments and whose output
+    # files are still there, otherwise we start from scratch
+    if resume:
+        extra = _read_checkpoint(checkpoint_path)['extra']
+        out = extra.get('run_output', {})
+        fingerprint = model.checkpoint_fingerprint('run_until_and_store', ye,
+                                                   store_monthly_step)
+        if (extra.get('fingerprint') != fingerprint or
+                out.get('run_path') != run_path or
+                out.get('diag_path') != diag_path or
+                not os.path.exists(run_path)):
+            log.warning('(%s) discarding the model checkpoint of another or '
+                        'incomplete run', gdir.rgi_id)
+            os.remove(checkpoint_path)
+            for p in [run_path, diag_path]:
+                if os.path.isdir(p):
+                    shutil.rmtree(p)
+                elif os.path.exists(p):
+                    os.remove(p)
+
+    if batch is not None:
+        batch.append(dict(gdir=gdir, model=model, ye=ye, run_path=run_path,
+                          diag_path=diag_path,
+                          store_monthly_step=store_monthly_step,
+                          container_key=container_key))
+        return model
 
     with np.warnings.catch_warnings():
         # For operational runs we ignore the warnings
         np.warnings.filterwarnings('ignore', category=RuntimeWarning)
         model.run_until_and_store(ye, run_path=run_path,
                                   diag_path=diag_path,
-                                  store_monthly_step=store_monthly_step)
+                                  store_monthly_step=store_monthly_step,
+                                  checkpoint_path=checkpoint_path)
+
+    if container_key is not None:
+        utils.add_to_run_output_container(container_key,
+                                          {'model_run': run_path,
+                                           'model_diagnostics': diag_path})
 
     return model
 
@@ -2389,8 +3853,9 @@ def run_from_climate_data(gdir, ys=None, ye=None, min_ys=None,
         ys = ys if ys < min_ys else min_ys
 
     if init_model_filesuffix is not None:
-        fp = gdir.get_filepath('model_run', filesuffix=init_model_filesuffix)
-        with FileModel(fp) as fmod:
+        fp, group = utils.get_run_output_location(
+            gdir, 'model_run', filesuffix=init_model_filesuffix)
+        with FileModel(fp, group=group) as fmod:
             if init_model_yr is None:
                 init_model_yr = fmod.last_yr
             fmod.run_until(init_model_yr)
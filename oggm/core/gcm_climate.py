@@ -12,13 +12,178 @@ import xarray as xr
 # Locals
 from oggm import cfg
 from oggm import utils
-from oggm import entity_task
+from oggm import entity_task, global_task
 from oggm.exceptions import InvalidParamsError
 
 # Module logger
 log = logging.getLogger(__name__)
 
 
+def _nearest_series(ds, fpath, varname, lon, lat):
+    """The series of a GCM variable at the grid point nearest to lon, lat.
+
+    For arrays of locations, the series are along a new 'points'
+    dimension. Read from a :py:class:`utils.PointSeriesStore` of the file
+    if ``cfg.PARAMS['use_point_series_store']`` is set.
+    """
+
+    if not cfg.PARAMS['use_point_series_store']:
+        if np.ndim(lon) > 0:
+            lon = xr.DataArray(lon, dims='points')
+            lat = xr.DataArray(lat, dims='points')
+        return ds[varname].sel(lat=lat, lon=lon, method='nearest')
+
+    store = utils.PointSeriesStore.from_netcdf(fpath, lon='lon', lat='lat',
+                                               decode_times=False)
+    points = store.nearest(lon, lat)
+    p_lon, p_lat = store.coordinates(points)
+    if np.ndim(lon) > 0:
+        return xr.DataArray(store.series(varname, points).T,
+                            dims=('time', 'points'),
+                            coords={'time': ds.time.values,
+                                    'lon': ('points', p_lon),
+                                    'lat': ('points', p_lat)},
+                            name=varname)
+    return xr.DataArray(store.series(varname, points)[0], dims=('time',),
+                        coords={'time': ds.time.values, 'lon': p_lon[0],
+                                'lat': p_lat[0]},
+                        name=varname)
+
+
+def _monthly_stat(func, data, months, mask=None):
+    """Statistics of the data per calendar month, of shape (12, ...)."""
+    if mask is None:
+        mask = np.ones(len(data), dtype=bool)
+    return np.stack([func(data[mask & (months == m)], axis=0)
+                     for m in range(1, 13)])
+
+
+def _gcm_anomalies(temp, prcp, months, ref, ref_temp, ref_prcp, ref_months,
+                   scale_stddev=True):
+    """Applies the anomaly method to GCM timeseries.
+
+    The series can be those of one grid point (1D arrays) or of many
+    points at once (2D arrays, time along the first axis).
+
+    Parameters
+    ----------
+    temp : ndarray
+        the GCM temperature, for full years (the length of the series is
+        a multiple of 12)
+    prcp : ndarray
+        the GCM precipitation (same shape as temp)
+    months : ndarray
+        the calendar month (1-12) of each time step
+    ref : ndarray of bool
+        which time steps are in the reference period
+    ref_temp : ndarray
+        the baseline temperature over the reference period
+    ref_prcp : ndarray
+        the baseline precipitation over the reference period
+    ref_months : ndarray
+        the calendar month of each time step of the baseline data
+    scale_stddev : bool
+        whether or not to scale the temperature standard deviation as well
+
+    Returns
+    -------
+    the (prcp, temp) timeseries
+    """
+
+    temp = np.asarray(temp, dtype=np.float64)
+    months = np.asarray(months)
+    ref_months = np.asarray(ref_months)
+
+    # compute monthly anomalies
+    # of temp
+    if scale_stddev:
+        n_ref = np.sum(ref)
+        # We need an even number of years for this to work
+        if ((n_ref // 12) % 2) == 1:
+            raise InvalidParamsError('We need an even number of years '
+                                     'for this to work')
+        std_fac = (_monthly_stat(np.nanstd, ref_temp, ref_months) /
+                   _monthly_stat(np.nanstd, temp, months, ref))
+        std_fac = std_fac[months - 1]
+
+        # running mean of each calendar month over the number of years of
+        # the reference period, centered and shortened at the edges
+        ny = len(temp) // 12
+        x = temp.reshape((ny, 12) + temp.shape[1:])
+        # remove the mean first for a more accurate cumulative sum
+        xm = np.nanmean(x, axis=0)
+        isok = np.isfinite(x)
+        csum = np.cumsum(np.where(isok, x - xm, 0), axis=0)
+        ccnt = np.cumsum(isok, axis=0)
+        csum = np.concatenate([np.zeros_like(csum[:1]), csum])
+        ccnt = np.concatenate([np.zeros_like(ccnt[:1]), ccnt])
+        half = n_ref // 24
+        i0 = utils.clip_min(np.arange(ny) - half, 0)
+        i1 = utils.clip_max(np.arange(ny) + half + 1, ny)
+        with np.errstate(invalid='ignore'):
+            roll = (csum[i1] - csum[i0]) / (ccnt[i1] - ccnt[i0]) + xm
+        roll = roll.reshape(temp.shape)
+        temp = roll + (temp - roll) * std_fac
+
+    ts_tmp_avg = _monthly_stat(np.nanmean, temp, months, ref)
+    ts_tmp = temp - ts_tmp_avg[months - 1]
+    # of precip -- scaled anomalies
+    ts_pre_avg = _monthly_stat(np.nanmean, prcp, months, ref)
+    ts_pre_ano = prcp - ts_pre_avg[months - 1]
+    # scaled anomalies is the default. Standard anomalies above
+    # are used later for where ts_pre_avg == 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ts_pre = prcp / ts_pre_avg[months - 1]
+
+    # for temp
+    loc_tmp = _monthly_stat(np.nanmean, ref_temp, ref_months)
+    ts_tmp = ts_tmp + loc_tmp[months - 1]
+
+    # for prcp
+    loc_pre = _monthly_stat(np.nanmean, ref_prcp, ref_months)
+    # scaled anomalies
+    ts_pre = ts_pre * loc_pre[months - 1]
+    # standard anomalies
+    ts_pre_ano = ts_pre_ano + loc_pre[months - 1]
+    # Correct infinite values with standard anomalies
+    ts_pre = np.where(np.isfinite(ts_pre), ts_pre, ts_pre_ano)
+    # The previous step might create negative values (unlikely). Clip them
+    ts_pre = utils.clip_min(ts_pre, 0)
+
+    assert np.all(np.isfinite(ts_pre))
+    assert np.all(np.isfinite(ts_tmp))
+    return ts_pre, ts_tmp
+
+
+def _check_gcm_data(temp, prcp):
+    """Standard sanity checks of the GCM data."""
+
+    months = temp['time.month']
+    if (months[0] != 1) or (months[-1] != 12):
+        raise ValueError('We expect the files to start in January and end in '
+                         'December!')
+
+    if np.any(np.abs(temp['lon']) > 180) or np.any(np.abs(prcp['lon']) > 180):
+        raise ValueError('We expect the longitude coordinates to be within '
+                         '[-180, 180].')
+
+
+def _ref_period(temp, year_range):
+    """Which time steps of the GCM series are in the reference period."""
+    ref = np.zeros(len(temp), dtype=bool)
+    ref[temp.indexes['time'].slice_indexer(*year_range)] = True
+    return ref
+
+
+def _get_baseline(gdir, year_range):
+    """The baseline climate of the glacier over the reference period."""
+    with xr.open_dataset(gdir.get_filepath('climate_historical')) as ds:
+        ds = ds.sel(time=slice(*year_range))
+        return dict(temp=ds.temp.values, prcp=ds.prcp.values,
+                    months=ds['time.month'].values,
+                    ref_hgt=float(ds.ref_hgt))
+
+
 @entity_task(log, writes=['gcm_data'])
 def process_gcm_data(gdir, filesuffix='', prcp=None, temp=None,
                      year_range=('1961', '1990'), scale_stddev=True,
@@ -67,15 +232,7 @@ def process_gcm_data(gdir, filesuffix='', prcp=None, temp=None,
         For metadata: the source of the climate data
     """
 
-    # Standard sanity checks
-    months = temp['time.month']
-    if (months[0] != 1) or (months[-1] != 12):
-        raise ValueError('We expect the files to start in January and end in '
-                         'December!')
-
-    if (np.abs(temp['lon']) > 180) or (np.abs(prcp['lon']) > 180):
-        raise ValueError('We expect the longitude coordinates to be within '
-                         '[-180, 180].')
+    _check_gcm_data(temp, prcp)
 
     # from normal years to hydrological years
     sm = cfg.PARAMS['hydro_month_' + gdir.hemisphere]
@@ -83,70 +240,31 @@ def process_gcm_data(gdir, filesuffix='', prcp=None, temp=None,
     temp = temp[sm-1:sm-13].load()
 
     # Get CRU to apply the anomaly to
-    fpath = gdir.get_filepath('climate_historical')
-    ds_cru = xr.open_dataset(fpath)
-
-    # Add CRU clim
-    dscru = ds_cru.sel(time=slice(*year_range))
-
-    # compute monthly anomalies
-    # of temp
-    if scale_stddev:
-        # This is a bit more arithmetic
-        ts_tmp_sel = temp.sel(time=slice(*year_range))
-        ts_tmp_std = ts_tmp_sel.groupby('time.month').std(dim='time')
-        std_fac = dscru.temp.groupby('time.month').std(dim='time') / ts_tmp_std
-        std_fac = std_fac.roll(month=13-sm, roll_coords=True)
-        std_fac = np.tile(std_fac.data, len(temp) // 12)
-        # We need an even number of years for this to work
-        if ((len(ts_tmp_sel) // 12) % 2) == 1:
-            raise InvalidParamsError('We need an even number of years '
-                                     'for this to work')
-        win_size = len(ts_tmp_sel) + 1
-
-        def roll_func(x, axis=None):
-            x = x[:, ::12]
-            n = len(x[0, :]) // 2
-            xm = np.nanmean(x, axis=axis)
-            return xm + (x[:, n] - xm) * std_fac
-
-        temp = temp.rolling(time=win_size, center=True,
-                            min_periods=1).reduce(roll_func)
-
-    ts_tmp_sel = temp.sel(time=slice(*year_range))
-    ts_tmp_avg = ts_tmp_sel.groupby('time.month').mean(dim='time')
-    ts_tmp = temp.groupby('time.month') - ts_tmp_avg
-    # of precip -- scaled anomalies
-    ts_pre_avg = prcp.sel(time=slice(*year_range))
-    ts_pre_avg = ts_pre_avg.groupby('time.month').mean(dim='time')
-    ts_pre_ano = prcp.groupby('time.month') - ts_pre_avg
-    # scaled anomalies is the default. Standard anomalies above
-    # are used later for where ts_pre_avg == 0
-    ts_pre = prcp.groupby('time.month') / ts_pre_avg
-
-    # for temp
-    loc_tmp = dscru.temp.groupby('time.month').mean()
-    ts_tmp = ts_tmp.groupby('time.month') + loc_tmp
-
-    # for prcp
-    loc_pre = dscru.prcp.groupby('time.month').mean()
-    # scaled anomalies
-    ts_pre = ts_pre.groupby('time.month') * loc_pre
-    # standard anomalies
-    ts_pre_ano = ts_pre_ano.groupby('time.month') + loc_pre
-    # Correct infinite values with standard anomalies
-    ts_pre.values = np.where(np.isfinite(ts_pre.values),
-                             ts_pre.values,
-                             ts_pre_ano.values)
-    # The previous step might create negative values (unlikely). Clip them
-    ts_pre.values = utils.clip_min(ts_pre.values, 0)
-
-    assert np.all(np.isfinite(ts_pre.values))
-    assert np.all(np.isfinite(ts_tmp.values))
-
-    gdir.write_monthly_climate_file(temp.time.values,
-                                    ts_pre.values, ts_tmp.values,
-                                    float(dscru.ref_hgt),
+    baseline = _get_baseline(gdir, year_range)
+
+    # The anomalies only depend on the GCM and baseline data: glaciers in
+    # the same grid cells can share them
+    cache = utils.get_grid_cell_cache('gcm')
+    out = None
+    if cache is not None:
+        key = cache.make_key('GCM', source, sm, tuple(year_range),
+                             scale_stddev, temp.time.values,
+                             temp.values, prcp.values,
+                             baseline['temp'], baseline['prcp'])
+        out = cache.get(key)
+    if out is None:
+        out = _gcm_anomalies(temp.values, prcp.values,
+                             temp['time.month'].values,
+                             _ref_period(temp, year_range),
+                             baseline['temp'], baseline['prcp'],
+                             baseline['months'],
+                             scale_stddev=scale_stddev)
+        if cache is not None:
+            cache.set(key, out)
+    ts_pre, ts_tmp = out
+
+    gdir.write_monthly_climate_file(temp.time.values, ts_pre, ts_tmp,
+                                    baseline['ref_hgt'],
                                     prcp.lon.values, prcp.lat.values,
                                     time_unit=time_unit,
                                     calendar=calendar,
@@ -154,7 +272,132 @@ def process_gcm_data(gdir, filesuffix='', prcp=None, temp=None,
                                     source=source,
                                     filesuffix=filesuffix)
 
-    ds_cru.close()
+
+class _GCMFiles(object):
+    """The files of one GCM run, opened once to read many locations."""
+
+    def __init__(self, gcm_type='cmip5', fpath_temp=None, fpath_precip=None,
+                 fpath_precc=None, fpath_precl=None):
+        """Open the files.
+
+        Parameters
+        ----------
+        gcm_type : str
+            'cesm' (see :py:func:`process_cesm_data`) or 'cmip5' (see
+            :py:func:`process_cmip5_data`)
+        fpath_temp : str
+            path to the temp file (default: cfg.PATHS['cesm_temp_file']
+            or cfg.PATHS['cmip5_temp_file'])
+        fpath_precip : str
+            path to the CMIP5 precip file (default:
+            cfg.PATHS['cmip5_precip_file'])
+        fpath_precc : str
+            path to the CESM precc file (default:
+            cfg.PATHS['cesm_precc_file'])
+        fpath_precl : str
+            path to the CESM precl file (default:
+            cfg.PATHS['cesm_precl_file'])
+        """
+
+        def _path(fpath, key):
+            if fpath is None:
+                if not (key in cfg.PATHS):
+                    raise ValueError("Need to set cfg.PATHS['{}']".format(key))
+                fpath = cfg.PATHS[key]
+            return fpath
+
+        self.gcm_type = gcm_type
+        self.dss = []
+        if gcm_type == 'cesm':
+            # CESM temperature and precipitation data
+            self.fpaths = [_path(fpath_temp, 'cesm_temp_file'),
+                           _path(fpath_precc, 'cesm_precc_file'),
+                           _path(fpath_precl, 'cesm_precl_file')]
+            self.varnames = ['TREFHT', 'PRECC', 'PRECL']
+
+            # read the files
+            if LooseVersion(xr.__version__) < LooseVersion('0.11'):
+                raise ImportError('This task needs xarray v0.11 or newer '
+                                  'to run.')
+            self.dss = [xr.open_dataset(f) for f in self.fpaths]
+
+            # Get the time right - i.e. from time bounds
+            # Fix for https://github.com/pydata/xarray/issues/2565
+            with utils.ncDataset(self.fpaths[0], mode='r') as nc:
+                self.time_unit = nc.variables['time'].units
+                self.calendar = nc.variables['time'].calendar
+
+            tempds = self.dss[0]
+            try:
+                # xarray v0.11
+                self.time = netCDF4.num2date(tempds.time_bnds[:, 0],
+                                             self.time_unit,
+                                             calendar=self.calendar)
+            except TypeError:
+                # xarray > v0.11
+                self.time = tempds.time_bnds[:, 0].values
+        elif gcm_type == 'cmip5':
+            # Get the path of GCM temperature & precipitation data
+            self.fpaths = [_path(fpath_temp, 'cmip5_temp_file'),
+                           _path(fpath_precip, 'cmip5_precip_file')]
+            self.varnames = ['tas', 'pr']
+
+            # Read the GCM files
+            self.dss = [xr.open_dataset(f, decode_times=False)
+                        for f in self.fpaths]
+
+            with utils.ncDataset(self.fpaths[0], mode='r') as nc:
+                self.time_unit = nc.variables['time'].units
+                self.calendar = nc.variables['time'].calendar
+                time = netCDF4.num2date(nc.variables['time'][:],
+                                        self.time_unit)
+            # Time needs a set to start of month
+            self.time = [datetime(t.year, t.month, 1) for t in time]
+        else:
+            raise InvalidParamsError('GCM type not understood: '
+                                     '{}'.format(gcm_type))
+
+    def read(self, lon, lat):
+        """The (temp, prcp) series at the grid points nearest to lon, lat.
+
+        For arrays of locations, the series are along a new 'points'
+        dimension. The precipitation is converted to mm month-1.
+        """
+
+        # GCM files are in 0-360
+        if np.ndim(lon) == 0:
+            lon = lon + 360 if lon <= 0 else lon
+        else:
+            lon = np.where(np.asarray(lon) <= 0, np.asarray(lon) + 360, lon)
+
+        # take the closest
+        # Should we consider GCM interpolation?
+        series = [_nearest_series(ds, f, v, lon, lat) for ds, f, v
+                  in zip(self.dss, self.fpaths, self.varnames)]
+        temp = series[0]
+        prcp = series[1] if len(series) == 2 else series[1] + series[2]
+        temp['time'] = self.time
+        prcp['time'] = self.time
+        temp['lon'] = temp.lon.where(temp.lon <= 180, temp.lon - 360)
+        prcp['lon'] = prcp.lon.where(prcp.lon <= 180, prcp.lon - 360)
+
+        if temp.time[0].dt.month != 1:
+            raise ValueError('We expect the files to start in January!')
+        ny, r = divmod(len(temp), 12)
+        assert r == 0
+        if self.gcm_type == 'cesm':
+            # Convert m s-1 to mm mth-1
+            ndays = xr.DataArray(np.tile(cfg.DAYS_IN_MONTH, ny), dims='time')
+            prcp = prcp * ndays * (60 * 60 * 24 * 1000)
+        else:
+            # Convert kg m-2 s-1 to mm mth-1 => 1 kg m-2 = 1 mm !!!
+            prcp = prcp * prcp.time.dt.days_in_month * (60 * 60 * 24)
+        return temp, prcp
+
+    def close(self):
+        """Close the files."""
+        for ds in self.dss:
+            ds.close()
 
 
 @entity_task(log, writes=['gcm_data'])
@@ -182,78 +425,18 @@ def process_cesm_data(gdir, filesuffix='', fpath_temp=None, fpath_precc=None,
     **kwargs: any kwarg to be passed to ref:`process_gcm_data`
     """
 
-    # CESM temperature and precipitation data
-    if fpath_temp is None:
-        if not ('cesm_temp_file' in cfg.PATHS):
-            raise ValueError("Need to set cfg.PATHS['cesm_temp_file']")
-        fpath_temp = cfg.PATHS['cesm_temp_file']
-    if fpath_precc is None:
-        if not ('cesm_precc_file' in cfg.PATHS):
-            raise ValueError("Need to set cfg.PATHS['cesm_precc_file']")
-        fpath_precc = cfg.PATHS['cesm_precc_file']
-    if fpath_precl is None:
-        if not ('cesm_precl_file' in cfg.PATHS):
-            raise ValueError("Need to set cfg.PATHS['cesm_precl_file']")
-        fpath_precl = cfg.PATHS['cesm_precl_file']
-
-    # read the files
-    if LooseVersion(xr.__version__) < LooseVersion('0.11'):
-        raise ImportError('This task needs xarray v0.11 or newer to run.')
-
-    tempds = xr.open_dataset(fpath_temp)
-    precpcds = xr.open_dataset(fpath_precc)
-    preclpds = xr.open_dataset(fpath_precl)
-
-    # Get the time right - i.e. from time bounds
-    # Fix for https://github.com/pydata/xarray/issues/2565
-    with utils.ncDataset(fpath_temp, mode='r') as nc:
-        time_unit = nc.variables['time'].units
-        calendar = nc.variables['time'].calendar
-
+    run = _GCMFiles('cesm', fpath_temp=fpath_temp, fpath_precc=fpath_precc,
+                    fpath_precl=fpath_precl)
     try:
-        # xarray v0.11
-        time = netCDF4.num2date(tempds.time_bnds[:, 0], time_unit,
-                                calendar=calendar)
-    except TypeError:
-        # xarray > v0.11
-        time = tempds.time_bnds[:, 0].values
-
-    # select for location
-    lon = gdir.cenlon
-    lat = gdir.cenlat
-
-    # CESM files are in 0-360
-    if lon <= 0:
-        lon += 360
-
-    # take the closest
-    # Should we consider GCM interpolation?
-    temp = tempds.TREFHT.sel(lat=lat, lon=lon, method='nearest')
-    prcp = (precpcds.PRECC.sel(lat=lat, lon=lon, method='nearest') +
-            preclpds.PRECL.sel(lat=lat, lon=lon, method='nearest'))
-    temp['time'] = time
-    prcp['time'] = time
-
-    temp.lon.values = temp.lon if temp.lon <= 180 else temp.lon - 360
-    prcp.lon.values = prcp.lon if prcp.lon <= 180 else prcp.lon - 360
-
-    # Convert m s-1 to mm mth-1
-    if time[0].month != 1:
-        raise ValueError('We expect the files to start in January!')
-    ny, r = divmod(len(time), 12)
-    assert r == 0
-    ndays = np.tile(cfg.DAYS_IN_MONTH, ny)
-    prcp = prcp * ndays * (60 * 60 * 24 * 1000)
-
-    tempds.close()
-    precpcds.close()
-    preclpds.close()
+        temp, prcp = run.read(gdir.cenlon, gdir.cenlat)
+    finally:
+        run.close()
 
     # Here:
     # - time_unit='days since 0850-01-01 00:00:00'
     # - calendar='noleap'
     process_gcm_data(gdir, filesuffix=filesuffix, prcp=prcp, temp=temp,
-                     time_unit=time_unit, calendar=calendar, **kwargs)
+                     time_unit=run.time_unit, calendar=run.calendar, **kwargs)
 
 
 @entity_task(log, writes=['gcm_data'])
@@ -278,60 +461,231 @@ def process_cmip5_data(gdir, filesuffix='', fpath_temp=None,
     **kwargs: any kwarg to be passed to ref:`process_gcm_data`
     """
 
-    # Get the path of GCM temperature & precipitation data
-    if fpath_temp is None:
-        if not ('cmip5_temp_file' in cfg.PATHS):
-            raise ValueError("Need to set cfg.PATHS['cmip5_temp_file']")
-        fpath_temp = cfg.PATHS['cmip5_temp_file']
-    if fpath_precip is None:
-        if not ('cmip5_precip_file' in cfg.PATHS):
-            raise ValueError("Need to set cfg.PATHS['cmip5_precip_file']")
-        fpath_precip = cfg.PATHS['cmip5_precip_file']
-
-    # Read the GCM files
-    tempds = xr.open_dataset(fpath_temp, decode_times=False)
-    precipds = xr.open_dataset(fpath_precip, decode_times=False)
-
-    with utils.ncDataset(fpath_temp, mode='r') as nc:
-        time_units = nc.variables['time'].units
-        calendar = nc.variables['time'].calendar
-        time = netCDF4.num2date(nc.variables['time'][:], time_units)
-
-    # Select for location
-    lon = gdir.cenlon
-    lat = gdir.cenlat
-
-    # Conversion of the longitude
-    if lon <= 0:
-        lon += 360
-
-    # Take the closest to the glacier
-    # Should we consider GCM interpolation?
-    temp = tempds.tas.sel(lat=lat, lon=lon, method='nearest')
-    precip = precipds.pr.sel(lat=lat, lon=lon, method='nearest')
-
-    # Time needs a set to start of month
-    time = [datetime(t.year, t.month, 1) for t in time]
-    temp['time'] = time
-    precip['time'] = time
-
-    temp.lon.values = temp.lon if temp.lon <= 180 else temp.lon - 360
-    precip.lon.values = precip.lon if precip.lon <= 180 else precip.lon - 360
-
-    # Convert kg m-2 s-1 to mm mth-1 => 1 kg m-2 = 1 mm !!!
-    if temp.time[0].dt.month != 1:
-        raise ValueError('We expect the files to start in January!')
-
-    ny, r = divmod(len(temp), 12)
-    assert r == 0
-    precip = precip * precip.time.dt.days_in_month * (60 * 60 * 24)
-
-    tempds.close()
-    precipds.close()
+    run = _GCMFiles('cmip5', fpath_temp=fpath_temp,
+                    fpath_precip=fpath_precip)
+    try:
+        temp, precip = run.read(gdir.cenlon, gdir.cenlat)
+    finally:
+        run.close()
 
     # Here:
     # - time_unit='days since 1870-01-15 12:00:00'
     # - calendar='standard'
     process_gcm_data(gdir, filesuffix=filesuffix, prcp=precip, temp=temp,
-                     time_unit=time_units, calendar=calendar, source='CESM',
-                     **kwargs)
+                     time_unit=run.time_unit, calendar=run.calendar,
+                     source='CESM', **kwargs)
+
+
+def _iter_gcm_ensemble_data(gdirs, members, gcm_type='cmip5',
+                            year_range=('1961', '1990'), scale_stddev=True,
+                            source=None, tile_size=10):
+    """Applies the anomaly method to the GCM runs of many glaciers.
+
+    The files of each run are opened once, the baseline climate of each
+    glacier is read once for all runs, and the anomaly method is applied
+    to all glaciers of a tile at once (see
+    :py:func:`utils.group_gdirs_by_tile`).
+
+    Yields
+    ------
+    (gdir, data) tuples, where data is a list of dicts of arguments to
+    :py:meth:`GlacierDirectory.write_monthly_climate_file` (one per run),
+    or the exception which occurred when processing this glacier.
+    """
+
+    runs = []
+    try:
+        for files, filesuffix in members:
+            runs.append((_GCMFiles(gcm_type, **files), filesuffix))
+        if source is None:
+            # Same as the single run tasks
+            source = 'CESM' if gcm_type == 'cmip5' else ''
+        for tile in utils.group_gdirs_by_tile(gdirs, tile_size=tile_size):
+            yield from _iter_gcm_ensemble_tile(tile, runs,
+                                               year_range=year_range,
+                                               scale_stddev=scale_stddev,
+                                               source=source)
+    finally:
+        for run, _ in runs:
+            run.close()
+
+
+def _iter_gcm_ensemble_tile(gdirs, runs, year_range=('1961', '1990'),
+                            scale_stddev=True, source=''):
+    """Applies the anomaly method to the GCM runs of glaciers in a tile."""
+
+    out = dict()
+    baselines = dict()
+    for gdir in gdirs:
+        try:
+            baselines[gdir.rgi_id] = _get_baseline(gdir, year_range)
+            out[gdir.rgi_id] = []
+        except Exception as err:
+            out[gdir.rgi_id] = err
+
+    # The glaciers which can be processed as one 2D array: same
+    # hydrological year and same baseline period
+    groups = dict()
+    for k, gdir in enumerate(gdirs):
+        if gdir.rgi_id in baselines:
+            months = baselines[gdir.rgi_id]['months']
+            groups.setdefault((gdir.hemisphere, months.tobytes()),
+                              []).append(k)
+
+    lons = np.array([gdir.cenlon for gdir in gdirs])
+    lats = np.array([gdir.cenlat for gdir in gdirs])
+    for run, filesuffix in runs:
+        ok = [k for k in range(len(gdirs))
+              if isinstance(out[gdirs[k].rgi_id], list)]
+        if not ok:
+            break
+        try:
+            temp, prcp = run.read(lons[ok], lats[ok])
+            _check_gcm_data(temp, prcp)
+        except Exception as err:
+            for k in ok:
+                out[gdirs[k].rgi_id] = err
+            break
+        temp = temp.assign_coords(points=ok)
+        prcp = prcp.assign_coords(points=ok)
+
+        for (hemisphere, _), idx in groups.items():
+            idx = [k for k in idx if k in ok]
+            if not idx:
+                continue
+            # from normal years to hydrological years
+            sm = cfg.PARAMS['hydro_month_' + hemisphere]
+            _temp = temp.sel(points=idx)[sm-1:sm-13].load()
+            _prcp = prcp.sel(points=idx)[sm-1:sm-13].load()
+            _bl = [baselines[gdirs[k].rgi_id] for k in idx]
+            args = (_temp.values, _prcp.values, _temp['time.month'].values,
+                    _ref_period(_temp, year_range),
+                    np.stack([bl['temp'] for bl in _bl], axis=1),
+                    np.stack([bl['prcp'] for bl in _bl], axis=1),
+                    _bl[0]['months'])
+            try:
+                ts_pre, ts_tmp = _gcm_anomalies(*args,
+                                                scale_stddev=scale_stddev)
+                ts = [(ts_pre[:, i], ts_tmp[:, i]) for i in range(len(idx))]
+            except Exception:
+                # Find out which glaciers are the culprits
+                ts = []
+                for i in range(len(idx)):
+                    try:
+                        ts.append(_gcm_anomalies(
+                            *[a[:, i] if a.ndim == 2 else a for a in args],
+                            scale_stddev=scale_stddev))
+                    except Exception as err:
+                        ts.append(err)
+
+            for i, k in enumerate(idx):
+                rgi_id = gdirs[k].rgi_id
+                if not isinstance(out[rgi_id], list):
+                    continue
+                if isinstance(ts[i], Exception):
+                    out[rgi_id] = ts[i]
+                    continue
+                out[rgi_id].append(dict(time=_temp.time.values,
+                                        prcp=ts[i][0], temp=ts[i][1],
+                                        ref_pix_hgt=_bl[i]['ref_hgt'],
+                                        ref_pix_lon=_prcp.lon.values[i],
+                                        ref_pix_lat=_prcp.lat.values[i],
+                                        time_unit=run.time_unit,
+                                        calendar=run.calendar,
+                                        file_name='gcm_data',
+                                        source=source,
+                                        filesuffix=filesuffix))
+
+    for gdir in gdirs:
+        yield gdir, out[gdir.rgi_id]
+
+
+@entity_task(log, writes=['gcm_data'])
+def process_gcm_ensemble(gdir, members=None, gcm_type='cmip5',
+                         year_range=('1961', '1990'), scale_stddev=True,
+                         source=None, gcm_data=None):
+    """Processes and writes the climate data of many GCM runs.
+
+    Same as calling :py:func:`process_cmip5_data` or
+    :py:func:`process_cesm_data` for each run (ensemble members,
+    scenarios...), but the baseline climate of the glacier is read only
+    once.
+
+    Parameters
+    ----------
+    gdir : :py:class:`oggm.GlacierDirectory`
+        where to write the data
+    members : list of (dict, str) tuples
+        for each run, the paths to its files (the keyword arguments of
+        :py:func:`process_cmip5_data` or :py:func:`process_cesm_data`,
+        e.g. ``dict(fpath_temp=..., fpath_precip=...)``) and the suffix
+        of the output file
+    gcm_type : str
+        'cmip5' or 'cesm'
+    year_range : tuple of str
+        the year range for which you want to compute the anomalies. Default
+        is `('1961', '1990')`
+    scale_stddev : bool
+        whether or not to scale the temperature standard deviation as well
+    source : str
+        For metadata: the source of the climate data (default: the same
+        as the single run tasks)
+    gcm_data : list of dict
+        the data of this glacier, already processed by
+        :py:func:`process_gcm_ensemble_batched` (the other arguments are
+        then ignored)
+    """
+
+    if gcm_data is None:
+        _, gcm_data = next(_iter_gcm_ensemble_data(
+            [gdir], members, gcm_type=gcm_type, year_range=year_range,
+            scale_stddev=scale_stddev, source=source))
+    if isinstance(gcm_data, Exception):
+        # Raise here so that the error is logged for this glacier
+        raise gcm_data
+
+    for data in gcm_data:
+        gdir.write_monthly_climate_file(**data)
+
+
+@global_task
+def process_gcm_ensemble_batched(gdirs, members=None, gcm_type='cmip5',
+                                 year_range=('1961', '1990'),
+                                 scale_stddev=True, source=None,
+                                 tile_size=10):
+    """Processes and writes the climate data of many GCM runs and glaciers.
+
+    Same as :py:func:`process_gcm_ensemble`, but the files of each run are
+    opened only once, and the anomaly method is applied to all glaciers
+    in the same tile at once, which is much faster for large number of
+    glaciers.
+
+    Parameters
+    ----------
+    gdirs : list of :py:class:`oggm.GlacierDirectory` objects
+        the glacier directories to process
+    members : list of (dict, str) tuples
+        for each run, the paths to its files (the keyword arguments of
+        :py:func:`process_cmip5_data` or :py:func:`process_cesm_data`,
+        e.g. ``dict(fpath_temp=..., fpath_precip=...)``) and the suffix
+        of the output file
+    gcm_type : str
+        'cmip5' or 'cesm'
+    year_range : tuple of str
+        the year range for which you want to compute the anomalies. Default
+        is `('1961', '1990')`
+    scale_stddev : bool
+        whether or not to scale the temperature standard deviation as well
+    source : str
+        For metadata: the source of the climate data (default: the same
+        as the single run tasks)
+    tile_size : float
+        the glaciers are processed per tiles of this size (in degrees), to
+        limit the amount of data read in memory at once
+    """
+
+    gdirs = [gdir for gdir in utils.tolist(gdirs) if gdir is not None]
+    for gdir, gcm_data in _iter_gcm_ensemble_data(
+            gdirs, members, gcm_type=gcm_type, year_range=year_range,
+            scale_stddev=scale_stddev, source=source, tile_size=tile_size):
+        process_gcm_ensemble(gdir, gcm_data=gcm_data)
@@ -14,6 +14,25 @@ from oggm.utils import (SuperclassMeta, lazy_property, floatyear_to_date,
 from oggm.exceptions import InvalidWorkflowError
 
 
+def _get_glacier_hbins(gdir, step=10):
+    """Elevation bins covering the glacier and its possible extent."""
+
+    # This is a quick'n dirty optimisation
+    try:
+        fls = gdir.read_pickle('model_flowlines')
+        h = []
+        for fl in fls:
+            # We use bed because of overdeepenings
+            h = np.append(h, fl.bed_h)
+            h = np.append(h, fl.surface_h)
+        zminmax = np.round([np.min(h)-50, np.max(h)+2000])
+    except FileNotFoundError:
+        # in case we don't have them
+        with ncDataset(gdir.get_filepath('gridded_data')) as nc:
+            zminmax = [nc.min_h_dem-250, nc.max_h_dem+1500]
+    return np.arange(*zminmax, step=step)
+
+
 class MassBalanceModel(object, metaclass=SuperclassMeta):
     """Common logic for the mass balance models.
 
@@ -91,6 +110,16 @@ class MassBalanceModel(object, metaclass=SuperclassMeta):
         """
         raise NotImplementedError()
 
+    def _get_annual_mb_years(self, heights, years, **kwargs):
+        """Annual MB for several years at once, shape (n_years, n_heights).
+
+        The default implementation loops over the years: models able to
+        compute all years in one call should override it.
+        """
+        return np.stack([np.atleast_1d(self.get_annual_mb(heights, year=yr,
+                                                          **kwargs))
+                         for yr in years])
+
     def get_specific_mb(self, heights=None, widths=None, fls=None,
                         year=None):
         """Specific mb for this year and a specific glacier geometry.
@@ -117,10 +146,26 @@ class MassBalanceModel(object, metaclass=SuperclassMeta):
         """
 
         if len(np.atleast_1d(year)) > 1:
-            out = [self.get_specific_mb(heights=heights, widths=widths,
-                                        fls=fls, year=yr)
-                   for yr in year]
-            return np.asarray(out)
+            # All years at once: (n_years, n_heights) MB
+            years = np.asarray(year)
+            if fls is not None:
+                mbs = []
+                widths = []
+                for i, fl in enumerate(fls):
+                    _widths = fl.widths
+                    try:
+                        # For rect and parabola don't compute spec mb
+                        _widths = np.where(fl.thick > 0, _widths, 0)
+                    except AttributeError:
+                        pass
+                    widths = np.append(widths, _widths)
+                    mbs.append(self._get_annual_mb_years(fl.surface_h, years,
+                                                         fls=fls, fl_id=i))
+                mbs = np.concatenate(mbs, axis=1)
+            else:
+                mbs = self._get_annual_mb_years(heights, years)
+            return (np.average(mbs, weights=widths, axis=1) *
+                    SEC_IN_YEAR * self.rho)
 
         if fls is not None:
             mbs = []
@@ -146,21 +191,23 @@ class MassBalanceModel(object, metaclass=SuperclassMeta):
 
         Parameters
         ----------
-        year: float, optional
-            the time (in the "hydrological floating year" convention)
+        year: float or array of floats, optional
+            the time (in the "hydrological floating year" convention). If
+            several years are given, the ELAs are computed all at once on
+            an elevation grid (see `_get_ela_years`)
         **kwargs: any other keyword argument accepted by self.get_annual_mb
         Returns
         -------
         the equilibrium line altitude (ELA, units: m)
         """
 
-        if len(np.atleast_1d(year)) > 1:
-            return np.asarray([self.get_ela(year=yr, **kwargs) for yr in year])
-
         if self.valid_bounds is None:
             raise ValueError('attribute `valid_bounds` needs to be '
                              'set for the ELA computation.')
 
+        if len(np.atleast_1d(year)) > 1:
+            return self._get_ela_years(np.asarray(year), **kwargs)
+
         # Check for invalid ELAs
         b0, b1 = self.valid_bounds
         if (np.any(~np.isfinite(
@@ -172,7 +219,71 @@ class MassBalanceModel(object, metaclass=SuperclassMeta):
         def to_minimize(x):
             return (self.get_annual_mb([x], year=year, **kwargs)[0] *
                     SEC_IN_YEAR * self.rho)
-        return optimization.brentq(to_minimize, *self.valid_bounds, xtol=0.1)
+        try:
+            return optimization.brentq(to_minimize, *self.valid_bounds,
+                                       xtol=0.1)
+        except ValueError:
+            # No sign change between the bounds after all: invalid ELA,
+            # like in `_get_ela_years`
+            return np.NaN
+
+    def _get_ela_years(self, years, dz=1., refine=50, **kwargs):
+        """ELA for several years at once, without root finding.
+
+        The MB of all years is evaluated on a coarse elevation grid (spacing
+        of about ``dz * refine`` m) spanning ``valid_bounds``, which brackets
+        the first zero crossing of each year. The brackets are then sampled
+        on a ``dz`` grid and the ELA is linearly interpolated at the zero
+        crossing. Years without a zero crossing between the bounds (or
+        with a non-finite MB at the bounds) are set to NaN, like in
+        `get_ela`.
+        """
+
+        b0, b1 = self.valid_bounds
+        ny = len(years)
+
+        # The coarse grid points are a subset of the fine grid points
+        nc = int(np.ceil((b1 - b0) / (dz * refine)))
+        dzf = (b1 - b0) / (nc * refine)
+
+        def zgrid(j):
+            return b0 + dzf * j
+
+        mb = self._get_annual_mb_years(zgrid(np.arange(nc + 1) * refine),
+                                       years, **kwargs)
+
+        # Check for invalid ELAs
+        out = np.full(ny, np.NaN)
+        ok = (np.all(np.isfinite(mb[:, [0, -1]]), axis=1) &
+              (mb[:, 0] <= 0) & (mb[:, -1] >= 0))
+        if not np.any(ok):
+            return out
+        years = years[ok]
+        mb = mb[ok]
+
+        # The ELA is between the coarse point before the first positive
+        # MB and this one. Sample these brackets on the fine grid.
+        ic = clip_min(np.argmax(mb >= 0, axis=1), 1)
+        j0 = (ic - 1) * refine
+        jlo = np.min(j0)
+        mbf = self._get_annual_mb_years(zgrid(np.arange(jlo, np.max(j0) +
+                                                        refine + 1)),
+                                        years, **kwargs)
+        cols = (j0 - jlo)[:, np.newaxis] + np.arange(refine + 1)
+        mbf = np.take_along_axis(mbf, cols, axis=1)
+
+        # First zero crossing and linear interpolation
+        pos = mbf >= 0
+        k = np.argmax(pos, axis=1)
+        k[~np.any(pos, axis=1)] = refine
+        km1 = clip_min(k - 1, 0)
+        m0 = np.take_along_axis(mbf, km1[:, np.newaxis], axis=1)[:, 0]
+        m1 = np.take_along_axis(mbf, k[:, np.newaxis], axis=1)[:, 0]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            frac = clip_array(np.where(k > 0, m0 / (m0 - m1), 0), 0, 1)
+
+        out[ok] = zgrid(j0 + km1 + frac)
+        return out
 
 
 class ScalarMassBalance(MassBalanceModel):
@@ -257,7 +368,8 @@ class PastMassBalance(MassBalanceModel):
 
     def __init__(self, gdir, mu_star=None, bias=None,
                  filename='climate_historical', input_filesuffix='',
-                 repeat=False, ys=None, ye=None, check_calib_params=True):
+                 repeat=False, ys=None, ye=None, check_calib_params=True,
+                 lookup_dh=None):
         """Initialize.
 
         Parameters
@@ -291,6 +403,13 @@ class PastMassBalance(MassBalanceModel):
             the parameters used during calibration and the ones you are
             using at run time. If they don't match, it will raise an error.
             Set to False to suppress this check.
+        lookup_dh : float, optional
+            opt-in optimisation for long runs: if > 0, the annual MB of each
+            year is computed only once on an elevation grid of this spacing
+            (in m) covering the glacier, and ``get_annual_mb`` interpolates
+            linearly on this grid. Heights outside the grid are computed
+            the usual way. The lookup table is reset when the biases or mu*
+            are changed. The default is cfg.PARAMS['past_mb_lookup_dh'].
 
         Attributes
         ----------
@@ -302,6 +421,7 @@ class PastMassBalance(MassBalanceModel):
         """
 
         super(PastMassBalance, self).__init__()
+        self._mb_lookup = None
         self.valid_bounds = [-1e4, 2e4]  # in m
         if mu_star is None:
             df = gdir.read_json('local_mustar')
@@ -363,11 +483,13 @@ class PastMassBalance(MassBalanceModel):
             self.years = np.repeat(np.arange(time[-1].year-ny+1,
                                              time[-1].year+1), 12)
             self.months = np.tile(np.arange(1, 13), ny)
-            # Read timeseries
-            self.temp = nc.variables['temp'][:]
-            self.prcp = nc.variables['prcp'][:] * prcp_fac
+            # Read timeseries. They are stored as plain 1D arrays, but
+            # are accessed as (n_years, 12) views (see _get_year_index)
+            self.temp = np.ma.filled(nc.variables['temp'][:], np.NaN)
+            self.prcp = np.ma.filled(nc.variables['prcp'][:], np.NaN)
+            self.prcp = self.prcp * prcp_fac
             if 'gradient' in nc.variables:
-                grad = nc.variables['gradient'][:]
+                grad = np.ma.filled(nc.variables['gradient'][:], np.NaN)
                 # Security for stuff that can happen with local gradients
                 g_minmax = cfg.PARAMS['temp_local_gradient_bounds']
                 grad = np.where(~np.isfinite(grad), default_grad, grad)
@@ -379,6 +501,76 @@ class PastMassBalance(MassBalanceModel):
             self.ys = self.years[0] if ys is None else ys
             self.ye = self.years[-1] if ye is None else ye
 
+        # Lookup table for the annual MB
+        if lookup_dh is None:
+            lookup_dh = cfg.PARAMS['past_mb_lookup_dh']
+        self.lookup_hbins = None
+        if lookup_dh > 0:
+            self.lookup_hbins = _get_glacier_hbins(gdir, step=lookup_dh)
+
+    @property
+    def temp_bias(self):
+        """Temperature bias to add to the original series."""
+        return self._temp_bias
+
+    @temp_bias.setter
+    def temp_bias(self, value):
+        """Temperature bias to add to the original series."""
+        self._mb_lookup = None
+        self._temp_bias = value
+
+    @property
+    def prcp_bias(self):
+        """Precipitation factor to apply to the original series."""
+        return self._prcp_bias
+
+    @prcp_bias.setter
+    def prcp_bias(self, value):
+        """Precipitation factor to apply to the original series."""
+        self._mb_lookup = None
+        self._prcp_bias = value
+
+    @property
+    def bias(self):
+        """Residual bias to apply to the original series."""
+        return self._bias
+
+    @bias.setter
+    def bias(self, value):
+        """Residual bias to apply to the original series."""
+        self._mb_lookup = None
+        self._bias = value
+
+    @property
+    def mu_star(self):
+        """Temperature sensitivity of the glacier."""
+        return self._mu_star
+
+    @mu_star.setter
+    def mu_star(self, value):
+        """Temperature sensitivity of the glacier."""
+        self._mb_lookup = None
+        self._mu_star = value
+
+    def _get_year_index(self, year):
+        """Index of the year(s) in the (n_years, 12) climate arrays."""
+
+        year = np.floor(year)
+        if self.repeat:
+            year = self.ys + (year - self.ys) % (self.ye - self.ys + 1)
+        if np.any(year < self.ys) or np.any(year > self.ye):
+            year = np.atleast_1d(year)
+            year = year[(year < self.ys) | (year > self.ye)][0]
+            raise ValueError('year {} out of the valid time bounds: '
+                             '[{}, {}]'.format(year, self.ys, self.ye))
+        iyr = year - self.years[0]
+        ny = len(self.years) // 12
+        if np.any(iyr < 0) or np.any(iyr >= ny):
+            year = np.atleast_1d(year)
+            year = year[(iyr < 0) | (iyr >= ny)][0]
+            raise ValueError('Year {} not in record'.format(int(year)))
+        return np.asarray(iyr, dtype=int)
+
     def get_monthly_climate(self, heights, year=None):
         """Monthly climate information at given heights.
 
@@ -391,12 +583,7 @@ class PastMassBalance(MassBalanceModel):
         """
 
         y, m = floatyear_to_date(year)
-        if self.repeat:
-            y = self.ys + (y - self.ys) % (self.ye - self.ys + 1)
-        if y < self.ys or y > self.ye:
-            raise ValueError('year {} out of the valid time bounds: '
-                             '[{}, {}]'.format(y, self.ys, self.ye))
-        pok = np.where((self.years == y) & (self.months == m))[0][0]
+        pok = self._get_year_index(y) * 12 + m - 1
 
         # Read timeseries
         itemp = self.temp[pok] + self.temp_bias
@@ -417,40 +604,39 @@ class PastMassBalance(MassBalanceModel):
 
         return temp, tempformelt, prcp, prcpsol
 
-    def _get_2d_annual_climate(self, heights, year):
-        # Avoid code duplication with a getter routine
-        year = np.floor(year)
-        if self.repeat:
-            year = self.ys + (year - self.ys) % (self.ye - self.ys + 1)
-        if year < self.ys or year > self.ye:
-            raise ValueError('year {} out of the valid time bounds: '
-                             '[{}, {}]'.format(year, self.ys, self.ye))
-        pok = np.where(self.years == year)[0]
-        if len(pok) < 1:
-            raise ValueError('Year {} not in record'.format(int(year)))
+    def _get_3d_annual_climate(self, heights, years):
+        """Climate for several years at once, shape (n_years, n_heights, 12).
+        """
 
-        # Read timeseries
-        itemp = self.temp[pok] + self.temp_bias
-        iprcp = self.prcp[pok] * self.prcp_bias
-        igrad = self.grad[pok]
+        pok = self._get_year_index(years)
+
+        # Read timeseries as (n_years, 1, 12)
+        itemp = self.temp.reshape((-1, 12))[pok, np.newaxis, :]
+        iprcp = self.prcp.reshape((-1, 12))[pok, np.newaxis, :]
+        igrad = self.grad.reshape((-1, 12))[pok, np.newaxis, :]
+        itemp = itemp + self.temp_bias
+        iprcp = iprcp * self.prcp_bias
 
         # For each height pixel:
         # Compute temp and tempformelt (temperature above melting threshold)
-        heights = np.asarray(heights)
-        npix = len(heights)
-        grad_temp = np.atleast_2d(igrad).repeat(npix, 0)
-        grad_temp *= (heights.repeat(12).reshape(grad_temp.shape) -
-                      self.ref_hgt)
-        temp2d = np.atleast_2d(itemp).repeat(npix, 0) + grad_temp
-        temp2dformelt = temp2d - self.t_melt
-        clip_min(temp2dformelt, 0, out=temp2dformelt)
+        heights = np.asarray(heights)[np.newaxis, :, np.newaxis]
+        # (the gradient term has the precision of the climate data)
+        grad_temp = igrad * (heights - self.ref_hgt)
+        temp3d = itemp + grad_temp.astype(igrad.dtype, copy=False)
+        temp3dformelt = temp3d - self.t_melt
+        clip_min(temp3dformelt, 0, out=temp3dformelt)
 
         # Compute solid precipitation from total precipitation
-        prcp = np.atleast_2d(iprcp).repeat(npix, 0)
-        fac = 1 - (temp2d - self.t_solid) / (self.t_liq - self.t_solid)
-        prcpsol = prcp * clip_array(fac, 0, 1)
+        prcp = np.broadcast_to(iprcp, temp3d.shape)
+        fac = 1 - (temp3d - self.t_solid) / (self.t_liq - self.t_solid)
+        prcpsol = iprcp * clip_array(fac, 0, 1)
 
-        return temp2d, temp2dformelt, prcp, prcpsol
+        return temp3d, temp3dformelt, prcp, prcpsol
+
+    def _get_2d_annual_climate(self, heights, year):
+        # Avoid code duplication with a getter routine
+        out = self._get_3d_annual_climate(heights, [year])
+        return tuple(o[0] for o in out)
 
     def get_annual_climate(self, heights, year=None):
         """Annual climate information at given heights.
@@ -462,9 +648,14 @@ class PastMassBalance(MassBalanceModel):
         -------
         (temp, tempformelt, prcp, prcpsol)
         """
-        t, tfmelt, prcp, prcpsol = self._get_2d_annual_climate(heights, year)
-        return (t.mean(axis=1), tfmelt.sum(axis=1),
-                prcp.sum(axis=1), prcpsol.sum(axis=1))
+        if np.ndim(year) > 0:
+            t, tfmelt, prcp, prcpsol = self._get_3d_annual_climate(heights,
+                                                                   year)
+        else:
+            t, tfmelt, prcp, prcpsol = self._get_2d_annual_climate(heights,
+                                                                   year)
+        return (t.mean(axis=-1), tfmelt.sum(axis=-1),
+                prcp.sum(axis=-1), prcpsol.sum(axis=-1))
 
     def get_monthly_mb(self, heights, year=None, **kwargs):
 
@@ -473,13 +664,63 @@ class PastMassBalance(MassBalanceModel):
         mb_month -= self.bias * SEC_IN_MONTH / SEC_IN_YEAR
         return mb_month / SEC_IN_MONTH / self.rho
 
-    def get_annual_mb(self, heights, year=None, **kwargs):
+    def _get_annual_mb(self, heights, year):
 
-        _, temp2dformelt, _, prcpsol = self._get_2d_annual_climate(heights,
-                                                                   year)
-        mb_annual = np.sum(prcpsol - self.mu_star * temp2dformelt, axis=1)
+        if np.ndim(year) > 0:
+            _, tformelt, _, prcpsol = self._get_3d_annual_climate(heights,
+                                                                  year)
+        else:
+            _, tformelt, _, prcpsol = self._get_2d_annual_climate(heights,
+                                                                  year)
+        mb_annual = np.sum(prcpsol - self.mu_star * tformelt, axis=-1)
         return (mb_annual - self.bias) / SEC_IN_YEAR / self.rho
 
+    def _get_annual_mb_from_lookup(self, heights, year):
+        """Interpolate the annual MB from the (lazily filled) lookup table."""
+
+        hbins = self.lookup_hbins
+        iyr = np.floor(year)
+        if self.repeat:
+            iyr = self.ys + (iyr - self.ys) % (self.ye - self.ys + 1)
+        iyr = int(iyr - self.ys)
+        if iyr < 0 or iyr > (self.ye - self.ys):
+            # Let the original method complain
+            return self._get_annual_mb(heights, year)
+
+        if self._mb_lookup is None:
+            ny = self.ye - self.ys + 1
+            self._mb_lookup = (np.zeros((ny, len(hbins))),
+                               np.zeros(ny, dtype=bool))
+        table, filled = self._mb_lookup
+        if not filled[iyr]:
+            table[iyr, :] = self._get_annual_mb(hbins, year)
+            filled[iyr] = True
+
+        heights = np.atleast_1d(heights).astype(float)
+        out = np.interp(heights, hbins, table[iyr, :])
+        outside = (heights < hbins[0]) | (heights > hbins[-1])
+        if np.any(outside):
+            out[outside] = self._get_annual_mb(heights[outside], year)
+        return out
+
+    def get_annual_mb(self, heights, year=None, **kwargs):
+        """Annual mass-balance at given altitude(s) for one or more years.
+
+        Same as :py:meth:`MassBalanceModel.get_annual_mb`, but ``year`` can
+        also be an array of years: the output is then a
+        (n_years, n_heights) array, computed in one vectorized call.
+        """
+
+        if self.lookup_hbins is not None:
+            if np.ndim(year) > 0:
+                return np.stack([self._get_annual_mb_from_lookup(heights, yr)
+                                 for yr in year])
+            return self._get_annual_mb_from_lookup(heights, year)
+        return self._get_annual_mb(heights, year)
+
+    def _get_annual_mb_years(self, heights, years, **kwargs):
+        return self.get_annual_mb(heights, year=np.asarray(years))
+
 
 class ConstantMassBalance(MassBalanceModel):
     """Constant mass-balance during a chosen period.
@@ -524,20 +765,7 @@ class ConstantMassBalance(MassBalanceModel):
             df = gdir.read_json('local_mustar')
             y0 = df['t_star']
 
-        # This is a quick'n dirty optimisation
-        try:
-            fls = gdir.read_pickle('model_flowlines')
-            h = []
-            for fl in fls:
-                # We use bed because of overdeepenings
-                h = np.append(h, fl.bed_h)
-                h = np.append(h, fl.surface_h)
-            zminmax = np.round([np.min(h)-50, np.max(h)+2000])
-        except FileNotFoundError:
-            # in case we don't have them
-            with ncDataset(gdir.get_filepath('gridded_data')) as nc:
-                zminmax = [nc.min_h_dem-250, nc.max_h_dem+1500]
-        self.hbins = np.arange(*zminmax, step=10)
+        self.hbins = _get_glacier_hbins(gdir)
         self.valid_bounds = self.hbins[[0, -1]]
         self.y0 = y0
         self.halfsize = halfsize
@@ -639,6 +867,18 @@ class ConstantMassBalance(MassBalanceModel):
     def get_annual_mb(self, heights, year=None, **kwargs):
         return self.interp_yr(heights)
 
+    def _get_annual_mb_years(self, heights, years, **kwargs):
+        # Same MB every year
+        mb = np.atleast_1d(self.get_annual_mb(heights))
+        return np.tile(mb, (len(years), 1))
+
+    def get_ela(self, year=None, **kwargs):
+        # Same ELA every year: compute it only once
+        if len(np.atleast_1d(year)) > 1:
+            return np.full(len(year), super(ConstantMassBalance,
+                                            self).get_ela(**kwargs))
+        return super(ConstantMassBalance, self).get_ela(year=year, **kwargs)
+
 
 class RandomMassBalance(MassBalanceModel):
     """Random shuffle of all MB years within a given time period.
@@ -1053,6 +1293,15 @@ class MultipleFlowlineMassBalance(MassBalanceModel):
         return self.flowline_mb_models[fl_id].get_annual_mb(heights,
                                                             year=year)
 
+    def _get_annual_mb_years(self, heights, years, fl_id=None, **kwargs):
+
+        if fl_id is None:
+            raise ValueError('`fl_id` is required for '
+                             'MultipleFlowlineMassBalance!')
+
+        mb_mod = self.flowline_mb_models[fl_id]
+        return mb_mod._get_annual_mb_years(heights, years)
+
     def get_annual_mb_on_flowlines(self, fls=None, year=None):
         """Get the MB on all points of the glacier at once.
 
@@ -1093,8 +1342,16 @@ class MultipleFlowlineMassBalance(MassBalanceModel):
             fls = self.fls
 
         if len(np.atleast_1d(year)) > 1:
-            out = [self.get_specific_mb(fls=fls, year=yr) for yr in year]
-            return np.asarray(out)
+            # All years at once, flowline by flowline
+            years = np.asarray(year)
+            mbs = []
+            widths = []
+            for fl, mb_mod in zip(self.fls, self.flowline_mb_models):
+                mb = mb_mod._get_annual_mb_years(fl.surface_h, years)
+                mbs.append(mb * SEC_IN_YEAR * mb_mod.rho)
+                widths = np.append(widths, fl.widths)
+            return np.average(np.concatenate(mbs, axis=1), weights=widths,
+                              axis=1)
 
         mbs = []
         widths = []
@@ -1110,15 +1367,13 @@ class MultipleFlowlineMassBalance(MassBalanceModel):
         # ELA here is not without ambiguity.
         # We compute a mean weighted by area.
 
-        if len(np.atleast_1d(year)) > 1:
-            return np.asarray([self.get_ela(year=yr) for yr in year])
-
         elas = []
         areas = []
         for fl_id, (fl, mb_mod) in enumerate(zip(self.fls,
                                                  self.flowline_mb_models)):
-            elas = np.append(elas, mb_mod.get_ela(year=year, fl_id=fl_id,
-                                                  fls=self.fls))
+            # Vectorized over the years if there are several of them
+            elas.append(mb_mod.get_ela(year=year, fl_id=fl_id,
+                                       fls=self.fls))
             areas = np.append(areas, np.sum(fl.widths))
 
-        return np.average(elas, weights=areas)
+        return np.average(elas, weights=areas, axis=0)
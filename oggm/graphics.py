@@ -635,8 +635,9 @@ def plot_modeloutput_map(gdirs, ax=None, smap=None, model=None,
     if model is None:
         models = []
         for gdir in gdirs:
-            model = FileModel(gdir.get_filepath('model_run',
-                                                filesuffix=filesuffix))
+            fp, group = utils.get_run_output_location(
+                gdir, 'model_run', filesuffix=filesuffix)
+            model = FileModel(fp, group=group)
             model.run_until(modelyr)
             models.append(model)
     else:
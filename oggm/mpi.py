@@ -63,26 +63,65 @@ def _init_oggm_mpi():
     _imprint("MPI initialized with a worker count of %s" % OGGM_MPI_SIZE)
 
 
-def mpi_master_spin_tasks(task, gdirs):
+def _get_chunks(gdirs, chunksize=None):
+    """Bins the glaciers into chunks of (index, gdir) of equal size."""
+    if chunksize is None:
+        chunksize = cfg.PARAMS['mpi_chunksize']
+    chunksize = max(int(chunksize), 1)
+    items = list(enumerate(gdirs))
+    return [items[i:i+chunksize] for i in range(0, len(items), chunksize)]
+
+
+def mpi_master_spin_tasks(task, gdirs, chunks=None):
+    """Distributes the glaciers to the MPI workers and collects the results.
+
+    The workers ask for a new chunk of glaciers each time they are done with
+    one (self-scheduling), so that the workers which get the small glaciers
+    are not idle while the others are still busy with the large ones.
+
+    Parameters
+    ----------
+    task : callable
+        the (pickleable) function to apply to each glacier
+    gdirs : list
+        the glacier directories (or any other pickleable item)
+    chunks : list, optional
+        list of chunks, each being a list of (index, gdir) tuples. The
+        chunks are sent in this order. The default is to send chunks of
+        cfg.PARAMS['mpi_chunksize'] glaciers in the order of the list.
+
+    Returns
+    -------
+    the list of the task outputs, in the order of gdirs
+    """
     comm = OGGM_MPI_COMM
     cfg_store = cfg.pack_config()
-    msg_list = ([gdir for gdir in gdirs if gdir is not None] +
-                [None] * OGGM_MPI_SIZE)
+    if chunks is None:
+        chunks = _get_chunks(gdirs)
+    chunks = [[(i, gdir) for i, gdir in chunk if gdir is not None]
+              for chunk in chunks]
+    msg_list = [chunk for chunk in chunks if chunk] + [None] * OGGM_MPI_SIZE
 
     _imprint("Starting MPI task distribution...")
 
     comm.bcast((cfg_store, task), root=OGGM_MPI_ROOT)
 
+    out = [None] * len(gdirs)
     status = MPI.Status()
     for msg in msg_list:
-        comm.recv(source=MPI.ANY_SOURCE, status=status)
+        res = comm.recv(source=MPI.ANY_SOURCE, status=status)
         comm.send(obj=msg, dest=status.Get_source())
+        for i, r in res:
+            out[i] = r
 
     _imprint("MPI task distribution done, collecting results...")
 
-    comm.gather(sendobj=None, root=OGGM_MPI_ROOT)
+    for res in comm.gather(sendobj=None, root=OGGM_MPI_ROOT):
+        for i, r in (res or []):
+            out[i] = r
 
     _imprint("MPI task results gotten!")
+    return out
 
 
 def _mpi_slave_bcast(comm):
@@ -92,13 +131,13 @@ def _mpi_slave_bcast(comm):
     return task_func
 
 
-def _mpi_slave_sendrecv(comm):
+def _mpi_slave_sendrecv(comm, results):
     try:
         bufsize = int(cfg.PARAMS['mpi_recv_buf_size'])
     except BaseException:
         bufsize = None
 
-    sreq = comm.isend(1, dest=OGGM_MPI_ROOT)
+    sreq = comm.isend(results, dest=OGGM_MPI_ROOT)
     rreq = comm.irecv(source=OGGM_MPI_ROOT, buf=bufsize)
     return sreq, rreq
 
@@ -110,20 +149,24 @@ def _mpi_slave():
     _imprint("MPI worker %s ready!" % rank)
 
     task_func = _mpi_slave_bcast(comm)
-    sreq, rreq = _mpi_slave_sendrecv(comm)
+    sreq, rreq = _mpi_slave_sendrecv(comm, [])
 
+    # The results of a chunk are sent along with the request for the next
+    # but one chunk: the next chunk is already on its way while working
+    results = []
     while True:
         sreq.wait()
-        task = rreq.wait()
-        if task is None:
-            comm.gather(sendobj="TASK_DONE", root=OGGM_MPI_ROOT)
+        chunk = rreq.wait()
+        if chunk is None:
+            comm.gather(sendobj=results, root=OGGM_MPI_ROOT)
             task_func = _mpi_slave_bcast(comm)
-            sreq, rreq = _mpi_slave_sendrecv(comm)
+            sreq, rreq = _mpi_slave_sendrecv(comm, [])
+            results = []
             continue
-        elif task is StopIteration:
+        elif chunk is StopIteration:
             break
-        sreq, rreq = _mpi_slave_sendrecv(comm)
-        task_func(task)
+        sreq, rreq = _mpi_slave_sendrecv(comm, results)
+        results = [(i, task_func(gdir)) for i, gdir in chunk]
     comm.gather(sendobj="WORKER_SHUTDOWN", root=OGGM_MPI_ROOT)
 
     _imprint("MPI Worker %s exiting" % rank)
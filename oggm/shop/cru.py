@@ -16,7 +16,7 @@ except ImportError:
 # Locals
 from oggm import cfg
 from oggm import utils
-from oggm import entity_task
+from oggm import entity_task, global_task
 from oggm.exceptions import MassBalanceCalibrationError, InvalidParamsError
 
 # Module logger
@@ -71,84 +71,63 @@ def get_cru_file(var=None):
     return utils.file_extractor(utils.file_downloader(cru_url))
 
 
-@entity_task(log, writes=['climate_historical'])
-def process_cru_data(gdir, tmp_file=None, pre_file=None, y0=None, y1=None,
-                     output_filesuffix=None):
-    """Processes and writes the CRU baseline climate data for this glacier.
+class _GriddedRegion(object):
+    """Gridded data read at once over the region covering a set of points.
 
-    Interpolates the CRU TS data to the high-resolution CL2 climatologies
-    (provided with OGGM) and writes everything to a NetCDF file.
-
-    Parameters
-    ----------
-    gdir : :py:class:`oggm.GlacierDirectory`
-        the glacier directory to process
-    tmp_file : str
-        path to the CRU temperature file (defaults to the current OGGM chosen
-        CRU version)
-    pre_file : str
-        path to the CRU precip file (defaults to the current OGGM chosen
-        CRU version)
-    y0 : int
-        the starting year of the timeseries to write. The default is to take
-        the entire time period available in the file, but with this kwarg
-        you can shorten it (to save space or to crop bad data)
-    y1 : int
-        the starting year of the timeseries to write. The default is to take
-        the entire time period available in the file, but with this kwarg
-        you can shorten it (to save space or to crop bad data)
-    output_filesuffix : str
-        this add a suffix to the output file (useful to avoid overwriting
-        previous experiments)
+    The windows around the grid points are selected like
+    ``set_subset(corners=((lon, lat), (lon, lat)), margin=margin)`` would
+    on the full dataset.
     """
 
-    if cfg.PATHS.get('climate_file', None):
-        warnings.warn("You seem to have set a custom climate file for this "
-                      "run, but are using the default CRU climate "
-                      "file instead.")
-
-    if cfg.PARAMS['baseline_climate'] != 'CRU':
-        raise InvalidParamsError("cfg.PARAMS['baseline_climate'] should be "
-                                 "set to CRU")
-
-    # read the climatology
-    ncclim = salem.GeoNetcdf(get_cru_cl_file())
-
-    # and the TS data
-    if tmp_file is None:
-        tmp_file = get_cru_file('tmp')
-    if pre_file is None:
-        pre_file = get_cru_file('pre')
-    nc_ts_tmp = salem.GeoNetcdf(tmp_file, monthbegin=True)
-    nc_ts_pre = salem.GeoNetcdf(pre_file, monthbegin=True)
-
-    # set temporal subset for the ts data (hydro years)
-    sm = cfg.PARAMS['hydro_month_' + gdir.hemisphere]
-    em = sm - 1 if (sm > 1) else 12
-    yrs = nc_ts_pre.time.year
-    y0 = yrs[0] if y0 is None else y0
-    y1 = yrs[-1] if y1 is None else y1
-
-    nc_ts_tmp.set_period(t0='{}-{:02d}-01'.format(y0, sm),
-                         t1='{}-{:02d}-01'.format(y1, em))
-    nc_ts_pre.set_period(t0='{}-{:02d}-01'.format(y0, sm),
-                         t1='{}-{:02d}-01'.format(y1, em))
-    time = nc_ts_pre.time
-    ny, r = divmod(len(time), 12)
-    assert r == 0
-
-    lon = gdir.cenlon
-    lat = gdir.cenlat
+    def __init__(self, nc, lons, lats, varnames, margin=1):
+
+        nc.set_subset()
+        self.full_grid = nc.grid
+        self.mx = nc.grid.nx - 1
+        self.my = nc.grid.ny - 1
+        nc.set_subset(corners=((np.min(lons), np.min(lats)),
+                               (np.max(lons), np.max(lats))),
+                      margin=margin)
+        self.grid = nc.grid
+        self.x0, self.x1 = nc.sub_x
+        self.y0, self.y1 = nc.sub_y
+        self.data = {v: np.ma.filled(nc.get_vardata(v), np.NaN)
+                     for v in varnames}
+        nc.set_subset()
+
+    def cells(self, lons, lats):
+        """The grid cells (i, j) containing the points, in the full grid."""
+        return self.full_grid.center_grid.transform(lons, lats,
+                                                    crs=salem.wgs84,
+                                                    nearest=True)
+
+    def window(self, i, j, margin=1):
+        """The slices of the window around a cell (None if not read)."""
+        x0, x1 = max(i - margin, 0), min(i + margin, self.mx)
+        y0, y1 = max(j - margin, 0), min(j + margin, self.my)
+        if x0 > x1 or y0 > y1:
+            raise RuntimeError('subset not valid')
+        if x0 < self.x0 or x1 > self.x1 or y0 < self.y0 or y1 > self.y1:
+            return None
+        return (slice(y0 - self.y0, y1 - self.y0 + 1),
+                slice(x0 - self.x0, x1 - self.x0 + 1))
+
+
+def _get_cru_cl_point(cl, ncclim, lon, lat, rgi_id):
+    """The CRU CL data around the glacier (the 3*3 pixels around it).
+
+    Glaciers in regions without valid climatology take the nearest valid
+    pixel instead.
+    """
 
-    # This is guaranteed to work because I prepared the file (I hope)
-    ncclim.set_subset(corners=((lon, lat), (lon, lat)), margin=1)
+    cl_vars = ['elev', 'temp', 'prcp', 'lon', 'lat']
 
-    # get climatology data
-    loc_hgt = ncclim.get_vardata('elev')
-    loc_tmp = ncclim.get_vardata('temp')
-    loc_pre = ncclim.get_vardata('prcp')
-    loc_lon = ncclim.get_vardata('lon')
-    loc_lat = ncclim.get_vardata('lat')
+    i, j = cl.cells(lon, lat)
+    win = cl.window(i, j)
+    if win is None:
+        cl = _GriddedRegion(ncclim, lon, lat, cl_vars)
+        win = cl.window(i, j)
+    loc_hgt = cl.data['elev'][win]
 
     # see if the center is ok
     if not np.isfinite(loc_hgt[1, 1]):
@@ -159,27 +138,43 @@ def process_cru_data(gdir, tmp_file=None, pre_file=None, y0=None, y1=None,
         _margin = 1
         while not np.any(isok):
             _margin += 1
-            ncclim.set_subset(corners=((lon, lat), (lon, lat)), margin=_margin)
-            loc_hgt = ncclim.get_vardata('elev')
+            win = cl.window(i, j, margin=_margin)
+            if win is None:
+                cl = _GriddedRegion(ncclim, lon, lat, cl_vars,
+                                    margin=_margin + 5)
+                win = cl.window(i, j, margin=_margin)
+            loc_hgt = cl.data['elev'][win]
             isok = np.isfinite(loc_hgt)
         if _margin > 1:
             log.debug('(%s) I had to look up for far climate pixels: %s',
-                      gdir.rgi_id, _margin)
+                      rgi_id, _margin)
 
         # Take the first candidate (doesn't matter which)
-        lon, lat = ncclim.grid.ll_coordinates
-        lon = lon[isok][0]
-        lat = lat[isok][0]
-        # Resubset
-        ncclim.set_subset()
-        ncclim.set_subset(corners=((lon, lat), (lon, lat)), margin=1)
-        loc_hgt = ncclim.get_vardata('elev')
-        loc_tmp = ncclim.get_vardata('temp')
-        loc_pre = ncclim.get_vardata('prcp')
-        loc_lon = ncclim.get_vardata('lon')
-        loc_lat = ncclim.get_vardata('lat')
+        lon, lat = cl.grid.ll_coordinates
+        lon = lon[win][isok][0]
+        lat = lat[win][isok][0]
+        i, j = cl.cells(lon, lat)
+        win = cl.window(i, j)
+        if win is None:
+            cl = _GriddedRegion(ncclim, lon, lat, cl_vars)
+            win = cl.window(i, j)
+
+    out = dict(lon=lon, lat=lat, cell=(int(i), int(j)))
+    # the center of the climatology pixel, as located by the grid
+    grid_lon, grid_lat = cl.grid.ll_coordinates
+    out['grid_lon'] = grid_lon[win][1, 1]
+    out['grid_lat'] = grid_lat[win][1, 1]
+    out['hgt'] = cl.data['elev'][win]
+    out['tmp'] = cl.data['temp'][(slice(None),) + win]
+    out['pre'] = cl.data['prcp'][(slice(None),) + win]
+    out['lon_c'] = cl.data['lon'][win[1]][1]
+    out['lat_c'] = cl.data['lat'][win[0]][1]
+    return out
+
+
+def _get_cru_gradient(loc_hgt, loc_tmp, em, ny):
+    """The temperature gradient from the CRU CL pixels, if asked for."""
 
-    assert np.isfinite(loc_hgt[1, 1])
     isok = np.isfinite(loc_hgt)
     hgt_f = loc_hgt[isok].flatten()
     assert len(hgt_f) > 0.
@@ -197,102 +192,359 @@ def process_cru_data(gdir, tmp_file=None, pre_file=None, y0=None, y1=None,
         ts_grad = ts_grad.tolist()
         ts_grad = ts_grad[em:] + ts_grad[0:em]
         ts_grad = np.asarray(ts_grad * ny)
+    return ts_grad
+
+
+def _iter_cru_data(gdirs, tmp_file=None, pre_file=None, y0=None, y1=None,
+                   tile_size=10):
+    """Extracts the CRU climate data of many glaciers.
+
+    Each file is opened once, and the anomalies are computed once per
+    tile of glaciers (see :py:func:`utils.group_gdirs_by_tile`).
+
+    Yields
+    ------
+    (gdir, data) tuples, where data is a dict of arguments to
+    :py:meth:`GlacierDirectory.write_monthly_climate_file`, or the
+    exception which occurred when extracting the data for this glacier.
+    """
+
+    # read the climatology
+    cl_file = get_cru_cl_file()
+    ncclim = salem.GeoNetcdf(cl_file)
+
+    # and the TS data
+    if tmp_file is None:
+        tmp_file = get_cru_file('tmp')
+    if pre_file is None:
+        pre_file = get_cru_file('pre')
+    nc_ts_tmp = salem.GeoNetcdf(tmp_file, monthbegin=True)
+    nc_ts_pre = salem.GeoNetcdf(pre_file, monthbegin=True)
+    source = nc_ts_tmp._nc.title[:10]
+
+    cache = utils.get_grid_cell_cache('cru')
+    if cache is not None:
+        files = [cache.file_key(f) for f in (cl_file, tmp_file, pre_file)]
+        cache = (cache, files)
+
+    try:
+        for tile in utils.group_gdirs_by_tile(gdirs, tile_size=tile_size):
+            yield from _iter_cru_tile(tile, ncclim, nc_ts_tmp, nc_ts_pre,
+                                      y0=y0, y1=y1, source=source,
+                                      cache=cache)
+    finally:
+        ncclim._nc.close()
+        nc_ts_tmp._nc.close()
+        nc_ts_pre._nc.close()
+
+
+def _iter_cru_tile(gdirs, ncclim, nc_ts_tmp, nc_ts_pre, y0=None, y1=None,
+                   source=None, cache=None):
+    """Extracts the CRU climate data of glaciers in the same tile.
+
+    The data only depends on the climatology and TS grid cells of the
+    glacier: if a cache is given (a (:py:class:`utils.GridCellCache`,
+    file keys) tuple), the data is extracted only for the cells which are
+    not in the cache yet.
+    """
 
-    # maybe this will throw out of bounds warnings
-    nc_ts_tmp.set_subset(corners=((lon, lat), (lon, lat)), margin=1)
-    nc_ts_pre.set_subset(corners=((lon, lat), (lon, lat)), margin=1)
+    # set temporal subset for the ts data (hydro years)
+    sm = cfg.PARAMS['hydro_month_' + gdirs[0].hemisphere]
+    em = sm - 1 if (sm > 1) else 12
+    nc_ts_tmp.set_period()
+    nc_ts_pre.set_period()
+    yrs = nc_ts_pre.time.year
+    y0 = yrs[0] if y0 is None else y0
+    y1 = yrs[-1] if y1 is None else y1
+
+    nc_ts_tmp.set_period(t0='{}-{:02d}-01'.format(y0, sm),
+                         t1='{}-{:02d}-01'.format(y1, em))
+    nc_ts_pre.set_period(t0='{}-{:02d}-01'.format(y0, sm),
+                         t1='{}-{:02d}-01'.format(y1, em))
+    time = nc_ts_pre.time
+    ny, r = divmod(len(time), 12)
+    assert r == 0
+
+    # get climatology data
+    lons = np.array([gdir.cenlon for gdir in gdirs])
+    lats = np.array([gdir.cenlat for gdir in gdirs])
+    cl = _GriddedRegion(ncclim, lons, lats,
+                        ['elev', 'temp', 'prcp', 'lon', 'lat'], margin=3)
+    cl_data = dict()
+    for gdir, lon, lat in zip(gdirs, lons, lats):
+        try:
+            d = _get_cru_cl_point(cl, ncclim, lon, lat, gdir.rgi_id)
+            assert np.isfinite(d['hgt'][1, 1])
+            cl_data[gdir.rgi_id] = d
+        except Exception as err:
+            cl_data[gdir.rgi_id] = err
+    ok = [gdir for gdir in gdirs if isinstance(cl_data[gdir.rgi_id], dict)]
+
+    # the glaciers in cells we already know about
+    keys = dict()
+    if cache is not None and ok:
+        cache, files = cache
+        nc_ts_tmp.set_subset()
+        ti, tj = nc_ts_tmp.grid.center_grid.transform(
+            [cl_data[gdir.rgi_id]['lon'] for gdir in ok],
+            [cl_data[gdir.rgi_id]['lat'] for gdir in ok],
+            crs=salem.wgs84, nearest=True)
+        use_grad = cfg.PARAMS['temp_use_local_gradient']
+        for gdir, i, j in zip(ok, ti, tj):
+            key = cache.make_key('CRU', files, cl_data[gdir.rgi_id]['cell'],
+                                 (int(i), int(j)), int(y0), int(y1), sm,
+                                 use_grad)
+            data = cache.get(key)
+            if data is None:
+                keys[gdir.rgi_id] = key
+            else:
+                cl_data[gdir.rgi_id] = data
+        ok = [gdir for gdir in ok if gdir.rgi_id in keys]
+
+    for gdir in ok:
+        d = cl_data[gdir.rgi_id]
+        try:
+            d['grad'] = _get_cru_gradient(d['hgt'], d['tmp'], em, ny)
+        except Exception as err:
+            cl_data[gdir.rgi_id] = err
+    ok = [gdir for gdir in ok if isinstance(cl_data[gdir.rgi_id], dict)]
+    if not ok:
+        for gdir in gdirs:
+            yield gdir, cl_data[gdir.rgi_id]
+        return
+    cl_ok = [cl_data[gdir.rgi_id] for gdir in ok]
+
+    # read the TS data around the climatology points
+    lons = np.array([d['lon'] for d in cl_ok])
+    lats = np.array([d['lat'] for d in cl_ok])
+    ts_tmp = _GriddedRegion(nc_ts_tmp, lons, lats, ['tmp'])
+    ts_pre = _GriddedRegion(nc_ts_pre, lons, lats, ['pre'])
+    ts_tmp, ts_pre, ts = ts_tmp.data['tmp'], ts_pre.data['pre'], ts_tmp
 
     # compute monthly anomalies
+    months = time.month.values - 1
+    ref = (time >= '1961-01-01') & (time <= '1990-12-01')
+    with warnings.catch_warnings():
+        # Mean of empty slices
+        warnings.simplefilter('ignore', RuntimeWarning)
+        ts_tmp_avg = np.stack([np.nanmean(ts_tmp[ref & (months == m)],
+                                          axis=0) for m in range(12)])
+        ts_pre_avg = np.stack([np.nanmean(ts_pre[ref & (months == m)],
+                                          axis=0) for m in range(12)])
     # of temp
-    ts_tmp = nc_ts_tmp.get_vardata('tmp', as_xarray=True)
-    ts_tmp_avg = ts_tmp.sel(time=slice('1961-01-01', '1990-12-01'))
-    ts_tmp_avg = ts_tmp_avg.groupby('time.month').mean(dim='time')
-    ts_tmp = ts_tmp.groupby('time.month') - ts_tmp_avg
+    ts_tmp = ts_tmp - ts_tmp_avg[months]
     # of precip
-    ts_pre = nc_ts_pre.get_vardata('pre', as_xarray=True)
-    ts_pre_avg = ts_pre.sel(time=slice('1961-01-01', '1990-12-01'))
-    ts_pre_avg = ts_pre_avg.groupby('time.month').mean(dim='time')
-    ts_pre_ano = ts_pre.groupby('time.month') - ts_pre_avg
+    ts_pre_ano = ts_pre - ts_pre_avg[months]
     # scaled anomalies is the default. Standard anomalies above
     # are used later for where ts_pre_avg == 0
-    ts_pre = ts_pre.groupby('time.month') / ts_pre_avg
-
-    # interpolate to HR grid
-    if np.any(~np.isfinite(ts_tmp[:, 1, 1])):
-        # Extreme case, middle pix is not valid
-        # take any valid pix from the 3*3 (and hope there's one)
-        found_it = False
-        for idi in range(2):
-            for idj in range(2):
-                if np.all(np.isfinite(ts_tmp[:, idj, idi])):
-                    ts_tmp[:, 1, 1] = ts_tmp[:, idj, idi]
-                    ts_pre[:, 1, 1] = ts_pre[:, idj, idi]
-                    ts_pre_ano[:, 1, 1] = ts_pre_ano[:, idj, idi]
-                    found_it = True
-        if not found_it:
-            msg = '({}) there is no climate data'.format(gdir.rgi_id)
-            raise MassBalanceCalibrationError(msg)
-    elif np.any(~np.isfinite(ts_tmp)):
-        # maybe the side is nan, but we can do nearest
-        ts_tmp = ncclim.grid.map_gridded_data(ts_tmp.values, nc_ts_tmp.grid,
-                                              interp='nearest')
-        ts_pre = ncclim.grid.map_gridded_data(ts_pre.values, nc_ts_pre.grid,
-                                              interp='nearest')
-        ts_pre_ano = ncclim.grid.map_gridded_data(ts_pre_ano.values,
-                                                  nc_ts_pre.grid,
-                                                  interp='nearest')
-    else:
-        # We can do bilinear
-        ts_tmp = ncclim.grid.map_gridded_data(ts_tmp.values, nc_ts_tmp.grid,
-                                              interp='linear')
-        ts_pre = ncclim.grid.map_gridded_data(ts_pre.values, nc_ts_pre.grid,
-                                              interp='linear')
-        ts_pre_ano = ncclim.grid.map_gridded_data(ts_pre_ano.values,
-                                                  nc_ts_pre.grid,
-                                                  interp='linear')
-
-    # take the center pixel and add it to the CRU CL clim
-    # for temp
-    loc_tmp = xr.DataArray(loc_tmp[:, 1, 1], dims=['month'],
-                           coords={'month': ts_tmp_avg.month})
-    ts_tmp = xr.DataArray(ts_tmp[:, 1, 1], dims=['time'],
-                          coords={'time': time})
-    ts_tmp = ts_tmp.groupby('time.month') + loc_tmp
-    # for prcp
-    loc_pre = xr.DataArray(loc_pre[:, 1, 1], dims=['month'],
-                           coords={'month': ts_pre_avg.month})
-    ts_pre = xr.DataArray(ts_pre[:, 1, 1], dims=['time'],
-                          coords={'time': time})
-    ts_pre_ano = xr.DataArray(ts_pre_ano[:, 1, 1], dims=['time'],
-                              coords={'time': time})
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ts_pre = ts_pre / ts_pre_avg[months]
+    tmp_ok = np.all(np.isfinite(ts_tmp), axis=0)
+
+    # where to take the data: the indices and weights of the four pixels
+    # around the climatology center point
+    n = len(ok)
+    i0, j0 = np.zeros(n, dtype=int), np.zeros(n, dtype=int)
+    wi, wj = np.zeros(n), np.zeros(n)
+    bilinear = np.zeros(n, dtype=bool)
+    cl_lons = np.array([d['grid_lon'] for d in cl_ok])
+    cl_lats = np.array([d['grid_lat'] for d in cl_ok])
+    cl_ni, cl_nj = ts.grid.center_grid.transform(cl_lons, cl_lats,
+                                                 crs=salem.wgs84,
+                                                 nearest=True)
+    cl_i, cl_j = ts.grid.center_grid.transform(cl_lons, cl_lats,
+                                               crs=salem.wgs84)
+    ci, cj = ts.cells(lons, lats)
+    for k, gdir in enumerate(ok):
+        win = ts.window(ci[k], cj[k])
+        wok = tmp_ok[win]
+        if not (win[1].start <= cl_i[k] <= win[1].stop - 1 and
+                win[0].start <= cl_j[k] <= win[0].stop - 1):
+            # Only happens at the border of the dataset
+            msg = ('({}) the climatology pixel is outside of the climate '
+                   'data'.format(gdir.rgi_id))
+            cl_data[gdir.rgi_id] = MassBalanceCalibrationError(msg)
+        elif not wok[1, 1]:
+            # Extreme case, middle pix is not valid
+            # take any valid pix from the 3*3 (and hope there's one)
+            found_it = False
+            for idi in range(2):
+                for idj in range(2):
+                    if wok[idj, idi]:
+                        j0[k] = win[0].start + idj
+                        i0[k] = win[1].start + idi
+                        found_it = True
+            if not found_it:
+                msg = '({}) there is no climate data'.format(gdir.rgi_id)
+                cl_data[gdir.rgi_id] = MassBalanceCalibrationError(msg)
+        elif not np.all(wok):
+            # maybe the side is nan, but we can do nearest
+            j0[k], i0[k] = cl_nj[k], cl_ni[k]
+        else:
+            # We can do bilinear
+            bilinear[k] = True
+            i0[k] = min(np.floor(cl_i[k]), win[1].stop - 2)
+            j0[k] = min(np.floor(cl_j[k]), win[0].stop - 2)
+            wi[k] = cl_i[k] - i0[k]
+            wj[k] = cl_j[k] - j0[k]
+
+    def _gather(data):
+        out = data[:, j0, i0].astype(np.float64)
+        b = bilinear
+        out[:, b] = (data[:, j0[b], i0[b]] * (1 - wj[b]) * (1 - wi[b]) +
+                     data[:, j0[b] + 1, i0[b]] * wj[b] * (1 - wi[b]) +
+                     data[:, j0[b], i0[b] + 1] * (1 - wj[b]) * wi[b] +
+                     data[:, j0[b] + 1, i0[b] + 1] * wj[b] * wi[b])
+        return out
+
+    ts_tmp = _gather(ts_tmp)
+    ts_pre = _gather(ts_pre)
+    ts_pre_ano = _gather(ts_pre_ano)
+
+    # add the anomalies to the CRU CL clim of the center pixel
+    loc_tmp = np.stack([d['tmp'][:, 1, 1] for d in cl_ok], axis=1)
+    loc_pre = np.stack([d['pre'][:, 1, 1] for d in cl_ok], axis=1)
+    ts_tmp = ts_tmp + loc_tmp[months]
     # scaled anomalies
-    ts_pre = ts_pre.groupby('time.month') * loc_pre
+    ts_pre = ts_pre * loc_pre[months]
     # standard anomalies
-    ts_pre_ano = ts_pre_ano.groupby('time.month') + loc_pre
+    ts_pre_ano = ts_pre_ano + loc_pre[months]
     # Correct infinite values with standard anomalies
-    ts_pre.values = np.where(np.isfinite(ts_pre.values),
-                             ts_pre.values,
-                             ts_pre_ano.values)
+    ts_pre = np.where(np.isfinite(ts_pre), ts_pre, ts_pre_ano)
     # The last step might create negative values (unlikely). Clip them
-    ts_pre.values = utils.clip_min(ts_pre.values, 0)
+    ts_pre = utils.clip_min(ts_pre, 0)
+
+    for k, gdir in enumerate(ok):
+        d = cl_data[gdir.rgi_id]
+        if not isinstance(d, dict):
+            continue
+        try:
+            assert np.all(np.isfinite(ts_pre[:, k]))
+            assert np.all(np.isfinite(ts_tmp[:, k]))
+            cl_data[gdir.rgi_id] = dict(time=time,
+                                        prcp=ts_pre[:, k],
+                                        temp=ts_tmp[:, k],
+                                        ref_pix_hgt=d['hgt'][1, 1],
+                                        ref_pix_lon=d['lon_c'],
+                                        ref_pix_lat=d['lat_c'],
+                                        gradient=d['grad'],
+                                        source=source)
+        except AssertionError as err:
+            cl_data[gdir.rgi_id] = err
+            continue
+        if gdir.rgi_id in keys:
+            cache.set(keys[gdir.rgi_id], cl_data[gdir.rgi_id])
+
+    for gdir in gdirs:
+        yield gdir, cl_data[gdir.rgi_id]
+
+
+def _check_cru_setup():
+    """Checks the config before using the CRU data."""
 
-    # done
-    loc_hgt = loc_hgt[1, 1]
-    loc_lon = loc_lon[1]
-    loc_lat = loc_lat[1]
-    assert np.isfinite(loc_hgt)
-    assert np.all(np.isfinite(ts_pre.values))
-    assert np.all(np.isfinite(ts_tmp.values))
+    if cfg.PATHS.get('climate_file', None):
+        warnings.warn("You seem to have set a custom climate file for this "
+                      "run, but are using the default CRU climate "
+                      "file instead.")
 
-    gdir.write_monthly_climate_file(time, ts_pre.values, ts_tmp.values,
-                                    loc_hgt, loc_lon, loc_lat,
-                                    filesuffix=output_filesuffix,
-                                    gradient=ts_grad,
-                                    source=nc_ts_tmp._nc.title[:10])
+    if cfg.PARAMS['baseline_climate'] != 'CRU':
+        raise InvalidParamsError("cfg.PARAMS['baseline_climate'] should be "
+                                 "set to CRU")
 
-    ncclim._nc.close()
-    nc_ts_tmp._nc.close()
-    nc_ts_pre._nc.close()
+
+@entity_task(log, writes=['climate_historical'])
+def process_cru_data(gdir, tmp_file=None, pre_file=None, y0=None, y1=None,
+                     output_filesuffix=None, climate_data=None):
+    """Processes and writes the CRU baseline climate data for this glacier.
+
+    Interpolates the CRU TS data to the high-resolution CL2 climatologies
+    (provided with OGGM) and writes everything to a NetCDF file.
+
+    Parameters
+    ----------
+    gdir : :py:class:`oggm.GlacierDirectory`
+        the glacier directory to process
+    tmp_file : str
+        path to the CRU temperature file (defaults to the current OGGM chosen
+        CRU version)
+    pre_file : str
+        path to the CRU precip file (defaults to the current OGGM chosen
+        CRU version)
+    y0 : int
+        the starting year of the timeseries to write. The default is to take
+        the entire time period available in the file, but with this kwarg
+        you can shorten it (to save space or to crop bad data)
+    y1 : int
+        the starting year of the timeseries to write. The default is to take
+        the entire time period available in the file, but with this kwarg
+        you can shorten it (to save space or to crop bad data)
+    output_filesuffix : str
+        this add a suffix to the output file (useful to avoid overwriting
+        previous experiments)
+    climate_data : dict
+        the climate data of this glacier, already extracted by
+        :py:func:`process_cru_data_batched` (the file and period arguments
+        are then ignored)
+    """
+
+    _check_cru_setup()
+
+    if climate_data is None:
+        _, climate_data = next(_iter_cru_data([gdir], tmp_file=tmp_file,
+                                              pre_file=pre_file,
+                                              y0=y0, y1=y1))
+    if isinstance(climate_data, Exception):
+        # Raise here so that the error is logged for this glacier
+        raise climate_data
+
+    gdir.write_monthly_climate_file(filesuffix=output_filesuffix,
+                                    **climate_data)
+
+
+@global_task
+def process_cru_data_batched(gdirs, tmp_file=None, pre_file=None, y0=None,
+                             y1=None, output_filesuffix=None, tile_size=10):
+    """Processes and writes the CRU baseline climate data for many glaciers.
+
+    Same as :py:func:`process_cru_data`, but the files are opened only once
+    and the anomalies are computed only once for all glaciers in the same
+    tile, which is much faster for large number of glaciers.
+
+    Parameters
+    ----------
+    gdirs : list of :py:class:`oggm.GlacierDirectory` objects
+        the glacier directories to process
+    tmp_file : str
+        path to the CRU temperature file (defaults to the current OGGM chosen
+        CRU version)
+    pre_file : str
+        path to the CRU precip file (defaults to the current OGGM chosen
+        CRU version)
+    y0 : int
+        the starting year of the timeseries to write. The default is to take
+        the entire time period available in the file, but with this kwarg
+        you can shorten it (to save space or to crop bad data)
+    y1 : int
+        the starting year of the timeseries to write. The default is to take
+        the entire time period available in the file, but with this kwarg
+        you can shorten it (to save space or to crop bad data)
+    output_filesuffix : str
+        this add a suffix to the output file (useful to avoid overwriting
+        previous experiments)
+    tile_size : float
+        the glaciers are processed per tiles of this size (in degrees), to
+        limit the amount of data read in memory at once
+    """
+
+    _check_cru_setup()
+
+    gdirs = [gdir for gdir in utils.tolist(gdirs) if gdir is not None]
+    for gdir, climate_data in _iter_cru_data(gdirs, tmp_file=tmp_file,
+                                             pre_file=pre_file,
+                                             y0=y0, y1=y1,
+                                             tile_size=tile_size):
+        process_cru_data(gdir, output_filesuffix=output_filesuffix,
+                         climate_data=climate_data)
 
 
 @entity_task(log, writes=['climate_historical'])
@@ -2,7 +2,10 @@ import logging
 import warnings
 
 # External libs
+import numpy as np
+import pandas as pd
 import xarray as xr
+from scipy.spatial import cKDTree
 
 # Optional libs
 try:
@@ -13,7 +16,7 @@ except ImportError:
 # Locals
 from oggm import cfg
 from oggm import utils
-from oggm import entity_task
+from oggm import entity_task, global_task
 from oggm.exceptions import InvalidParamsError
 
 # Module logger
@@ -88,9 +91,236 @@ def get_ecmwf_file(dataset='ERA5', var=None):
     return utils.file_downloader(ECMWF_SERVER + BASENAMES[dataset][var])
 
 
+def _nearest_cells(ds, lons, lats):
+    """The indices of the nearest grid points to many locations.
+
+    Returns an array of shape (n, 1) for flattened data or point stores
+    (the point indices), and of shape (n, 2) for gridded data (the
+    longitude and latitude indices).
+    """
+
+    if isinstance(ds, utils.PointSeriesStore):
+        return ds.nearest(lons, lats)[:, np.newaxis]
+    try:
+        ii = ds.indexes['longitude'].get_indexer(lons, method='nearest')
+        jj = ds.indexes['latitude'].get_indexer(lats, method='nearest')
+    except KeyError:
+        # Flattened ERA5
+        tree = cKDTree(np.stack([ds.longitude.values, ds.latitude.values],
+                                axis=1))
+        _, ip = tree.query(np.stack([lons, lats], axis=1))
+        return ip[:, np.newaxis]
+    return np.stack([ii, jj], axis=1)
+
+
+def _sel_nearest(ds, lons, lats):
+    """Selects the nearest grid points to many locations at once.
+
+    The locations are along a new 'gdir' dimension. For gridded data, the
+    box around all locations is read only once.
+    """
+
+    cells = _nearest_cells(ds, lons, lats)
+    if cells.shape[1] == 1:
+        return ds.isel(points=xr.DataArray(cells[:, 0], dims='gdir')).load()
+
+    ii, jj = cells.T
+    ds = ds.isel(longitude=slice(ii.min(), ii.max() + 1),
+                 latitude=slice(jj.min(), jj.max() + 1)).load()
+    return ds.isel(longitude=xr.DataArray(ii - ii.min(), dims='gdir'),
+                   latitude=xr.DataArray(jj - jj.min(), dims='gdir'))
+
+
+def _iter_ecmwf_data(gdirs, dataset=None, ensemble_member=0,
+                     y0=None, y1=None, tile_size=10):
+    """Extracts the ECMWF climate data of many glaciers.
+
+    Each file is opened once, and the data is read once per tile of
+    glaciers (see :py:func:`utils.group_gdirs_by_tile`).
+
+    Yields
+    ------
+    (gdir, data) tuples, where data is a dict of arguments to
+    :py:meth:`GlacierDirectory.write_monthly_climate_file`, or the
+    exception which occurred when extracting the data for this glacier.
+    """
+
+    if dataset is None:
+        dataset = cfg.PARAMS['baseline_climate']
+
+    # Should we compute the gradient?
+    if cfg.PARAMS['temp_use_local_gradient']:
+        raise NotImplementedError('`temp_use_local_gradient` not '
+                                  'implemented yet')
+
+    names = ['tmp', 'pre', 'inv']
+    if dataset == 'ERA5dr':
+        names += ['lapserates', 'tempstd']
+    dss = dict()
+    cache = utils.get_grid_cell_cache('ecmwf')
+    files = []
+    try:
+        for n in names:
+            files.append(get_ecmwf_file(dataset, n))
+            if cfg.PARAMS['use_point_series_store']:
+                isel = None
+                if dataset == 'CERA' and n != 'inv':
+                    isel = dict(number=ensemble_member)
+                dss[n] = utils.PointSeriesStore.from_netcdf(files[-1],
+                                                            isel=isel)
+                assert dss[n].lon.min() >= 0
+                continue
+            dss[n] = xr.open_dataset(files[-1])
+            assert dss[n].longitude.min() >= 0
+        if cache is not None:
+            cache = (cache, [cache.file_key(f) for f in files])
+        for tile in utils.group_gdirs_by_tile(gdirs, tile_size=tile_size):
+            yield from _iter_ecmwf_tile(tile, dss, dataset,
+                                        ensemble_member=ensemble_member,
+                                        y0=y0, y1=y1, cache=cache)
+    finally:
+        for ds in dss.values():
+            ds.close()
+
+
+def _iter_ecmwf_tile(gdirs, dss, dataset, ensemble_member=0,
+                     y0=None, y1=None, cache=None):
+    """Extracts the ECMWF climate data of glaciers in the same tile.
+
+    If a cache is given (a (:py:class:`utils.GridCellCache`, file keys)
+    tuple), the data is read only for the grid points which are not in the
+    cache yet.
+    """
+
+    lons = np.array([gdir.cenlon + 360 if gdir.cenlon < 0 else gdir.cenlon
+                     for gdir in gdirs])
+    lats = np.array([gdir.cenlat for gdir in gdirs])
+
+    time = pd.DatetimeIndex(np.asarray(dss['tmp'].time))
+    # set temporal subset for the ts data (hydro years)
+    sm = cfg.PARAMS['hydro_month_' + gdirs[0].hemisphere]
+    em = sm - 1 if (sm > 1) else 12
+    yrs = time.year
+    y0 = yrs[0] if y0 is None else y0
+    y1 = yrs[-1] if y1 is None else y1
+    if dataset == 'ERA5dr':
+        # Last year incomplete
+        assert time.month[-1] == 5
+        if em > 5:
+            y1 -= 1
+    period = slice('{}-{:02d}-01'.format(y0, sm),
+                   '{}-{:02d}-01'.format(y1, em))
+
+    # the glaciers in grid points we already know about
+    out = [None] * len(gdirs)
+    keys = dict()
+    if cache is not None:
+        cache, files = cache
+        cells = _nearest_cells(dss['tmp'], lons, lats)
+        for k, cell in enumerate(cells):
+            key = cache.make_key('ECMWF', dataset, files,
+                                 tuple(int(c) for c in cell), int(y0),
+                                 int(y1), sm, ensemble_member)
+            out[k] = cache.get(key)
+            if out[k] is None:
+                keys[k] = key
+    todo = [k for k, d in enumerate(out) if d is None]
+    if todo:
+        data = _get_ecmwf_points(dss, dataset, lons[todo], lats[todo],
+                                 period, ensemble_member=ensemble_member)
+        for k, d in zip(todo, data):
+            out[k] = d
+            if k in keys:
+                cache.set(keys[k], d)
+
+    for gdir, d in zip(gdirs, out):
+        yield gdir, d
+
+
+def _get_ecmwf_points(dss, dataset, lons, lats, period, ensemble_member=0):
+    """The ECMWF climate data at the nearest grid points of many locations.
+
+    Returns a list of dicts of arguments to
+    :py:meth:`GlacierDirectory.write_monthly_climate_file`.
+    """
+
+    if isinstance(dss['tmp'], utils.PointSeriesStore):
+        return _get_ecmwf_store_points(dss, dataset, lons, lats, period)
+
+    def _select(ds):
+        ds = ds.sel(time=period)
+        if dataset == 'CERA':
+            ds = ds.sel(number=ensemble_member)
+        return ds
+
+    ds = _sel_nearest(_select(dss['tmp']), lons, lats)
+    temp = ds['t2m'].data - 273.15
+    time = ds.time.data
+    ref_lon = ds['longitude'].data
+    ref_lon = np.where(ref_lon > 180, ref_lon - 360, ref_lon)
+    ref_lat = ds['latitude'].data
+    ds = _sel_nearest(_select(dss['pre']), lons, lats)
+    prcp = ds['tp'].data * 1000 * ds['time.daysinmonth'].data[:, None]
+    ds = _sel_nearest(dss['inv'].isel(time=0), lons, lats)
+    hgt = ds['z'].data / cfg.G
+
+    gradient = None
+    temp_std = None
+    if dataset == 'ERA5dr':
+        ds = _sel_nearest(dss['lapserates'].sel(time=period), lons, lats)
+        gradient = ds['lapserate'].data
+        ds = _sel_nearest(dss['tempstd'].sel(time=period), lons, lats)
+        temp_std = ds['t2m_std'].data
+
+    return [dict(time=time, prcp=prcp[:, k], temp=temp[:, k],
+                 ref_pix_hgt=hgt[k],
+                 ref_pix_lon=float(ref_lon[k]),
+                 ref_pix_lat=float(ref_lat[k]),
+                 gradient=None if gradient is None else gradient[:, k],
+                 temp_std=None if temp_std is None else temp_std[:, k],
+                 source=dataset)
+            for k in range(len(lons))]
+
+
+def _get_ecmwf_store_points(dss, dataset, lons, lats, period):
+    """Same as :py:func:`_get_ecmwf_points`, but from point stores."""
+
+    def _read(name, var):
+        st = dss[name]
+        points = st.nearest(lons, lats)
+        ts = st.time_slice(period.start, period.stop)
+        return st, points, st.series(var, points)[:, ts].T, st.time[ts]
+
+    st, points, temp, time = _read('tmp', 't2m')
+    temp = temp - 273.15
+    ref_lon, ref_lat = st.coordinates(points)
+    ref_lon = np.where(ref_lon > 180, ref_lon - 360, ref_lon)
+    _, _, prcp, ptime = _read('pre', 'tp')
+    ndays = pd.DatetimeIndex(ptime).daysinmonth.values
+    prcp = prcp * 1000 * ndays[:, None]
+    st = dss['inv']
+    hgt = st.series('z', st.nearest(lons, lats))[:, 0] / cfg.G
+
+    gradient = None
+    temp_std = None
+    if dataset == 'ERA5dr':
+        _, _, gradient, _ = _read('lapserates', 'lapserate')
+        _, _, temp_std, _ = _read('tempstd', 't2m_std')
+
+    return [dict(time=time, prcp=prcp[:, k], temp=temp[:, k],
+                 ref_pix_hgt=hgt[k],
+                 ref_pix_lon=float(ref_lon[k]),
+                 ref_pix_lat=float(ref_lat[k]),
+                 gradient=None if gradient is None else gradient[:, k],
+                 temp_std=None if temp_std is None else temp_std[:, k],
+                 source=dataset)
+            for k in range(len(lons))]
+
+
 @entity_task(log, writes=['climate_historical'])
 def process_ecmwf_data(gdir, dataset=None, ensemble_member=0,
-                       y0=None, y1=None, output_filesuffix=None):
+                       y0=None, y1=None, output_filesuffix=None,
+                       climate_data=None):
     """Processes and writes the ECMWF baseline climate data for this glacier.
 
     Extracts the nearest timeseries and writes everything to a NetCDF file.
@@ -113,6 +343,10 @@ def process_ecmwf_data(gdir, dataset=None, ensemble_member=0,
     output_filesuffix : str
         this add a suffix to the output file (useful to avoid overwriting
         previous experiments)
+    climate_data : dict
+        the climate data of this glacier, already extracted by
+        :py:func:`process_ecmwf_data_batched` (the dataset and period
+        arguments are then ignored)
     """
 
     if cfg.PATHS.get('climate_file', None):
@@ -120,89 +354,53 @@ def process_ecmwf_data(gdir, dataset=None, ensemble_member=0,
                       "run, but are using the ECMWF climate file "
                       "instead.")
 
-    if dataset is None:
-        dataset = cfg.PARAMS['baseline_climate']
+    if climate_data is None:
+        _, climate_data = next(_iter_ecmwf_data(
+            [gdir], dataset=dataset, ensemble_member=ensemble_member,
+            y0=y0, y1=y1))
 
-    # Use xarray to read the data
-    lon = gdir.cenlon + 360 if gdir.cenlon < 0 else gdir.cenlon
-    lat = gdir.cenlat
-    with xr.open_dataset(get_ecmwf_file(dataset, 'tmp')) as ds:
-        assert ds.longitude.min() >= 0
-        # set temporal subset for the ts data (hydro years)
-        sm = cfg.PARAMS['hydro_month_' + gdir.hemisphere]
-        em = sm - 1 if (sm > 1) else 12
-        yrs = ds['time.year'].data
-        y0 = yrs[0] if y0 is None else y0
-        y1 = yrs[-1] if y1 is None else y1
-        if dataset == 'ERA5dr':
-            # Last year incomplete
-            assert ds['time.month'][-1] == 5
-            if em > 5:
-                y1 -= 1
-        ds = ds.sel(time=slice('{}-{:02d}-01'.format(y0, sm),
-                               '{}-{:02d}-01'.format(y1, em)))
-        if dataset == 'CERA':
-            ds = ds.sel(number=ensemble_member)
-        try:
-            ds = ds.sel(longitude=lon, latitude=lat, method='nearest')
-        except ValueError:
-            # Flattened ERA5
-            c = (ds.longitude - lon)**2 + (ds.latitude - lat)**2
-            ds = ds.isel(points=c.argmin())
-        temp = ds['t2m'].data - 273.15
-        time = ds.time.data
-        ref_lon = float(ds['longitude'])
-        ref_lon = ref_lon - 360 if ref_lon > 180 else ref_lon
-        ref_lat = float(ds['latitude'])
-    with xr.open_dataset(get_ecmwf_file(dataset, 'pre')) as ds:
-        assert ds.longitude.min() >= 0
-        ds = ds.sel(time=slice('{}-{:02d}-01'.format(y0, sm),
-                               '{}-{:02d}-01'.format(y1, em)))
-        if dataset == 'CERA':
-            ds = ds.sel(number=ensemble_member)
-        try:
-            ds = ds.sel(longitude=lon, latitude=lat, method='nearest')
-        except ValueError:
-            # Flattened ERA5
-            c = (ds.longitude - lon)**2 + (ds.latitude - lat)**2
-            ds = ds.isel(points=c.argmin())
-        prcp = ds['tp'].data * 1000 * ds['time.daysinmonth']
-    with xr.open_dataset(get_ecmwf_file(dataset, 'inv')) as ds:
-        assert ds.longitude.min() >= 0
-        ds = ds.isel(time=0)
-        try:
-            ds = ds.sel(longitude=lon, latitude=lat, method='nearest')
-        except ValueError:
-            # Flattened ERA5
-            c = (ds.longitude - lon)**2 + (ds.latitude - lat)**2
-            ds = ds.isel(points=c.argmin())
-        hgt = ds['z'].data / cfg.G
+    # OK, ready to write
+    gdir.write_monthly_climate_file(filesuffix=output_filesuffix,
+                                    **climate_data)
 
-    gradient = None
-    temp_std = None
 
-    # Should we compute the gradient?
-    if cfg.PARAMS['temp_use_local_gradient']:
-        raise NotImplementedError('`temp_use_local_gradient` not '
-                                  'implemented yet')
-    if dataset == 'ERA5dr':
-        with xr.open_dataset(get_ecmwf_file(dataset, 'lapserates')) as ds:
-            assert ds.longitude.min() >= 0
-            ds = ds.sel(time=slice('{}-{:02d}-01'.format(y0, sm),
-                                   '{}-{:02d}-01'.format(y1, em)))
-            ds = ds.sel(longitude=lon, latitude=lat, method='nearest')
-            gradient = ds['lapserate'].data
-
-        with xr.open_dataset(get_ecmwf_file(dataset, 'tempstd')) as ds:
-            assert ds.longitude.min() >= 0
-            ds = ds.sel(time=slice('{}-{:02d}-01'.format(y0, sm),
-                                   '{}-{:02d}-01'.format(y1, em)))
-            ds = ds.sel(longitude=lon, latitude=lat, method='nearest')
-            temp_std = ds['t2m_std'].data
+@global_task
+def process_ecmwf_data_batched(gdirs, dataset=None, ensemble_member=0,
+                               y0=None, y1=None, output_filesuffix=None,
+                               tile_size=10):
+    """Processes and writes the ECMWF baseline climate data for many glaciers.
 
-    # OK, ready to write
-    gdir.write_monthly_climate_file(time, prcp, temp, hgt, ref_lon, ref_lat,
-                                    filesuffix=output_filesuffix,
-                                    gradient=gradient,
-                                    temp_std=temp_std,
-                                    source=dataset)
+    Same as :py:func:`process_ecmwf_data`, but the files are opened only
+    once and the data is read only once for all glaciers in the same tile,
+    which is much faster for large number of glaciers.
+
+    Parameters
+    ----------
+    gdirs : list of :py:class:`oggm.GlacierDirectory` objects
+        the glacier directories to process
+    dataset : str
+        'ERA5', 'ERA5L', 'CERA'. Defaults to cfg.PARAMS['baseline_climate']
+    ensemble_member : int
+        for CERA, pick an ensemble member number (0-9).
+    y0 : int
+        the starting year of the timeseries to write. The default is to take
+        the entire time period available in the file, but with this kwarg
+        you can shorten it (to save space or to crop bad data)
+    y1 : int
+        the starting year of the timeseries to write. The default is to take
+        the entire time period available in the file, but with this kwarg
+        you can shorten it (to save space or to crop bad data)
+    output_filesuffix : str
+        this add a suffix to the output file (useful to avoid overwriting
+        previous experiments)
+    tile_size : float
+        the glaciers are processed per tiles of this size (in degrees), to
+        limit the amount of data read in memory at once
+    """
+
+    gdirs = [gdir for gdir in utils.tolist(gdirs) if gdir is not None]
+    for gdir, climate_data in _iter_ecmwf_data(
+            gdirs, dataset=dataset, ensemble_member=ensemble_member,
+            y0=y0, y1=y1, tile_size=tile_size):
+        process_ecmwf_data(gdir, output_filesuffix=output_filesuffix,
+                           climate_data=climate_data)
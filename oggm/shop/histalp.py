@@ -15,7 +15,7 @@ except ImportError:
 # Locals
 from oggm import cfg
 from oggm import utils
-from oggm import entity_task
+from oggm import entity_task, global_task
 from oggm.exceptions import InvalidParamsError
 
 # Module logger
@@ -63,37 +63,19 @@ def get_histalp_file(var=None):
     return utils.file_extractor(utils.file_downloader(h_url))
 
 
-@entity_task(log, writes=['climate_historical'])
-def process_histalp_data(gdir, y0=None, y1=None, output_filesuffix=None):
-    """Processes and writes the HISTALP baseline climate data for this glacier.
+def _iter_histalp_data(gdirs, y0=None, y1=None, tile_size=10):
+    """Extracts the HISTALP climate data of many glaciers.
 
-    Extracts the nearest timeseries and writes everything to a NetCDF file.
+    Each file is opened once, and the data is read once per tile of
+    glaciers (see :py:func:`utils.group_gdirs_by_tile`).
 
-    Parameters
-    ----------
-    gdir : :py:class:`oggm.GlacierDirectory`
-        the glacier directory to process
-    y0 : int
-        the starting year of the timeseries to write. The default is to take
-        1850 (because the data is quite bad before that)
-    y1 : int
-        the starting year of the timeseries to write. The default is to take
-        the entire time period available in the file, but with this kwarg
-        you can shorten it (to save space or to crop bad data)
-    output_filesuffix : str
-        this add a suffix to the output file (useful to avoid overwriting
-        previous experiments)
+    Yields
+    ------
+    (gdir, data) tuples, where data is a dict of arguments to
+    :py:meth:`GlacierDirectory.write_monthly_climate_file`, or the
+    exception which occurred when extracting the data for this glacier.
     """
 
-    if cfg.PATHS.get('climate_file', None):
-        warnings.warn("You seem to have set a custom climate file for this "
-                      "run, but are using the default HISTALP climate file "
-                      "instead.")
-
-    if cfg.PARAMS['baseline_climate'] != 'HISTALP':
-        raise InvalidParamsError("cfg.PARAMS['baseline_climate'] should be "
-                                 "set to HISTALP.")
-
     # read the time out of the pure netcdf file
     ft = get_histalp_file('tmp')
     fp = get_histalp_file('pre')
@@ -114,14 +96,43 @@ def process_histalp_data(gdir, y0=None, y1=None, output_filesuffix=None):
     nc_ts_tmp = salem.GeoNetcdf(ft, time=time_t)
     nc_ts_pre = salem.GeoNetcdf(fp, time=time_p)
 
+    # Units
+    assert nc_ts_tmp._nc.variables['HSURF'].units.lower() in ['m', 'meters',
+                                                              'meter',
+                                                              'metres',
+                                                              'metre']
+    assert nc_ts_tmp._nc.variables['T_2M'].units.lower() in ['degc', 'degrees',
+                                                             'degrees celcius',
+                                                             'degree', 'c']
+    assert nc_ts_pre._nc.variables['TOT_PREC'].units.lower() in ['kg m-2',
+                                                                 'l m-2', 'mm',
+                                                                 'millimeters',
+                                                                 'millimeter']
+    source = nc_ts_tmp._nc.title[:7]
+
     # Some default
     if y0 is None:
         y0 = 1850
 
+    try:
+        for tile in utils.group_gdirs_by_tile(gdirs, tile_size=tile_size):
+            yield from _iter_histalp_tile(tile, nc_ts_tmp, nc_ts_pre,
+                                          y0=y0, y1=y1, source=source)
+    finally:
+        nc_ts_tmp._nc.close()
+        nc_ts_pre._nc.close()
+
+
+def _iter_histalp_tile(gdirs, nc_ts_tmp, nc_ts_pre, y0=None, y1=None,
+                       source=None):
+    """Extracts the HISTALP climate data of glaciers in the same tile."""
+
     # set temporal subset for the ts data (hydro years)
     # the reference time is given by precip, which is shorter
-    sm = cfg.PARAMS['hydro_month_' + gdir.hemisphere]
+    sm = cfg.PARAMS['hydro_month_' + gdirs[0].hemisphere]
     em = sm - 1 if (sm > 1) else 12
+    nc_ts_tmp.set_period()
+    nc_ts_pre.set_period()
     yrs = nc_ts_pre.time.year
     y0 = yrs[0] if y0 is None else y0
     y1 = yrs[-1] if y1 is None else y1
@@ -134,47 +145,141 @@ def process_histalp_data(gdir, y0=None, y1=None, output_filesuffix=None):
     ny, r = divmod(len(time), 12)
     assert r == 0
 
-    # Units
-    assert nc_ts_tmp._nc.variables['HSURF'].units.lower() in ['m', 'meters',
-                                                              'meter',
-                                                              'metres',
-                                                              'metre']
-    assert nc_ts_tmp._nc.variables['T_2M'].units.lower() in ['degc', 'degrees',
-                                                             'degrees celcius',
-                                                             'degree', 'c']
-    assert nc_ts_pre._nc.variables['TOT_PREC'].units.lower() in ['kg m-2',
-                                                                 'l m-2', 'mm',
-                                                                 'millimeters',
-                                                                 'millimeter']
-
-    # geoloc
-    lon = gdir.cenlon
-    lat = gdir.cenlat
-    nc_ts_tmp.set_subset(corners=((lon, lat), (lon, lat)), margin=1)
-    nc_ts_pre.set_subset(corners=((lon, lat), (lon, lat)), margin=1)
-
-    # read the data
+    # read the data of the whole tile at once
+    lons = np.array([gdir.cenlon for gdir in gdirs])
+    lats = np.array([gdir.cenlat for gdir in gdirs])
+    corners = ((np.min(lons), np.min(lats)), (np.max(lons), np.max(lats)))
+    nc_ts_tmp.set_subset()
+    mx, my = nc_ts_tmp.grid.nx - 1, nc_ts_tmp.grid.ny - 1
+    ci, cj = nc_ts_tmp.grid.center_grid.transform(lons, lats,
+                                                  crs=salem.wgs84,
+                                                  nearest=True)
+    nc_ts_tmp.set_subset(corners=corners, margin=1)
+    nc_ts_pre.set_subset(corners=corners, margin=1)
+    sx0, sy0 = nc_ts_tmp.sub_x[0], nc_ts_tmp.sub_y[0]
     temp = nc_ts_tmp.get_vardata('T_2M')
     prcp = nc_ts_pre.get_vardata('TOT_PREC')
     hgt = nc_ts_tmp.get_vardata('HSURF')
     ref_lon = nc_ts_tmp.get_vardata('lon')
     ref_lat = nc_ts_tmp.get_vardata('lat')
-    source = nc_ts_tmp._nc.title[:7]
-    nc_ts_tmp._nc.close()
-    nc_ts_pre._nc.close()
+
+    # the 3*3 window around each glacier (as set_subset would select it)
+    wi = np.clip(ci - 1, 0, mx) - sx0
+    wj = np.clip(cj - 1, 0, my) - sy0
+
+    # one gather for all glaciers
+    temp_c = temp[:, wj + 1, wi + 1]
+    prcp_c = prcp[:, wj + 1, wi + 1]
 
     # Should we compute the gradient?
     use_grad = cfg.PARAMS['temp_use_local_gradient']
-    igrad = None
-    if use_grad:
-        igrad = np.zeros(len(time)) * np.NaN
-        for t, loct in enumerate(temp):
-            slope, _, _, p_val, _ = stats.linregress(hgt.flatten(),
-                                                     loct.flatten())
-            igrad[t] = slope if (p_val < 0.01) else np.NaN
-
-    gdir.write_monthly_climate_file(time, prcp[:, 1, 1], temp[:, 1, 1],
-                                    hgt[1, 1], ref_lon[1], ref_lat[1],
-                                    gradient=igrad,
-                                    filesuffix=output_filesuffix,
-                                    source=source)
+    for k, gdir in enumerate(gdirs):
+        try:
+            win = (slice(wj[k], min(cj[k] + 1, my) - sy0 + 1),
+                   slice(wi[k], min(ci[k] + 1, mx) - sx0 + 1))
+            igrad = None
+            if use_grad:
+                loc_hgt = hgt[win]
+                igrad = np.zeros(len(time)) * np.NaN
+                for t, loct in enumerate(temp[(slice(None),) + win]):
+                    slope, _, _, p_val, _ = stats.linregress(
+                        loc_hgt.flatten(), loct.flatten())
+                    igrad[t] = slope if (p_val < 0.01) else np.NaN
+
+            data = dict(time=time, prcp=prcp_c[:, k], temp=temp_c[:, k],
+                        ref_pix_hgt=hgt[wj[k] + 1, wi[k] + 1],
+                        ref_pix_lon=ref_lon[wi[k] + 1],
+                        ref_pix_lat=ref_lat[wj[k] + 1],
+                        gradient=igrad, source=source)
+        except Exception as err:
+            data = err
+        yield gdir, data
+
+
+def _check_histalp_setup():
+    """Checks the config before using the HISTALP data."""
+
+    if cfg.PATHS.get('climate_file', None):
+        warnings.warn("You seem to have set a custom climate file for this "
+                      "run, but are using the default HISTALP climate file "
+                      "instead.")
+
+    if cfg.PARAMS['baseline_climate'] != 'HISTALP':
+        raise InvalidParamsError("cfg.PARAMS['baseline_climate'] should be "
+                                 "set to HISTALP.")
+
+
+@entity_task(log, writes=['climate_historical'])
+def process_histalp_data(gdir, y0=None, y1=None, output_filesuffix=None,
+                         climate_data=None):
+    """Processes and writes the HISTALP baseline climate data for this glacier.
+
+    Extracts the nearest timeseries and writes everything to a NetCDF file.
+
+    Parameters
+    ----------
+    gdir : :py:class:`oggm.GlacierDirectory`
+        the glacier directory to process
+    y0 : int
+        the starting year of the timeseries to write. The default is to take
+        1850 (because the data is quite bad before that)
+    y1 : int
+        the starting year of the timeseries to write. The default is to take
+        the entire time period available in the file, but with this kwarg
+        you can shorten it (to save space or to crop bad data)
+    output_filesuffix : str
+        this add a suffix to the output file (useful to avoid overwriting
+        previous experiments)
+    climate_data : dict
+        the climate data of this glacier, already extracted by
+        :py:func:`process_histalp_data_batched` (the period arguments are
+        then ignored)
+    """
+
+    _check_histalp_setup()
+
+    if climate_data is None:
+        _, climate_data = next(_iter_histalp_data([gdir], y0=y0, y1=y1))
+    if isinstance(climate_data, Exception):
+        # Raise here so that the error is logged for this glacier
+        raise climate_data
+
+    gdir.write_monthly_climate_file(filesuffix=output_filesuffix,
+                                    **climate_data)
+
+
+@global_task
+def process_histalp_data_batched(gdirs, y0=None, y1=None,
+                                 output_filesuffix=None, tile_size=10):
+    """Processes and writes the HISTALP baseline climate for many glaciers.
+
+    Same as :py:func:`process_histalp_data`, but the files are opened only
+    once and the data is read only once for all glaciers in the same tile,
+    which is much faster for large number of glaciers.
+
+    Parameters
+    ----------
+    gdirs : list of :py:class:`oggm.GlacierDirectory` objects
+        the glacier directories to process
+    y0 : int
+        the starting year of the timeseries to write. The default is to take
+        1850 (because the data is quite bad before that)
+    y1 : int
+        the starting year of the timeseries to write. The default is to take
+        the entire time period available in the file, but with this kwarg
+        you can shorten it (to save space or to crop bad data)
+    output_filesuffix : str
+        this add a suffix to the output file (useful to avoid overwriting
+        previous experiments)
+    tile_size : float
+        the glaciers are processed per tiles of this size (in degrees), to
+        limit the amount of data read in memory at once
+    """
+
+    _check_histalp_setup()
+
+    gdirs = [gdir for gdir in utils.tolist(gdirs) if gdir is not None]
+    for gdir, climate_data in _iter_histalp_data(gdirs, y0=y0, y1=y1,
+                                                 tile_size=tile_size):
+        process_histalp_data(gdir, output_filesuffix=output_filesuffix,
+                             climate_data=climate_data)
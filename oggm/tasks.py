@@ -26,12 +26,17 @@ from oggm.core.climate import process_custom_climate_data
 from oggm.core.climate import historical_delta_method
 from oggm.core.climate import historical_climate_qc
 from oggm.shop.cru import process_cru_data
+from oggm.shop.cru import process_cru_data_batched
 from oggm.shop.cru import process_dummy_cru_file
 from oggm.shop.histalp import process_histalp_data
+from oggm.shop.histalp import process_histalp_data_batched
 from oggm.shop.ecmwf import process_ecmwf_data
+from oggm.shop.ecmwf import process_ecmwf_data_batched
 from oggm.core.gcm_climate import process_gcm_data
 from oggm.core.gcm_climate import process_cesm_data
 from oggm.core.gcm_climate import process_cmip5_data
+from oggm.core.gcm_climate import process_gcm_ensemble
+from oggm.core.gcm_climate import process_gcm_ensemble_batched
 from oggm.core.climate import local_t_star
 from oggm.core.climate import mu_star_calibration
 from oggm.core.climate import apparent_mb_from_linear_mb
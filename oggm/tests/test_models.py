@@ -21,6 +21,7 @@ from oggm import utils, workflow, tasks, cfg
 from oggm.core import gcm_climate, climate, inversion, centerlines
 from oggm.cfg import SEC_IN_DAY, SEC_IN_YEAR, SEC_IN_MONTH
 from oggm.utils import get_demo_file
+from oggm.exceptions import InvalidParamsError, InvalidWorkflowError
 
 from oggm.tests.funcs import get_test_dir
 from oggm.tests.funcs import (dummy_bumpy_bed, dummy_constant_bed,
@@ -37,7 +38,7 @@ from oggm.core.flowline import (FluxBasedModel, FlowlineModel,
                                 ParabolicBedFlowline, MixedBedFlowline,
                                 flowline_from_dataset, FileModel,
                                 run_constant_climate, run_random_climate,
-                                run_from_climate_data)
+                                run_from_climate_data, robust_model_run)
 
 FluxBasedModel = partial(FluxBasedModel, inplace=True)
 FlowlineModel = partial(FlowlineModel, inplace=True)
@@ -336,6 +337,116 @@ class TestMassBalanceModels:
         mb_gw = mb_gw_mod.get_specific_mb(year=yrs)
         assert_allclose(mb, mb_gw)
 
+    def test_past_mb_vectorized(self, hef_gdir):
+
+        gdir = hef_gdir
+        init_present_time_glacier(gdir)
+        h, w = gdir.get_inversion_flowline_hw()
+
+        mb_mod = massbalance.PastMassBalance(gdir)
+        yrs = np.arange(1851, 2001)
+        ref = np.stack([mb_mod.get_annual_mb(h, year=yr) for yr in yrs])
+        mb = mb_mod.get_annual_mb(h, year=yrs)
+        assert mb.shape == (len(yrs), len(h))
+        assert_allclose(mb, ref)
+
+        ref = [mb_mod.get_annual_climate(h, year=yr)[1] for yr in yrs]
+        assert_allclose(mb_mod.get_annual_climate(h, year=yrs)[1], ref)
+
+        # Repeat also works
+        mb_mod = massbalance.PastMassBalance(gdir, repeat=True,
+                                             ys=1901, ye=1950)
+        mb = mb_mod.get_annual_mb(h, year=yrs + 100)
+        assert_allclose(mb[:50], mb[50:100])
+
+        with pytest.raises(ValueError):
+            massbalance.PastMassBalance(gdir).get_annual_mb(h, [1900, 2100])
+
+    def test_vectorized_specific_mb_and_ela(self, hef_gdir):
+
+        gdir = hef_gdir
+        init_present_time_glacier(gdir)
+        fls = gdir.read_pickle('model_flowlines')
+        h, w = gdir.get_inversion_flowline_hw()
+        yrs = np.arange(1901, 2001)
+
+        mb_mod = massbalance.PastMassBalance(gdir)
+        ref = [mb_mod.get_specific_mb(h, w, year=yr) for yr in yrs]
+        assert_allclose(mb_mod.get_specific_mb(h, w, year=yrs), ref)
+        ref = [mb_mod.get_specific_mb(fls=fls, year=yr) for yr in yrs]
+        assert_allclose(mb_mod.get_specific_mb(fls=fls, year=yrs), ref)
+
+        # The grid ELA is as good as the root finding one
+        ref = [mb_mod.get_ela(year=yr) for yr in yrs]
+        assert_allclose(mb_mod.get_ela(year=yrs), ref, atol=0.5)
+
+        # Invalid years are NaN as well
+        mb_mod.temp_bias = 1e4
+        assert np.all(np.isnan(mb_mod.get_ela(year=yrs[:5])))
+
+        # Also the years without zero crossing between the bounds
+        mb_mod = massbalance.PastMassBalance(gdir)
+        mb_mod.valid_bounds = np.percentile(mb_mod.get_ela(year=yrs),
+                                            [25, 75])
+        ref = [mb_mod.get_ela(year=yr) for yr in yrs]
+        assert 40 <= np.sum(np.isnan(ref)) <= 60
+        assert_allclose(mb_mod.get_ela(year=yrs), ref, atol=0.5)
+
+        mb_mod = massbalance.MultipleFlowlineMassBalance(gdir)
+        ref = [mb_mod.get_specific_mb(year=yr) for yr in yrs]
+        assert_allclose(mb_mod.get_specific_mb(year=yrs), ref)
+        ref = [mb_mod.get_ela(year=yr) for yr in yrs]
+        assert_allclose(mb_mod.get_ela(year=yrs), ref, atol=0.5)
+
+        mb_mod = massbalance.ConstantMassBalance(gdir)
+        elas = mb_mod.get_ela(year=yrs[:10])
+        assert_allclose(elas, mb_mod.get_ela())
+        smb = mb_mod.get_specific_mb(h, w, year=yrs[:10])
+        assert_allclose(smb, mb_mod.get_specific_mb(h, w))
+
+    def test_past_mb_lookup(self, hef_gdir):
+
+        gdir = hef_gdir
+        init_present_time_glacier(gdir)
+        F = SEC_IN_YEAR * cfg.PARAMS['ice_density']
+
+        fls = gdir.read_pickle('model_flowlines')
+        h = np.concatenate([fl.surface_h for fl in fls])
+        # Add some heights outside of the lookup range
+        h = np.append(h, [-100, 9000])
+
+        ref_mod = massbalance.PastMassBalance(gdir)
+        mb_mod = massbalance.PastMassBalance(gdir, lookup_dh=5)
+        assert ref_mod.lookup_hbins is None
+        assert mb_mod.lookup_hbins[1] - mb_mod.lookup_hbins[0] == 5
+
+        def check(yrs=(1900, 1950, 2000)):
+            for yr in yrs:
+                ref = ref_mod.get_annual_mb(h, yr) * F
+                new = mb_mod.get_annual_mb(h, yr) * F
+                assert_allclose(new, ref, atol=5)
+                # Outside the lookup we are exact
+                assert_allclose(new[-2:], ref[-2:])
+
+        check()
+        assert mb_mod._mb_lookup[1].sum() == 3
+
+        # The lookup is reset when the params change
+        for attr, val in [('temp_bias', 1), ('prcp_bias', 1.2),
+                          ('bias', 100), ('mu_star', 100)]:
+            setattr(ref_mod, attr, val)
+            setattr(mb_mod, attr, val)
+            assert mb_mod._mb_lookup is None
+            check()
+
+        # It is used by default if asked to
+        cfg.PARAMS['past_mb_lookup_dh'] = 10
+        try:
+            mb_mod = massbalance.PastMassBalance(gdir)
+            assert mb_mod.lookup_hbins is not None
+        finally:
+            cfg.PARAMS['past_mb_lookup_dh'] = 0
+
     @pytest.mark.parametrize("cl", [massbalance.PastMassBalance,
                                     massbalance.ConstantMassBalance,
                                     massbalance.RandomMassBalance])
@@ -1259,6 +1370,17 @@ class TestModelFlowlines():
         assert rec.volume_bsl_km3 == 0
 
 
+class InterruptedMassBalance(LinearMassBalance):
+    """Simulates a run being killed after a given year."""
+    interrupt_at = None
+
+    def get_annual_mb(self, heights, year=None, **kwargs):
+        if self.interrupt_at is not None and year > self.interrupt_at:
+            raise KeyboardInterrupt('Preempted!')
+        return super(InterruptedMassBalance, self).get_annual_mb(heights,
+                                                                 year=year)
+
+
 @pytest.fixture(scope='class')
 def io_init_gdir(hef_gdir):
     init_present_time_glacier(hef_gdir)
@@ -1398,6 +1520,153 @@ class TestIO():
             np.testing.assert_allclose(model.fls[0].section,
                                        fmodel.fls[0].section)
 
+    def test_run_streamed(self, class_case_dir):
+
+        mb = LinearMassBalance(2600.)
+
+        paths = []
+        for flush_interval in [0, 7]:
+            run_path = os.path.join(class_case_dir,
+                                    'ts_run_{}.nc'.format(flush_interval))
+            diag_path = os.path.join(class_case_dir,
+                                     'ts_diag_{}.nc'.format(flush_interval))
+            for p in [run_path, diag_path]:
+                if os.path.exists(p):
+                    os.remove(p)
+            model = FluxBasedModel(dummy_width_bed_tributary(), mb_model=mb,
+                                   y0=0., glen_a=self.glen_a)
+            run_ds, diag = model.run_until_and_store(
+                30, run_path=run_path, diag_path=diag_path,
+                store_monthly_step=True, flush_interval=flush_interval)
+            paths.append((run_path, diag_path))
+
+        # Nothing is kept in memory
+        assert run_ds is None
+        assert diag.volume_m3[-1] == model.volume_m3
+
+        # But the files are the same
+        for group in [None, 'fl_0', 'fl_1']:
+            ref = xr.open_dataset(paths[0][0], group=group)
+            with xr.open_dataset(paths[1][0], group=group) as ds:
+                del ref.attrs['creation_date']
+                del ds.attrs['creation_date']
+                xr.testing.assert_identical(ref, ds)
+            ref.close()
+        with xr.open_dataset(paths[0][1]) as ref:
+            with xr.open_dataset(paths[1][1]) as ds:
+                assert ds.dims['time'] == 30 * 12 + 1
+                xr.testing.assert_equal(ref, ds)
+
+        with FileModel(paths[1][0]) as fmodel:
+            assert fmodel.last_yr == 30
+            fmodel.run_until(30)
+            np.testing.assert_allclose(fmodel.volume_m3, model.volume_m3)
+
+    @pytest.mark.parametrize("flush_interval", [0, 7])
+    def test_run_zarr(self, class_case_dir, flush_interval):
+
+        pytest.importorskip('zarr')
+
+        mb = LinearMassBalance(2600.)
+
+        paths = dict()
+        for n in ['run', 'diag']:
+            paths[n] = os.path.join(class_case_dir, 'ts_{}.nc'.format(n))
+            paths['zarr_' + n] = os.path.join(class_case_dir,
+                                              'ts_{}.zarr'.format(n))
+        for p in paths.values():
+            if os.path.isdir(p):
+                shutil.rmtree(p)
+            elif os.path.exists(p):
+                os.remove(p)
+
+        for fmt in ['netcdf', 'zarr']:
+            pre = 'zarr_' if fmt == 'zarr' else ''
+            model = FluxBasedModel(dummy_width_bed_tributary(), mb_model=mb,
+                                   y0=0., glen_a=self.glen_a)
+            model.run_until_and_store(30, run_path=paths[pre + 'run'],
+                                      diag_path=paths[pre + 'diag'],
+                                      store_monthly_step=True,
+                                      flush_interval=flush_interval,
+                                      output_format=fmt)
+
+        assert os.path.isdir(paths['zarr_run'])
+        for group in [None, 'fl_0', 'fl_1']:
+            with xr.open_dataset(paths['run'], group=group) as ref:
+                with xr.open_dataset(paths['zarr_run'], group=group) as ds:
+                    xr.testing.assert_allclose(ref, ds)
+        with xr.open_dataset(paths['diag']) as ref:
+            with xr.open_dataset(paths['zarr_diag']) as ds:
+                assert ds.dims['time'] == 30 * 12 + 1
+                xr.testing.assert_allclose(ref, ds)
+
+        with FileModel(paths['zarr_run']) as fmodel:
+            assert fmodel.last_yr == 30
+            fmodel.run_until(30)
+            np.testing.assert_allclose(fmodel.volume_m3, model.volume_m3)
+
+        with pytest.raises(InvalidParamsError):
+            model.run_until_and_store(31, output_format='hdf4')
+
+    @pytest.mark.parametrize("flush_interval", [0, 7])
+    def test_run_checkpoint(self, class_case_dir, flush_interval):
+
+        paths = dict()
+        for n in ['run', 'diag', 'ref_run', 'ref_diag', 'checkpoint']:
+            paths[n] = os.path.join(class_case_dir, 'ts_{}.nc'.format(n))
+            if os.path.exists(paths[n]):
+                os.remove(paths[n])
+
+        ref = FluxBasedModel(dummy_width_bed_tributary(),
+                             mb_model=InterruptedMassBalance(2600.),
+                             y0=0., glen_a=self.glen_a)
+        _, ref_diag = ref.run_until_and_store(
+            40, run_path=paths['ref_run'], diag_path=paths['ref_diag'],
+            store_monthly_step=True, flush_interval=flush_interval)
+
+        kwargs = dict(run_path=paths['run'], diag_path=paths['diag'],
+                      store_monthly_step=True, flush_interval=flush_interval,
+                      checkpoint_path=paths['checkpoint'],
+                      checkpoint_interval=5)
+        InterruptedMassBalance.interrupt_at = 23.5
+        model = FluxBasedModel(dummy_width_bed_tributary(),
+                               mb_model=InterruptedMassBalance(2600.),
+                               y0=0., glen_a=self.glen_a)
+        with pytest.raises(KeyboardInterrupt):
+            model.run_until_and_store(40, **kwargs)
+        assert os.path.exists(paths['checkpoint'])
+
+        # Another run cannot be resumed from this checkpoint
+        InterruptedMassBalance.interrupt_at = None
+        other = FluxBasedModel(dummy_width_bed_tributary(),
+                               mb_model=InterruptedMassBalance(2500.),
+                               y0=0., glen_a=self.glen_a)
+        with pytest.raises(InvalidWorkflowError):
+            other.run_until_and_store(40, **kwargs)
+        other = FluxBasedModel(dummy_width_bed_tributary(),
+                               mb_model=InterruptedMassBalance(2600.),
+                               y0=1., glen_a=self.glen_a)
+        with pytest.raises(InvalidWorkflowError):
+            other.run_until_and_store(40, **kwargs)
+        assert other.yr == 1
+
+        # Start again from scratch
+        model = FluxBasedModel(dummy_width_bed_tributary(),
+                               mb_model=InterruptedMassBalance(2600.),
+                               y0=0., glen_a=self.glen_a)
+        _, diag = model.run_until_and_store(40, **kwargs)
+        assert not os.path.exists(paths['checkpoint'])
+        assert model.yr == 40
+        np.testing.assert_array_equal(model.fls[-1].section,
+                                      ref.fls[-1].section)
+        np.testing.assert_array_equal(diag.volume_m3, ref_diag.volume_m3)
+        for group in [None, 'fl_0', 'fl_1']:
+            with xr.open_dataset(paths['run'], group=group) as ds:
+                with xr.open_dataset(paths['ref_run'], group=group) as rds:
+                    del ds.attrs['creation_date']
+                    del rds.attrs['creation_date']
+                    xr.testing.assert_identical(ds, rds)
+
     @pytest.mark.slow
     def test_calving_filemodel(self, class_case_dir):
         y1 = 1200
@@ -2588,6 +2857,134 @@ class TestHEF:
                     plt.tight_layout()
                     plt.show()
 
+    @pytest.mark.slow
+    def test_batched_run(self, hef_gdir, inversion_params):
+
+        init_present_time_glacier(hef_gdir)
+        kwargs = dict(nyears=50, temperature_bias=-0.5,
+                      fs=inversion_params['fs'],
+                      glen_a=inversion_params['glen_a'])
+        workflow.execute_entity_task(run_constant_climate, [hef_gdir],
+                                     output_filesuffix='_ref', **kwargs)
+        out = workflow.execute_batched_model_run(run_constant_climate,
+                                                 [hef_gdir],
+                                                 output_filesuffix='_bt',
+                                                 **kwargs)
+        assert len(out) == 1
+        assert out[0].yr == 50
+        assert hef_gdir.get_task_status('run_constant_climate_bt') == 'SUCCESS'
+
+        ds_ref = utils.compile_run_output([hef_gdir], path=False,
+                                          input_filesuffix='_ref')
+        ds_bt = utils.compile_run_output([hef_gdir], path=False,
+                                         input_filesuffix='_bt')
+        assert_allclose(ds_bt.volume, ds_ref.volume, rtol=1e-7)
+        assert_allclose(ds_bt.area, ds_ref.area, rtol=1e-7)
+        assert_allclose(ds_bt.length, ds_ref.length)
+
+    @pytest.mark.slow
+    def test_run_output_container(self, hef_gdir, inversion_params,
+                                  test_dir):
+
+        init_present_time_glacier(hef_gdir)
+        kwargs = dict(nyears=20, temperature_bias=-0.5,
+                      fs=inversion_params['fs'],
+                      glen_a=inversion_params['glen_a'])
+        run_constant_climate(hef_gdir, output_filesuffix='_ref', **kwargs)
+
+        prev_wd = cfg.PATHS['working_dir']
+        cfg.PATHS['working_dir'] = utils.mkdir(os.path.join(test_dir,
+                                                            'ct_wd'),
+                                               reset=True)
+        cfg.PARAMS['run_output_container'] = True
+        try:
+            run_constant_climate(hef_gdir, output_filesuffix='_ct', **kwargs)
+            workflow.execute_batched_model_run(run_constant_climate,
+                                               [hef_gdir],
+                                               output_filesuffix='_ctb',
+                                               **kwargs)
+            for suffix in ['_ct', '_ctb']:
+                fp = hef_gdir.get_filepath('model_run', filesuffix=suffix)
+                assert not os.path.exists(fp)
+
+            ds_ref = utils.compile_run_output([hef_gdir], path=False,
+                                              input_filesuffix='_ref')
+            for suffix in ['_ct', '_ctb']:
+                ds = utils.compile_run_output([hef_gdir], path=False,
+                                              input_filesuffix=suffix)
+                assert_allclose(ds.volume, ds_ref.volume, rtol=1e-7)
+
+            path = utils.merge_run_output_containers()
+            odir = os.path.dirname(path)
+            assert os.listdir(odir) == ['run_outputs.nc']
+
+            fp, group = utils.get_run_output_location(hef_gdir, 'model_run',
+                                                      filesuffix='_ct')
+            assert fp == path
+            with FileModel(fp, group=group) as fmodel:
+                fmodel.run_until(20)
+                assert_allclose(fmodel.volume_m3, ds_ref.volume[-1],
+                                rtol=1e-7)
+        finally:
+            cfg.PARAMS['run_output_container'] = False
+            cfg.PATHS['working_dir'] = prev_wd
+
+    @pytest.mark.slow
+    def test_run_output_container_resume(self, hef_gdir, test_dir):
+
+        init_present_time_glacier(hef_gdir)
+        kwargs = dict(ys=0, ye=20)
+        robust_model_run(hef_gdir, output_filesuffix='_rs_ref',
+                         mb_model=InterruptedMassBalance(3000.), **kwargs)
+
+        prev_wd = cfg.PATHS['working_dir']
+        cfg.PATHS['working_dir'] = utils.mkdir(os.path.join(test_dir,
+                                                            'ctr_wd'),
+                                               reset=True)
+        cfg.PARAMS['run_output_container'] = True
+        cfg.PARAMS['model_checkpoint_interval'] = 5
+        ckpt = hef_gdir.get_filepath('model_checkpoint', filesuffix='_rs')
+        try:
+            InterruptedMassBalance.interrupt_at = 12.5
+            with pytest.raises(KeyboardInterrupt):
+                robust_model_run(hef_gdir, output_filesuffix='_rs',
+                                 mb_model=InterruptedMassBalance(3000.),
+                                 **kwargs)
+            assert os.path.exists(ckpt)
+
+            # Resume, e.g. on another node
+            shutil.rmtree(utils.gettempdir('run_outputs'))
+            InterruptedMassBalance.interrupt_at = None
+            robust_model_run(hef_gdir, output_filesuffix='_rs',
+                             mb_model=InterruptedMassBalance(3000.), **kwargs)
+            assert not os.path.exists(ckpt)
+            fp = hef_gdir.get_filepath('model_run', filesuffix='_rs')
+            assert not os.path.exists(fp)
+
+            # A checkpoint without its output files is not resumed
+            InterruptedMassBalance.interrupt_at = 12.5
+            with pytest.raises(KeyboardInterrupt):
+                robust_model_run(hef_gdir, output_filesuffix='_rs2',
+                                 mb_model=InterruptedMassBalance(3000.),
+                                 **kwargs)
+            os.remove(hef_gdir.get_filepath('model_run', filesuffix='_rs2'))
+            InterruptedMassBalance.interrupt_at = None
+            robust_model_run(hef_gdir, output_filesuffix='_rs2',
+                             mb_model=InterruptedMassBalance(3000.), **kwargs)
+
+            ds_ref = utils.compile_run_output([hef_gdir], path=False,
+                                              input_filesuffix='_rs_ref')
+            for suffix in ['_rs', '_rs2']:
+                ds = utils.compile_run_output([hef_gdir], path=False,
+                                              input_filesuffix=suffix)
+                assert_allclose(ds.volume, ds_ref.volume, rtol=1e-7)
+                assert_allclose(ds.length, ds_ref.length)
+        finally:
+            InterruptedMassBalance.interrupt_at = None
+            cfg.PARAMS['run_output_container'] = False
+            cfg.PARAMS['model_checkpoint_interval'] = 0
+            cfg.PATHS['working_dir'] = prev_wd
+
     @pytest.mark.slow
     def test_random_sh(self, gdir_sh, hef_gdir):
 
@@ -2830,6 +3227,11 @@ class TestHEF:
         path = os.path.join(cfg.PATHS['working_dir'], 'run_output_rehist.nc')
         with xr.open_dataset(path) as ds:
             assert len(ds.rgi_id) == 3
+            # Same as the compilation in memory
+            assert_allclose(ds.volume.isel(rgi_id=2),
+                            ds1.volume.isel(rgi_id=0), rtol=1e-6)
+            assert_allclose(ds.ela.isel(rgi_id=1),
+                            ds1.ela.isel(rgi_id=0), rtol=1e-6)
 
     @pytest.mark.slow
     def test_elevation_feedback(self, hef_gdir):
@@ -31,7 +31,8 @@ import matplotlib.pyplot as plt
 
 from oggm.core.flowline import (KarthausModel, FluxBasedModel,
                                 RectangularBedFlowline,
-                                MassConservationChecker)
+                                MassConservationChecker,
+                                BatchedFluxBasedModel, SemiImplicitModel)
 from oggm.tests.ext.sia_fluxlim import MUSCLSuperBeeModel
 
 FluxBasedModel = partial(FluxBasedModel, inplace=True)
@@ -1005,6 +1006,246 @@ class TestIdealisedCases(unittest.TestCase):
             model.run_until(300)
         assert 'exceeds domain boundaries' in str(excinfo.value)
 
+    def test_numba_kernel(self):
+
+        pytest.importorskip('numba')
+
+        beds = [dummy_constant_bed, dummy_width_bed_tributary,
+                dummy_mixed_bed, dummy_trapezoidal_bed, dummy_parabolic_bed,
+                dummy_noisy_bed]
+        for bed in beds:
+            mb = LinearMassBalance(2600.)
+            model = FluxBasedModel(bed(), mb_model=mb, y0=0.,
+                                   glen_a=self.glen_a, fs=self.fs)
+            model.run_until(100)
+
+            # One step from the same state is equivalent
+            fls = model.fls
+            ref = FluxBasedModel(copy.deepcopy(fls), mb_model=mb, y0=0.,
+                                 glen_a=self.glen_a, fs=self.fs)
+            cfg.PARAMS['flowline_kernel'] = 'numba'
+            new = FluxBasedModel(copy.deepcopy(fls), mb_model=mb, y0=0.,
+                                 glen_a=self.glen_a, fs=self.fs)
+            cfg.PARAMS['flowline_kernel'] = 'numpy'
+            assert new.kernel == 'numba'
+            assert ref.kernel == 'numpy'
+            assert ref.step(1e6) == new.step(1e6)
+            for fl_id in range(len(fls)):
+                for stag in ['slope_stag', 'thick_stag', 'section_stag',
+                             'u_stag', 'flux_stag']:
+                    assert_allclose(getattr(new, stag)[fl_id],
+                                    getattr(ref, stag)[fl_id],
+                                    rtol=1e-12, atol=1e-20)
+                assert_allclose(new.fls[fl_id].section,
+                                ref.fls[fl_id].section, rtol=1e-12)
+
+            # Whole runs only differ by round-off errors. They are run with
+            # a fixed time step: with the adaptive one, round-off errors
+            # can change the length of a time step (when the CFL criterion
+            # is close to the maximum step), and the runs then also differ
+            # by the time discretization errors
+            kwargs = dict(mb_model=mb, y0=0., glen_a=self.glen_a, fs=self.fs,
+                          fixed_dt=10 * SEC_IN_DAY)
+            ref = FluxBasedModel(copy.deepcopy(fls), **kwargs)
+            cfg.PARAMS['flowline_kernel'] = 'numba'
+            new = FluxBasedModel(copy.deepcopy(fls), **kwargs)
+            cfg.PARAMS['flowline_kernel'] = 'numpy'
+            ref.run_until(50)
+            new.run_until(50)
+            assert_allclose(new.volume_m3, ref.volume_m3, rtol=1e-12)
+            assert new.length_m == ref.length_m
+
+        with pytest.raises(InvalidParamsError):
+            FluxBasedModel(dummy_constant_bed(), kernel='fortran')
+
+    def test_batched_model(self):
+
+        beds = [dummy_constant_bed, dummy_width_bed_tributary,
+                dummy_mixed_bed, dummy_trapezoidal_bed, dummy_parabolic_bed,
+                dummy_noisy_bed, dummy_constant_bed]
+        elas = [2600., 2400., 2700., 2600., 2600., 2600., 1600.]
+        glen_as = self.glen_a * np.linspace(1, 2, len(beds))
+
+        def get_models():
+            return [FluxBasedModel(bed(), mb_model=LinearMassBalance(ela),
+                                   y0=0., glen_a=glen_a, fs=self.fs)
+                    for bed, ela, glen_a in zip(beds, elas, glen_as)]
+
+        ref = []
+        for model in get_models()[:-1]:
+            ref.append(model.run_until_and_store(150)[1])
+
+        models = get_models()
+        batch = BatchedFluxBasedModel(models)
+        out = batch.run_until_and_store(150)
+
+        # The last one is too big for its domain
+        assert out[-1] is None
+        assert 'exceeds domain boundaries' in str(batch.errors[-1])
+        assert isinstance(batch.errors[-1], RuntimeError)
+
+        # All others are the same
+        assert batch.errors[:-1] == [None] * (len(beds) - 1)
+        for rds, (_, ds), model in zip(ref, out, models):
+            assert model.yr == 150
+            assert_allclose(ds.volume_m3, rds.volume_m3, rtol=1e-10)
+            assert_allclose(ds.area_m2, rds.area_m2, rtol=1e-10)
+            assert_allclose(ds.length_m, rds.length_m)
+        assert models[0].volume_m3 > 0
+
+        with pytest.raises(InvalidParamsError):
+            BatchedFluxBasedModel([FluxBasedModel(dummy_constant_bed(),
+                                                  y0=0.),
+                                   FluxBasedModel(dummy_constant_bed(),
+                                                  y0=10.)])
+
+    def test_batched_model_flux_gate(self):
+
+        mb = ScalarMassBalance()
+        ref = FluxBasedModel(dummy_width_bed_tributary(), mb_model=mb,
+                             flux_gate_thickness=150, flux_gate_build_up=50)
+        ref.run_until(500)
+
+        models = [FluxBasedModel(dummy_width_bed_tributary(), mb_model=mb,
+                                 flux_gate_thickness=150,
+                                 flux_gate_build_up=50),
+                  FluxBasedModel(dummy_constant_bed(), mb_model=mb)]
+        BatchedFluxBasedModel(models).run_until(500)
+        assert_allclose(models[0].volume_m3, ref.volume_m3)
+        assert_allclose(models[0].volume_m3,
+                        models[0].flux_gate_m3_since_y0)
+        assert_allclose(models[0].fls[-1].thick, ref.fls[-1].thick)
+        assert models[1].volume_m3 == 0
+
+    def test_ela_diagnostic(self):
+
+        out = dict()
+        for mode in ['exact', 'interpolated', 'off']:
+            for feedback in ['annual', 'always']:
+                model = FluxBasedModel(dummy_width_bed_tributary(),
+                                       mb_model=LinearMassBalance(2600.),
+                                       y0=0., glen_a=self.glen_a, fs=self.fs,
+                                       mb_elev_feedback=feedback)
+                _, ds = model.run_until_and_store(50, ela_diagnostic=mode)
+                out[mode, feedback] = ds
+
+        for feedback in ['annual', 'always']:
+            ref = out['exact', feedback]
+            assert_allclose(ref.ela_m, 2600, atol=0.1)
+            ds = out['interpolated', feedback]
+            assert_allclose(ds.ela_m, 2600)
+            assert_allclose(ds.volume_m3, ref.volume_m3)
+            ds = out['off', feedback]
+            assert np.all(np.isnan(ds.ela_m))
+            assert_allclose(ds.volume_m3, ref.volume_m3)
+
+        cfg.PARAMS['ela_diagnostic'] = 'interpolated'
+        model = FluxBasedModel(dummy_constant_bed(),
+                               mb_model=LinearMassBalance(2600.))
+        _, ds = model.run_until_and_store(2)
+        assert_allclose(ds.ela_m, 2600)
+
+        cfg.PARAMS['ela_diagnostic'] = 'fast'
+        with pytest.raises(InvalidParamsError):
+            model.run_until_and_store(3)
+
+    def test_event_time_stepping(self):
+
+        n_steps = dict()
+        models = dict()
+        for time_stepping in ['monthly', 'events']:
+            model = FluxBasedModel(dummy_width_bed_tributary(),
+                                   mb_model=LinearMassBalance(2600.),
+                                   y0=0., glen_a=self.glen_a / 10,
+                                   fs=self.fs, time_stepping=time_stepping)
+            n_steps[time_stepping] = 0
+            step = model.step
+
+            def counting_step(dt, ts=time_stepping, step=step):
+                n_steps[ts] += 1
+                return step(dt)
+
+            model.step = counting_step
+            model.run_until(200)
+            models[time_stepping] = model
+
+        # Same results, but with fewer steps
+        assert n_steps['events'] < 0.8 * n_steps['monthly']
+        ref, model = models['monthly'], models['events']
+        assert model.yr == 200
+        assert_allclose(model.volume_m3, ref.volume_m3, rtol=5e-3)
+        assert_allclose(model.area_m2, ref.area_m2, rtol=5e-3)
+
+        # Monthly MB updates are still monthly
+        model = FluxBasedModel(dummy_constant_bed(), y0=0.,
+                               mb_elev_feedback='monthly',
+                               time_stepping='events')
+        ts = model.get_step_boundaries(2)
+        assert_allclose(ts[[0, -1]], [0, 2])
+        assert np.all(np.diff(ts) < 0.084)
+        model = FluxBasedModel(dummy_constant_bed(), y0=0.5,
+                               time_stepping='events')
+        assert_allclose(model.get_step_boundaries(3.5), [1, 2, 3, 3.5])
+
+        # The end of the flux gate build up is an event too
+        model = FluxBasedModel(dummy_constant_bed(), y0=0.,
+                               flux_gate=0.1, flux_gate_build_up=10.5,
+                               time_stepping='events')
+        assert 10.5 in model.get_step_boundaries(20)
+
+        with pytest.raises(InvalidParamsError):
+            FluxBasedModel(dummy_constant_bed(), time_stepping='weekly')
+
+    def test_semi_implicit_model(self):
+
+        # A fast glacier which needs small explicit time steps
+        glen_a = self.glen_a * 10
+        kwargs = [dict(model_class=FluxBasedModel),
+                  dict(model_class=SemiImplicitModel),
+                  dict(model_class=SemiImplicitModel, max_dt=cfg.SEC_IN_YEAR,
+                       time_stepping='events')]
+        n_steps = []
+        volume = []
+        length = []
+        for kw in kwargs:
+            model_class = kw.pop('model_class')
+            model = model_class(dummy_width_bed_tributary(),
+                                mb_model=LinearMassBalance(2600.),
+                                y0=0., glen_a=glen_a, fs=self.fs_old,
+                                inplace=True, **kw)
+            step = model.step
+
+            def counting_step(dt, step=step):
+                n_steps[-1] += 1
+                return step(dt)
+
+            model.step = counting_step
+            n_steps.append(0)
+            vol = []
+            for y in np.arange(50, 301, 50):
+                model.run_until(y)
+                assert model.yr == y
+                vol.append(model.volume_m3)
+            volume.append(vol)
+            length.append(model.length_m)
+
+        # Close to the explicit solver, even with annual steps
+        assert_allclose(volume[1], volume[0], rtol=2e-3)
+        assert_allclose(volume[2], volume[0], rtol=2e-2)
+        assert_allclose(length[1:], length[0], atol=101)
+        assert n_steps[0] > 2 * n_steps[1]
+        assert n_steps[2] == 300
+
+        # The diagnostics are available as for the explicit model
+        df = model.get_diagnostics()
+        assert np.all(df['ice_flux'] >= -1e-9)
+
+        with pytest.raises(InvalidParamsError):
+            SemiImplicitModel(dummy_constant_bed(), is_tidewater=True,
+                              do_kcalving=True)
+        with pytest.raises(InvalidParamsError):
+            BatchedFluxBasedModel([SemiImplicitModel(dummy_constant_bed())])
+
 
 class TestFluxGate(unittest.TestCase):
 
@@ -4,6 +4,8 @@ warnings.filterwarnings("once", category=DeprecationWarning)  # noqa: E402
 import unittest
 import os
 import shutil
+import gzip
+import pickle
 from distutils.version import LooseVersion
 import pytest
 
@@ -25,7 +27,7 @@ from oggm import utils, tasks
 from oggm.utils import get_demo_file, tuple2int
 from oggm.tests.funcs import get_test_dir, init_columbia
 from oggm import workflow
-from oggm.exceptions import InvalidWorkflowError
+from oggm.exceptions import InvalidWorkflowError, InvalidParamsError
 
 pytestmark = pytest.mark.test_env("prepro")
 
@@ -263,6 +265,53 @@ class TestGIS(unittest.TestCase):
         # this should simply run
         oggm.GlacierDirectory(entity.RGIId, base_dir=self.testdir)
 
+    def test_pickle_cache(self):
+
+        from oggm.utils._workflow import _pickle_cache
+
+        hef_file = get_demo_file('Hintereisferner_RGI5.shp')
+        entity = gpd.read_file(hef_file).iloc[0]
+        gdir = oggm.GlacierDirectory(entity, base_dir=self.testdir)
+
+        def in_cache(gd, filename):
+            return gd.get_filepath(filename) in _pickle_cache
+
+        cfg.PARAMS['gdir_pickle_cache_size'] = 1
+        gdir.write_pickle([1, 2], 'centerlines')
+        assert in_cache(gdir, 'centerlines')
+        # Modifying the output does not modify the cache
+        gdir.read_pickle('centerlines').append(3)
+        assert gdir.read_pickle('centerlines') == [1, 2]
+        gdir.write_pickle([3], 'centerlines', filesuffix='_1')
+        assert gdir.read_pickle('centerlines', filesuffix='_1') == [3]
+
+        # The files on disk have priority
+        with gzip.open(gdir.get_filepath('centerlines'), 'wb') as f:
+            pickle.dump([1, 2, 3, 4], f)
+        assert gdir.read_pickle('centerlines') == [1, 2, 3, 4]
+
+        # The memory is limited
+        gdir.write_pickle(np.zeros(int(1e5)), 'downstream_line')
+        assert in_cache(gdir, 'downstream_line')
+        gdir.write_pickle(np.ones(int(1e5)), 'inversion_flowlines')
+        assert not in_cache(gdir, 'downstream_line')
+        assert in_cache(gdir, 'inversion_flowlines')
+        np.testing.assert_allclose(gdir.read_pickle('downstream_line'), 0)
+
+        # The budget is shared by all glacier directories
+        other = oggm.GlacierDirectory(entity, base_dir=os.path.join(
+            self.testdir, 'other'))
+        other.write_pickle(np.ones(int(1e5)), 'inversion_flowlines')
+        assert in_cache(other, 'inversion_flowlines')
+        assert not in_cache(gdir, 'downstream_line')
+        assert not in_cache(gdir, 'inversion_flowlines')
+        np.testing.assert_allclose(gdir.read_pickle('inversion_flowlines'), 1)
+
+        # The cache is not pickled with the gdir
+        gdir = pickle.loads(pickle.dumps(gdir))
+        assert '_pickle_cache' not in gdir.__dict__
+        assert gdir.read_pickle('centerlines') == [1, 2, 3, 4]
+
     def test_glacier_masks(self):
 
         # The GIS was double checked externally with IDL.
@@ -1271,6 +1320,35 @@ class TestClimate(unittest.TestCase):
                 totest = nc_c.prcp - nc_h.prcp
                 self.assertTrue(totest.mean() < 100)
 
+    def test_distribute_climate_batched(self):
+
+        hef_file = get_demo_file('Hintereisferner_RGI5.shp')
+        entity = gpd.read_file(hef_file).iloc[0]
+
+        gdirs = []
+        for base_dir in [self.testdir, self.testdir_cru]:
+            gdir = oggm.GlacierDirectory(entity, base_dir=base_dir)
+            gis.define_glacier_region(gdir)
+            gdirs.append(gdir)
+
+        cfg.PATHS['climate_file'] = ''
+        for baseline, task, batched in [
+                ('CRU', tasks.process_cru_data,
+                 tasks.process_cru_data_batched),
+                ('HISTALP', tasks.process_histalp_data,
+                 tasks.process_histalp_data_batched)]:
+            cfg.PARAMS['baseline_climate'] = baseline
+            task(gdirs[0])
+            workflow.execute_entity_task(batched, gdirs[1:])
+            assert 'SUCCESS' in gdirs[1].get_task_status(task.__name__)
+
+            f1 = gdirs[0].get_filepath('climate_historical')
+            f2 = gdirs[1].get_filepath('climate_historical')
+            with xr.open_dataset(f1) as ds1, xr.open_dataset(f2) as ds2:
+                xr.testing.assert_allclose(ds1, ds2)
+                assert ds1.attrs == ds2.attrs
+        cfg.PATHS['climate_file'] = get_demo_file('histalp_merged_hef.nc')
+
     def test_distribute_climate_dummy(self):
 
         hef_file = get_demo_file('Hintereisferner_RGI5.shp')
@@ -3238,6 +3316,108 @@ class TestGCMClimate(unittest.TestCase):
             ss2 = ds2.temp.rolling(time=n, min_periods=1, center=True).std()
             assert utils.corrcoef(ss1, ss2) > 0.9
 
+    def test_process_gcm_ensemble(self):
+
+        hef_file = get_demo_file('Hintereisferner_RGI5.shp')
+        entity = gpd.read_file(hef_file).iloc[0]
+
+        gdir = oggm.GlacierDirectory(entity, base_dir=self.testdir)
+        gis.define_glacier_region(gdir)
+        tasks.process_cru_data(gdir)
+
+        ft = get_demo_file('tas_mon_CCSM4_rcp26_r1i1p1_g025.nc')
+        fp = get_demo_file('pr_mon_CCSM4_rcp26_r1i1p1_g025.nc')
+        files = dict(fpath_temp=ft, fpath_precip=fp)
+        gcm_climate.process_cmip5_data(gdir, filesuffix='_CCSM4', **files)
+        gcm_climate.process_cmip5_data(gdir, filesuffix='_CCSM4_ns',
+                                       scale_stddev=False, **files)
+
+        members = [(files, '_CCSM4_ens'), (files, '_CCSM4_ens2')]
+        gcm_climate.process_gcm_ensemble(gdir, members=members)
+        members = [(files, '_CCSM4_ns_ens')]
+        gcm_climate.process_gcm_ensemble_batched([gdir], members=members,
+                                                 scale_stddev=False)
+
+        for ref, suffixes in [('_CCSM4', ['_CCSM4_ens', '_CCSM4_ens2']),
+                              ('_CCSM4_ns', ['_CCSM4_ns_ens'])]:
+            f1 = gdir.get_filepath('gcm_data', filesuffix=ref)
+            with xr.open_dataset(f1) as ds1:
+                ds1 = ds1.load()
+            for suffix in suffixes:
+                f2 = gdir.get_filepath('gcm_data', filesuffix=suffix)
+                with xr.open_dataset(f2) as ds2:
+                    np.testing.assert_allclose(ds1.temp, ds2.temp,
+                                               atol=1e-4)
+                    np.testing.assert_allclose(ds1.prcp, ds2.prcp,
+                                               rtol=1e-5)
+                    assert ds1.ref_hgt == ds2.ref_hgt
+                    assert ds1.climate_source == ds2.climate_source
+
+        # Wrong GCM type
+        with pytest.raises(InvalidParamsError):
+            gcm_climate.process_gcm_ensemble(gdir, members=members,
+                                             gcm_type='cmip42')
+
+    def test_gcm_anomalies(self):
+
+        rng = np.random.RandomState(0)
+        ny, n = 100, 3
+        months = np.tile(np.roll(np.arange(1, 13), 2), ny)
+        ref = np.zeros(ny * 12, dtype=bool)
+        ref[12*40:12*70] = True
+        temp = rng.randn(ny * 12, n) + 280
+        prcp = rng.rand(ny * 12, n) * 100
+        prcp[:5] = 0
+        ref_temp = rng.randn(30 * 12, n) * 2
+        ref_prcp = rng.rand(30 * 12, n) * 200
+        ref_months = np.tile(np.arange(1, 13), 30)
+
+        pre, tmp = gcm_climate._gcm_anomalies(temp, prcp, months, ref,
+                                              ref_temp, ref_prcp,
+                                              ref_months)
+        assert pre.shape == (ny * 12, n)
+        assert np.all(pre >= 0)
+
+        # The series are processed independently
+        for k in range(n):
+            _pre, _tmp = gcm_climate._gcm_anomalies(temp[:, k], prcp[:, k],
+                                                    months, ref,
+                                                    ref_temp[:, k],
+                                                    ref_prcp[:, k],
+                                                    ref_months)
+            np.testing.assert_allclose(_pre, pre[:, k])
+            np.testing.assert_allclose(_tmp, tmp[:, k])
+
+            # The climate of the reference period is the baseline one
+            for m in range(1, 13):
+                _ref = ref & (months == m)
+                _ref_m = ref_months == m
+                np.testing.assert_allclose(np.mean(_tmp[_ref]),
+                                           np.mean(ref_temp[_ref_m, k]))
+                np.testing.assert_allclose(np.std(_tmp[_ref]),
+                                           np.std(ref_temp[_ref_m, k]),
+                                           rtol=0.1)
+                np.testing.assert_allclose(np.mean(_pre[_ref]),
+                                           np.mean(ref_prcp[_ref_m, k]))
+
+        # With a constant baseline, the temperature is the running mean
+        # of each month over the 30 years around it
+        x = temp[:, 0].reshape((ny, 12))
+        roll = np.stack([x[max(i - 15, 0):i + 16].mean(axis=0)
+                         for i in range(ny)]).flatten()
+        _, _tmp = gcm_climate._gcm_anomalies(temp[:, 0], prcp[:, 0], months,
+                                             ref, np.ones(30 * 12),
+                                             ref_prcp[:, 0], ref_months)
+        for m in range(1, 13):
+            _m = months == m
+            np.testing.assert_allclose(_tmp[_m],
+                                       roll[_m] - roll[_m & ref].mean() + 1)
+
+        with pytest.raises(InvalidParamsError):
+            ref[12*40:12*41] = False
+            gcm_climate._gcm_anomalies(temp, prcp, months, ref, ref_temp,
+                                       ref_prcp, ref_months)
+
     def test_compile_climate_input(self):
 
         filename = 'gcm_data'
@@ -150,6 +150,30 @@ class Test_ecmwf:
         with pytest.raises(ValueError):
             ecmwf.get_ecmwf_file('zoup', 'tmp')
 
+    def test_ecmwf_batched(self, class_case_dir):
+
+        # Init
+        cfg.initialize()
+        cfg.PARAMS['use_intersects'] = False
+        cfg.PATHS['working_dir'] = class_case_dir
+        cfg.PATHS['dem_file'] = get_demo_file('hef_srtm.tif')
+
+        hef_file = get_demo_file('Hintereisferner_RGI5.shp')
+
+        gdir = workflow.init_glacier_directories(gpd.read_file(hef_file))[0]
+        for d in ['ERA5', 'ERA5L', 'CERA']:
+            tasks.process_ecmwf_data(gdir, dataset=d, output_filesuffix=d)
+            workflow.execute_entity_task(tasks.process_ecmwf_data_batched,
+                                         [gdir], dataset=d,
+                                         output_filesuffix=d + '_bt')
+
+            f_ref = gdir.get_filepath('climate_historical', filesuffix=d)
+            f_bt = gdir.get_filepath('climate_historical',
+                                     filesuffix=d + '_bt')
+            with xr.open_dataset(f_ref) as ref, xr.open_dataset(f_bt) as bt:
+                xr.testing.assert_allclose(ref, bt)
+                assert ref.attrs == bt.attrs
+
     def test_ecmwf_historical_delta_method(self, class_case_dir):
 
         # Init
@@ -2,16 +2,21 @@ import warnings
 warnings.filterwarnings("once", category=DeprecationWarning)  # noqa: E402
 
 import unittest
+import logging
 import os
+import sys
 import shutil
+import subprocess
 import time
 import hashlib
+import json
 import tarfile
 import pytest
 import itertools
 from unittest import mock
 
 import numpy as np
+import xarray as xr
 import pandas as pd
 from numpy.testing import assert_array_equal, assert_allclose
 
@@ -325,6 +330,52 @@ class TestInitialize(unittest.TestCase):
         self.assertEqual(cfg.PATHS['working_dir'], expected)
 
 
+class _FakeCostGdir(object):
+    """Just what the task scheduler needs from a glacier directory."""
+
+    def __init__(self, rgi_id, area, task_time=None):
+        self.rgi_id = rgi_id
+        self.rgi_area_km2 = area
+        self.task_time = task_time
+
+    def get_task_time(self, task_name):
+        return self.task_time
+
+    def get_task_status(self, task_name):
+        return None
+
+    def log(self, task_name, **kwargs):
+        pass
+
+
+def _fake_task(gdir, suffix=''):
+    return gdir.rgi_id + suffix
+
+
+def _fake_add_task(gdir, suffix=''):
+    gdir.rgi_id += suffix
+    return gdir.rgi_id
+
+
+@utils.entity_task(logging.getLogger(__name__), io_bound=True)
+def _fake_io_task(gdir):
+    """Which process runs the task."""
+    return os.getpid()
+
+
+@utils.global_task
+def _fake_global_task(gdirs, suffix=''):
+    return [gdir.rgi_id + suffix for gdir in gdirs]
+
+
+def _fake_intersects_task(gdir):
+    gdf = cfg.PARAMS['intersects_gdf']
+    if isinstance(gdf, utils.SharedDataFrame):
+        gdf = gdf.to_dataframe()
+    gdf = gdf.loc[gdf.RGIId_1 == gdir.rgi_id]
+    return type(cfg.PARAMS['intersects_gdf']).__name__, gdf.geometry.length
+
+
 class TestWorkflowTools(unittest.TestCase):
 
     def setUp(self):
@@ -350,6 +401,54 @@ class TestWorkflowTools(unittest.TestCase):
         assert df.name == 'Hintereis'
         assert len(df) == 105
 
+    def test_task_log(self):
+
+        hef_file = utils.get_demo_file('Hintereisferner_RGI5.shp')
+        entity = gpd.read_file(hef_file).iloc[0]
+        cfg.PARAMS['use_intersects'] = False
+        gdir = oggm.GlacierDirectory(entity, base_dir=self.testdir)
+
+        assert gdir.get_task_status('task_a') is None
+        assert gdir.get_error_log() is None
+        gdir.log('task_a', task_time=2.)
+        gdir.log('task_b', err=InvalidParamsError('bad; idea'))
+        assert gdir.get_task_status('task_a') == 'SUCCESS'
+        assert gdir.get_task_time('task_a') == 2.
+        assert gdir.get_task_status('task_b') == ' idea'
+        assert gdir.get_task_time('task_b') is None
+        assert 'InvalidParamsError: bad' in gdir.get_error_log()
+
+        # The log is appended to the index
+        gdir.log('task_a', err=InvalidParamsError('bad'))
+        gdir.log('task_b', task_time=1.)
+        assert 'InvalidParamsError' in gdir.get_task_status('task_a')
+        assert gdir.get_task_time('task_a') is None
+        assert gdir.get_task_time('task_b') == 1.
+        assert 'task_b' in gdir.get_error_log()
+
+        # Also by someone else
+        with open(gdir.logfile, 'a') as f:
+            f.write('2020-01-01T00:00:00;task_c;time:3.0;SUCC')
+        assert gdir.get_task_status('task_c') is None
+        with open(gdir.logfile, 'a') as f:
+            f.write('ESS\n')
+        assert gdir.get_task_status('task_c') == 'SUCCESS'
+
+        df = utils.compile_task_log([gdir], ['task_a', 'task_c', 'task_d'],
+                                    path=False)
+        assert df.loc[gdir.rgi_id, 'task_c'] == 'SUCCESS'
+        assert df.loc[gdir.rgi_id, 'task_d'] == ''
+        df = utils.compile_task_time([gdir], ['task_b', 'task_c'],
+                                     path=False)
+        assert_allclose(df.loc[gdir.rgi_id], [1, 3])
+
+        # A new log file
+        os.remove(gdir.logfile)
+        assert gdir.get_task_status('task_a') is None
+        gdir.log('task_d')
+        assert gdir.get_task_status('task_d') == 'SUCCESS'
+        assert gdir.get_task_status('task_a') is None
+
     def test_glacier_characs(self):
 
         gdir = init_hef()
@@ -369,6 +468,268 @@ class TestWorkflowTools(unittest.TestCase):
         np.testing.assert_allclose(df['1970-2000_avg_prcpsol_max_elev'],
                                    2811, atol=200)
 
+    def test_balanced_scheduling(self):
+
+        areas = np.random.RandomState(0).lognormal(0, 2, size=50)
+        gdirs = [_FakeCostGdir('G{}'.format(i), a)
+                 for i, a in enumerate(areas)]
+        # A previous run time has priority over the area
+        gdirs[-1].task_time = 2 * areas.max()
+
+        chunks = workflow._get_balanced_chunks('_fake_task', gdirs, 2)
+        ids = [i for c in chunks for i, _ in c]
+        assert sorted(ids) == list(range(50))
+        assert chunks[0] == [(49, gdirs[-1])]
+        assert len(chunks[-1]) > 1
+
+        cfg.PARAMS['mp_processes'] = 2
+        cfg.PARAMS['use_multiprocessing'] = True
+        ref = ['G{}_t'.format(i) for i in range(50)]
+        for scheduling in ['ordered', 'balanced']:
+            cfg.PARAMS['mp_scheduling'] = scheduling
+            out = workflow.execute_entity_task(_fake_task, gdirs,
+                                               suffix='_t')
+            assert out == ref
+
+        cfg.PARAMS['mp_scheduling'] = 'random'
+        with pytest.raises(InvalidParamsError):
+            workflow.execute_entity_task(_fake_task, gdirs)
+
+    @pytest.mark.skipif(shutil.which('mpiexec') is None,
+                        reason='Requires an MPI environment.')
+    def test_mpi_scheduling(self):
+
+        pytest.importorskip('mpi4py')
+
+        # The workers run the same script, and never return from the import
+        script = """if True:
+        from oggm import cfg, workflow
+        from oggm.tests.test_utils import _FakeCostGdir, _fake_task
+        cfg.initialize_minimal(logging_level='CRITICAL')
+        cfg.PARAMS['mpi_chunksize'] = 3
+        gdirs = [_FakeCostGdir('G{}'.format(i), 10. ** (i % 4))
+                 for i in range(20)]
+        gdirs[5] = None
+        for scheduling in ['ordered', 'balanced']:
+            cfg.PARAMS['mp_scheduling'] = scheduling
+            out = workflow.execute_entity_task(_fake_task, gdirs,
+                                               suffix='_t')
+            assert out[5] is None
+            assert out[:5] == ['G{}_t'.format(i) for i in range(5)]
+            assert out[6:] == ['G{}_t'.format(i) for i in range(6, 20)]
+        print('MPI_TEST_PASSED')
+        """
+        res = subprocess.run(['mpiexec', '-n', '4', sys.executable, '-c',
+                              script, '--mpi'], stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT, timeout=300)
+        assert 'MPI_TEST_PASSED' in res.stdout.decode()
+
+    def test_io_bound_executor(self):
+
+        gdirs = [_FakeCostGdir('G{}'.format(i), 1) for i in range(8)]
+        cfg.PARAMS['mp_processes'] = 2
+        cfg.PARAMS['use_multiprocessing'] = True
+
+        # The I/O bound tasks run in threads of this process
+        assert _fake_io_task.__dict__['io_bound']
+        out = workflow.execute_entity_task(_fake_io_task, gdirs)
+        assert out == [os.getpid()] * 8
+
+        # Unless asked otherwise
+        out = workflow.execute_entity_task(_fake_io_task, gdirs,
+                                           executor='process')
+        assert os.getpid() not in out
+        out = workflow.execute_entity_task(_fake_task, gdirs, suffix='_t',
+                                           executor='thread')
+        assert out == ['G{}_t'.format(i) for i in range(8)]
+
+        with pytest.raises(InvalidParamsError):
+            workflow.execute_entity_task(_fake_task, gdirs,
+                                         executor='gpu')
+
+    def test_execute_pipeline(self):
+
+        gdirs = [_FakeCostGdir('G{}'.format(i), 1) for i in range(10)]
+        cfg.PARAMS['mp_processes'] = 2
+        cfg.PARAMS['use_multiprocessing'] = True
+
+        # The whole chain is run on each glacier in the same process
+        out = workflow.execute_pipeline(gdirs, [
+            (_fake_add_task, dict(suffix='_a')),
+            (_fake_add_task, dict(suffix='_b')),
+        ])
+        assert out == ['G{}_a_b'.format(i) for i in range(10)]
+
+        # Global tasks get all glaciers at once
+        cfg.PARAMS['use_multiprocessing'] = False
+        out = workflow.execute_pipeline(gdirs, [
+            (_fake_add_task, dict(suffix='_a')),
+            (_fake_global_task, dict(suffix='_g')),
+        ])
+        assert out == ['G{}_a_g'.format(i) for i in range(10)]
+        assert workflow.execute_pipeline([], [_fake_add_task]) is None
+
+    def test_shared_dataframe(self):
+
+        from shapely.geometry import LineString
+        geoms = [LineString([(0, 0), (i + 1, 0)]) for i in range(5)]
+        gdf = gpd.GeoDataFrame(dict(RGIId_1=['G{}'.format(i % 2)
+                                             for i in range(5)],
+                                    RGIId_2=['G{}'.format(i + 2)
+                                             for i in range(5)],
+                                    val=np.arange(5.)),
+                               geometry=geoms, crs='EPSG:32632')
+        sdf = utils.SharedDataFrame(gdf, os.path.join(self.testdir, 'sh'))
+        assert len(sdf) == 5
+        assert isinstance(sdf['val'], np.memmap)
+        df = sdf.to_dataframe(sdf['RGIId_1'] == 'G1')
+        assert_array_equal(df.index, [1, 3])
+        assert_allclose(df.geometry.length, [2, 4])
+        assert_allclose(df.val, [1, 3])
+
+        # Pickling is cheap
+        import pickle
+        sdf = pickle.loads(pickle.dumps(sdf))
+        assert len(pickle.dumps(sdf)) < 1000
+        df = sdf.to_dataframe()
+        assert df.crs == gdf.crs
+        assert_array_equal(df.RGIId_2, gdf.RGIId_2)
+        assert all(df.geometry.geom_equals(gdf.geometry))
+
+        # The processes get the shared data
+        cfg.set_intersects_db(gdf)
+        cfg.PARAMS['mp_processes'] = 2
+        cfg.PARAMS['use_multiprocessing'] = True
+        cfg.PARAMS['mp_shared_inputs'] = True
+        gdirs = [_FakeCostGdir('G{}'.format(i), 1) for i in range(3)]
+        out = workflow.execute_entity_task(_fake_intersects_task, gdirs)
+        assert [o[0] for o in out] == ['SharedDataFrame'] * 3
+        assert_allclose(out[1][1], [2, 4])
+        assert len(out[2][1]) == 0
+        shared_dir = workflow._mp_shared_dir
+        assert os.path.isdir(shared_dir)
+        workflow.reset_multiprocessing()
+        assert not os.path.exists(shared_dir)
+
+    def test_grid_cell_cache(self):
+
+        cfg.PATHS['working_dir'] = self.testdir
+        assert utils.get_grid_cell_cache('cru') is None
+        cfg.PARAMS['use_grid_cell_cache'] = True
+        cache = utils.get_grid_cell_cache('cru')
+        assert cache.directory == os.path.join(self.testdir, 'cache', 'cru')
+
+        # The keys depend on the content only
+        a = np.arange(12.)
+        key = cache.make_key('CRU', (1, 2), a, 1961)
+        assert key == cache.make_key('CRU', (1, 2), a.copy(), 1961)
+        assert key != cache.make_key('CRU', (1, 2), a + 1, 1961)
+        assert key != cache.make_key('CRU', (1, 2), a.astype(np.float32),
+                                     1961)
+        assert key != cache.make_key('CRU', (2, 1), a, 1961)
+        assert key != cache.make_key('CRU', 1, 2, a, 1961)
+
+        # Files are identified by their version on disk
+        fpath = os.path.join(self.testdir, 'f.txt')
+        with open(fpath, 'w') as f:
+            f.write('a')
+        fkey = cache.file_key(fpath)
+        with open(fpath, 'w') as f:
+            f.write('ab')
+        assert fkey != cache.file_key(fpath)
+
+        assert cache.get(key) is None
+        cache.set(key, dict(temp=a))
+        assert_array_equal(cache.get(key)['temp'], a)
+        # Other instances (e.g. in other processes) see the entry
+        cache = utils.GridCellCache('cru')
+        assert_array_equal(cache.get(key)['temp'], a)
+        assert utils.GridCellCache('ecmwf').get(key) is None
+        cache.set(key, dict(temp=a + 1))
+        assert_array_equal(cache.get(key)['temp'], a + 1)
+        assert len(os.listdir(os.path.dirname(cache._path(key)))) == 1
+
+    def test_point_series_store(self):
+
+        cfg.PATHS['tmp_dir'] = self.testdir
+        time = pd.date_range('2000-01-01', '2009-12-01', freq='MS')
+        lon = np.arange(0, 360, 10.)
+        lat = np.arange(80, -90, -10.)
+        data = np.random.RandomState(0).randn(len(time), len(lat), len(lon))
+        ds = xr.Dataset({'t2m': (('time', 'latitude', 'longitude'), data),
+                         'z': (('latitude', 'longitude'), data[0])},
+                        coords={'time': time, 'longitude': lon,
+                                'latitude': lat})
+        fpath = os.path.join(self.testdir, 'grid.nc')
+        ds.to_netcdf(fpath)
+
+        store = utils.PointSeriesStore.from_netcdf(fpath, block_size=50)
+        assert store.gridded
+        assert store.variables == ['t2m']
+        assert_array_equal(store.time, time)
+        lons = [0., 4.9, 5.1, 355., 123.]
+        lats = [80., -76., 0., 14., -80.]
+        points = store.nearest(lons, lats)
+        ts = store.time_slice('2001-10-01', '2003-09-01')
+        out = store.series('t2m', points)[:, ts]
+        for k, (x, y) in enumerate(zip(lons, lats)):
+            ref = ds.t2m.sel(longitude=x, latitude=y, method='nearest')
+            ref = ref.sel(time=slice('2001-10-01', '2003-09-01'))
+            assert_array_equal(out[k], ref)
+            p_lon, p_lat = store.coordinates(points[k])
+            assert p_lon == ref.longitude
+            assert p_lat == ref.latitude
+
+        # Pickling is cheap
+        import pickle
+        store = pickle.loads(pickle.dumps(store))
+        assert len(pickle.dumps(store)) < 1000
+        jj, ii = np.divmod(points, len(lon))
+        out_all = data[:, jj, ii].T
+        assert_array_equal(store.series('t2m', points), out_all)
+
+        # The store is written again if the file changed
+        (ds * 2).to_netcdf(fpath)
+        store = utils.PointSeriesStore.from_netcdf(fpath)
+        assert_allclose(store.series('t2m', points), out_all * 2)
+
+        # Flattened data
+        lon2d, lat2d = np.meshgrid(lon, lat)
+        ds = xr.Dataset({'tp': (('time', 'points'),
+                                data.reshape((len(time), -1)))},
+                        coords={'time': time,
+                                'longitude': ('points', lon2d.flatten()),
+                                'latitude': ('points', lat2d.flatten())})
+        fpath = os.path.join(self.testdir, 'flat.nc')
+        ds.to_netcdf(fpath)
+        store = utils.PointSeriesStore.from_netcdf(fpath, block_size=50)
+        assert not store.gridded
+        points = store.nearest(lons, lats)
+        assert_array_equal(store.series('tp', points), out_all)
+        assert_array_equal(store.coordinates(points)[0], [0, 0, 10, 350, 120])
+
+        # Times which can't be decoded
+        ds['time'] = ('time', np.arange(len(time)),
+                      {'units': 'months since 2000-01-01'})
+        fpath = os.path.join(self.testdir, 'raw_times.nc')
+        ds.to_netcdf(fpath)
+        with pytest.raises(ValueError):
+            utils.PointSeriesStore.from_netcdf(fpath)
+        store = utils.PointSeriesStore.from_netcdf(fpath, decode_times=False)
+        assert_array_equal(store.time, np.arange(len(time)))
+        assert_array_equal(store.series('tp', points), out_all)
+
+        # An outdated store is replaced
+        directory = store.directory
+        os.remove(os.path.join(directory, 'meta.json'))
+        with open(os.path.join(directory, 'meta.json'), 'w') as f:
+            json.dump(dict(store.meta, source=None), f)
+        store = utils.PointSeriesStore.from_netcdf(fpath, decode_times=False)
+        assert store.directory == directory
+        assert_array_equal(store.series('tp', points), out_all)
+        assert not [d for d in os.listdir(os.path.dirname(directory))
+                    if '.tmp' in d]
+
     def test_demo_glacier_id(self):
 
         cfg.initialize()
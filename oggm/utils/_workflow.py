@@ -12,9 +12,11 @@ import shutil
 import tarfile
 import sys
 import signal
+import threading
 import datetime
 import logging
 import pickle
+import hashlib
 import warnings
 from collections import OrderedDict
 from functools import partial, wraps
@@ -28,8 +30,10 @@ import importlib
 import pandas as pd
 import numpy as np
 from scipy import stats
+from scipy.spatial import cKDTree
 import xarray as xr
 import shapely.geometry as shpg
+import shapely.wkb
 from shapely.ops import transform as shp_trafo
 import netCDF4
 
@@ -51,6 +55,10 @@ try:
     import pyproj
 except ImportError:
     pass
+try:
+    import zarr
+except ImportError:
+    zarr = None
 
 
 # Locals
@@ -59,7 +67,7 @@ from oggm.utils._funcs import (calendardate_to_hydrodate, date_to_floatyear,
                                tolist, filter_rgi_name, parse_rgi_meta,
                                haversine, multipolygon_to_polygon)
 from oggm.utils._downloads import (get_demo_file, get_wgms_files,
-                                   get_rgi_glacier_entities)
+                                   get_rgi_glacier_entities, get_lock)
 from oggm import cfg
 from oggm.exceptions import InvalidParamsError, InvalidWorkflowError
 
@@ -282,6 +290,466 @@ class LRUFileCache():
         self.purge()
 
 
+class SharedDataFrame(object):
+    """A read-only (Geo)DataFrame stored in memory-mapped files.
+
+    The columns are written once to ``.npy`` files, and each process
+    accessing them maps the files into memory instead of reading them: the
+    operating system shares the same memory pages between all processes.
+    Only the paths to the files are pickled, i.e. sending the object to
+    other processes is cheap.
+
+    Geometries are stored as WKB and only converted back to shapely objects
+    for the selected rows (see :py:meth:`to_dataframe`).
+    """
+
+    def __init__(self, df, directory):
+        """Write the data to disk.
+
+        Parameters
+        ----------
+        df : pandas.DataFrame or geopandas.GeoDataFrame
+            the data to share
+        directory : str
+            where to write the files
+        """
+        mkdir(directory)
+        self.directory = directory
+        self.columns = list(df.columns)
+        self.geometry = None
+        self.crs = None
+        if 'geometry' in df.columns and hasattr(df, 'crs'):
+            self.geometry = df.geometry.name
+            self.crs = df.crs
+        self._len = len(df)
+        self._arrays = dict()
+
+        self._save('index', np.asarray(df.index))
+        for col in self.columns:
+            if col == self.geometry:
+                wkb = [g.wkb for g in df[col]]
+                offsets = np.cumsum([0] + [len(w) for w in wkb])
+                self._save(col + '.offsets', offsets)
+                self._save(col, np.frombuffer(b''.join(wkb), dtype=np.uint8))
+                continue
+            values = np.asarray(df[col])
+            if values.dtype == object and all(isinstance(v, str)
+                                              for v in values):
+                values = values.astype(str)
+            self._save(col, values)
+
+    def _save(self, name, values):
+        np.save(os.path.join(self.directory, name + '.npy'), values)
+
+    def _load(self, name):
+        out = self.__dict__.setdefault('_arrays', dict()).get(name)
+        if out is None:
+            path = os.path.join(self.directory, name + '.npy')
+            try:
+                out = np.load(path, mmap_mode='r')
+            except ValueError:
+                # Python objects can't be memory-mapped
+                out = np.load(path, allow_pickle=True)
+            self._arrays[name] = out
+        return out
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_arrays', None)
+        return state
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, col):
+        """The (read-only) values of a column."""
+        if col not in self.columns or col == self.geometry:
+            raise KeyError(col)
+        return self._load(col)
+
+    def to_dataframe(self, rows=None):
+        """Build a (Geo)DataFrame out of the data.
+
+        Parameters
+        ----------
+        rows : array-like of bool or int, optional
+            the rows to select (default: all)
+
+        Returns
+        -------
+        a pandas.DataFrame or geopandas.GeoDataFrame
+        """
+        idx = np.arange(self._len)
+        if rows is not None:
+            idx = idx[rows]
+        data = OrderedDict()
+        for col in self.columns:
+            if col == self.geometry:
+                wkb = self._load(col)
+                offsets = self._load(col + '.offsets')
+                data[col] = [shapely.wkb.loads(wkb[offsets[i]:offsets[i+1]]
+                                               .tobytes()) for i in idx]
+            else:
+                data[col] = np.array(self._load(col)[idx])
+        index = np.array(self._load('index')[idx])
+        if self.geometry is not None:
+            return gpd.GeoDataFrame(data, index=index, crs=self.crs,
+                                    geometry=self.geometry)
+        return pd.DataFrame(data, index=index)
+
+
+class GridCellCache(object):
+    """A file-backed store of data computed for a grid cell.
+
+    Many glaciers fall in the same grid cell of a climate dataset, and the
+    data extracted for this cell is the same for all of them. The entries
+    are addressed by a hash of everything they depend on (see
+    :py:meth:`make_key`) and are written as pickle files, so that they
+    are shared between the processes (and between runs) using the same
+    directory. The files are written atomically: concurrent writers of the
+    same entry simply overwrite each other with the same data.
+    """
+
+    def __init__(self, name, base_dir=None):
+        """Instantiate.
+
+        Parameters
+        ----------
+        name : str
+            the name of the cache (one sub-directory per name)
+        base_dir : str
+            where to write the cache. Defaults to
+            `cfg.PATHS['working_dir'] + /cache/`
+        """
+        if base_dir is None:
+            if not cfg.PATHS.get('working_dir', None):
+                raise ValueError("Need a valid PATHS['working_dir']!")
+            base_dir = os.path.join(cfg.PATHS['working_dir'], 'cache')
+        self.directory = os.path.join(base_dir, name)
+
+    @staticmethod
+    def make_key(*parts):
+        """The key of an entry: a hash of the given (nested) parts.
+
+        The parts can be any object with a reproducible repr, tuples or
+        lists of them, or numpy arrays (hashed by their content).
+        """
+
+        h = hashlib.sha1()
+
+        def _update(part):
+            if isinstance(part, (tuple, list)):
+                h.update(b'(')
+                for p in part:
+                    _update(p)
+                h.update(b')')
+            elif isinstance(part, np.ndarray):
+                h.update('{}{}'.format(part.dtype, part.shape).encode())
+                if part.dtype == object:
+                    h.update(repr(part.tolist()).encode())
+                else:
+                    h.update(np.ascontiguousarray(part).tobytes())
+            else:
+                h.update(repr(part).encode())
+            h.update(b';')
+
+        _update(parts)
+        return h.hexdigest()
+
+    @staticmethod
+    def file_key(path):
+        """A key part identifying a file and its version on disk."""
+        st = os.stat(path)
+        return os.path.abspath(path), st.st_size, st.st_mtime_ns
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.pkl')
+
+    def get(self, key):
+        """The entry stored under this key (None if there is none)."""
+        try:
+            with open(self._path(key), 'rb') as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def set(self, key, value):
+        """Store an entry under this key."""
+        path = self._path(key)
+        dirname = mkdir(os.path.dirname(path))
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, protocol=-1)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+class PointSeriesStore(object):
+    """The time series of a gridded dataset, stored point by point.
+
+    Climate files are written time step after time step: reading the
+    series of one location reads (or at least seeks through) the entire
+    file. The store holds one array of shape (n_points, n_times) per
+    variable in a memory-mapped ``.npy`` file, so that the series of each
+    point is contiguous on disk. Reading it is a single small read, and
+    the pages are shared between all processes using the store.
+
+    The points are located with the (sorted) coordinates for gridded
+    data, and with a KD-tree for flattened data (with a ``points``
+    dimension). Only the paths are pickled when sending the store to
+    other processes.
+    """
+
+    def __init__(self, directory):
+        """Open an existing store (see :py:meth:`from_netcdf`).
+
+        Parameters
+        ----------
+        directory : str
+            the directory of the store
+        """
+        self.directory = directory
+        with open(os.path.join(directory, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        self.variables = self.meta['variables']
+        self.gridded = self.meta['gridded']
+        self._arrays = dict()
+
+    @classmethod
+    def from_netcdf(cls, fpath, directory=None, lon='longitude',
+                    lat='latitude', isel=None, decode_times=True,
+                    block_size=2**16):
+        """The store of a NetCDF file, written if needed.
+
+        The variables with a time dimension and the spatial dimensions
+        are stored. The store is written again if the file changed.
+
+        Parameters
+        ----------
+        fpath : str
+            path to the NetCDF file
+        directory : str
+            where to write the store. Defaults to a sub-directory of
+            `cfg.PATHS['tmp_dir'] + /point_stores/`
+        lon : str
+            the name of the longitude coordinate
+        lat : str
+            the name of the latitude coordinate
+        isel : dict
+            the indices to select along the other dimensions, if any (e.g.
+            the ensemble member)
+        decode_times : bool
+            passed to :py:func:`xarray.open_dataset`. Set to False for files
+            with times xarray cannot decode (the time coordinate of the
+            store is then the raw one)
+        block_size : int
+            the (approximate) number of points converted at once, to limit
+            the memory usage
+
+        Returns
+        -------
+        a :py:class:`PointSeriesStore`
+        """
+
+        fpath = os.path.abspath(fpath)
+        key = repr(isel) + ('' if decode_times else 'raw_times')
+        if directory is None:
+            hid = hashlib.md5((fpath + key).encode()).hexdigest()[:7]
+            directory = os.path.join(cfg.PATHS['tmp_dir'], 'point_stores',
+                                     hid + '_' + os.path.basename(fpath))
+        st = os.stat(fpath)
+        source = [fpath, st.st_size, st.st_mtime_ns, key]
+
+        # The lock is per process group only: other processes (e.g. MPI
+        # ranks) may convert the same file at the same time. Each of them
+        # writes to its own directory, which is then renamed to the store
+        out = cls._open_if_valid(directory, source)
+        if out is not None:
+            return out
+        with get_lock():
+            out = cls._open_if_valid(directory, source)
+            if out is not None:
+                return out
+            parent = mkdir(os.path.dirname(directory))
+            prefix = os.path.basename(directory) + '.tmp'
+            tmp_dir = tempfile.mkdtemp(prefix=prefix, dir=parent)
+            try:
+                with xr.open_dataset(fpath, decode_times=decode_times) as ds:
+                    if isel:
+                        ds = ds.isel(**isel)
+                    cls._write(ds, tmp_dir, lon, lat, source, block_size)
+            except BaseException:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                raise
+            try:
+                os.rename(tmp_dir, directory)
+            except OSError:
+                # The directory exists: a store written by another process
+                # in the meantime, or an outdated one that we replace
+                out = cls._open_if_valid(directory, source)
+                if out is not None:
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+                    return out
+                old_dir = tempfile.mkdtemp(prefix=prefix, dir=parent)
+                try:
+                    os.rename(directory, os.path.join(old_dir, 'store'))
+                    os.rename(tmp_dir, directory)
+                except OSError:
+                    # Another process replaced it first
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+                shutil.rmtree(old_dir, ignore_errors=True)
+        return cls(directory)
+
+    @classmethod
+    def _open_if_valid(cls, directory, source):
+        """The store in this directory if it was written from source."""
+        try:
+            out = cls(directory)
+        except (FileNotFoundError, ValueError):
+            # Missing or (being) replaced
+            return None
+        return out if out.meta['source'] == source else None
+
+    @staticmethod
+    def _write(ds, directory, lon, lat, source, block_size):
+
+        gridded = lon in ds.dims
+        if gridded:
+            sdims = (lat, lon)
+        else:
+            sdims = ds[lon].dims
+        shape = [ds.dims[d] for d in sdims]
+        n_points = int(np.prod(shape))
+        per_row = n_points // shape[0]
+        n_rows = max(1, block_size // per_row)
+        n_times = ds.dims['time']
+
+        variables = [v for v in ds.data_vars
+                     if set(ds[v].dims) == set(('time',) + sdims)]
+        for v in variables:
+            da = ds[v].transpose('time', *sdims)
+            out = np.lib.format.open_memmap(os.path.join(directory,
+                                                         v + '.npy'),
+                                            mode='w+', dtype=da.dtype,
+                                            shape=(n_points, n_times))
+            for r0 in range(0, shape[0], n_rows):
+                block = da.isel({sdims[0]: slice(r0, r0 + n_rows)}).values
+                block = block.reshape((n_times, -1)).T
+                out[r0 * per_row:r0 * per_row + len(block)] = block
+            out.flush()
+            del out
+
+        np.save(os.path.join(directory, 'lon.npy'), ds[lon].values)
+        np.save(os.path.join(directory, 'lat.npy'), ds[lat].values)
+        np.save(os.path.join(directory, 'time.npy'), ds['time'].values)
+        if not gridded:
+            tree = cKDTree(np.stack([ds[lon].values, ds[lat].values],
+                                    axis=1))
+            with open(os.path.join(directory, 'tree.pkl'), 'wb') as f:
+                pickle.dump(tree, f, protocol=-1)
+
+        meta = dict(source=source, gridded=gridded, shape=shape,
+                    variables=variables)
+        with open(os.path.join(directory, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+    def _load(self, name):
+        out = self.__dict__.setdefault('_arrays', dict()).get(name)
+        if out is None:
+            if name == 'tree':
+                with open(os.path.join(self.directory, 'tree.pkl'),
+                          'rb') as f:
+                    out = pickle.load(f)
+            else:
+                path = os.path.join(self.directory, name + '.npy')
+                try:
+                    out = np.load(path, mmap_mode='r')
+                except ValueError:
+                    # Python objects can't be memory-mapped
+                    out = np.load(path, allow_pickle=True)
+            self._arrays[name] = out
+        return out
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_arrays', None)
+        return state
+
+    @property
+    def time(self):
+        """The time coordinate."""
+        return self._load('time')
+
+    @property
+    def lon(self):
+        """The longitude coordinate (of the grid or of the points)."""
+        return self._load('lon')
+
+    @property
+    def lat(self):
+        """The latitude coordinate (of the grid or of the points)."""
+        return self._load('lat')
+
+    def nearest(self, lons, lats):
+        """The indices of the points nearest to the given locations.
+
+        For gridded data, this is the same as the ``method='nearest'``
+        selection of xarray along each coordinate.
+        """
+        lons = np.atleast_1d(lons)
+        lats = np.atleast_1d(lats)
+        if not self.gridded:
+            _, ip = self._load('tree').query(np.stack([lons, lats], axis=1))
+            return ip
+        ii = pd.Index(self.lon).get_indexer(lons, method='nearest')
+        jj = pd.Index(self.lat).get_indexer(lats, method='nearest')
+        return jj * self.meta['shape'][1] + ii
+
+    def coordinates(self, points):
+        """The (lon, lat) coordinates of the points."""
+        lon, lat = self.lon, self.lat
+        if not self.gridded:
+            return lon[points], lat[points]
+        jj, ii = np.divmod(points, self.meta['shape'][1])
+        return lon[ii], lat[jj]
+
+    def time_slice(self, t0=None, t1=None):
+        """The slice of the time steps between t0 and t1 (included)."""
+        return pd.Index(self.time).slice_indexer(t0, t1)
+
+    def series(self, var, points):
+        """The series of a variable, of shape (len(points), n_times)."""
+        if var not in self.variables:
+            raise KeyError(var)
+        return np.asarray(self._load(var)[points])
+
+    def close(self):
+        """Release the memory-mapped files."""
+        self._arrays = dict()
+
+
+def get_grid_cell_cache(name):
+    """The grid cell cache with this name, if the cache is switched on.
+
+    Parameters
+    ----------
+    name : str
+        the name of the cache (e.g. the name of the climate dataset)
+
+    Returns
+    -------
+    a :py:class:`GridCellCache`, or None if
+    ``cfg.PARAMS['use_grid_cell_cache']`` is False
+    """
+    if not cfg.PARAMS.get('use_grid_cell_cache', False):
+        return None
+    return GridCellCache(name)
+
+
 def lazy_property(fn):
     """Decorator that makes a property lazy-evaluated."""
 
@@ -358,6 +826,30 @@ class ncDataset(netCDF4.Dataset):
         self.set_auto_mask(False)
 
 
+def get_output_format(output_format=None):
+    """Checks the format of the large output files.
+
+    Parameters
+    ----------
+    output_format : str
+        'netcdf' or 'zarr' (chunked Zarr directory store). Defaults to
+        cfg.PARAMS['output_format'].
+
+    Returns
+    -------
+    the output format
+    """
+    if output_format is None:
+        output_format = cfg.PARAMS['output_format']
+    if output_format not in ['netcdf', 'zarr']:
+        raise InvalidParamsError('output_format should be one of `netcdf` '
+                                 'or `zarr`, got: {}'.format(output_format))
+    if output_format == 'zarr' and zarr is None:
+        raise ImportError("The zarr output format needs zarr to be "
+                          "installed.")
+    return output_format
+
+
 def pipe_log(gdir, task_func_name, err=None):
     """Log the error in a specific directory."""
 
@@ -411,7 +903,7 @@ class entity_task(object):
     exceptions, logging, and (some day) database for job-controlling.
     """
 
-    def __init__(self, log, writes=[], fallback=None):
+    def __init__(self, log, writes=[], fallback=None, io_bound=False):
         """Decorator syntax: ``@oggm_task(log, writes=['dem', 'outlines'])``
 
         Parameters
@@ -423,10 +915,15 @@ class entity_task(object):
             available in ``cfg.BASENAMES``)
         fallback: python function
             will be executed on gdir if entity_task fails
+        io_bound: bool
+            whether the task spends most of its time reading, writing or
+            compressing files. Such tasks are run in a pool of threads
+            by ``execute_entity_task`` instead of a pool of processes.
         """
         self.log = log
         self.writes = writes
         self.fallback = fallback
+        self.io_bound = io_bound
 
         cnt = ['    Notes']
         cnt += ['    -----']
@@ -469,14 +966,18 @@ class entity_task(object):
                 self.log.info('(%s) %s', gdir.rgi_id, task_name)
 
             # Run the task
+            # Signals can only be used in the main thread
+            use_timeout = (cfg.PARAMS['task_timeout'] > 0 and
+                           threading.current_thread() is
+                           threading.main_thread())
             try:
-                if cfg.PARAMS['task_timeout'] > 0:
+                if use_timeout:
                     signal.signal(signal.SIGALRM, _timeout_handler)
                     signal.alarm(cfg.PARAMS['task_timeout'])
                 ex_t = time.time()
                 out = task_func(gdir, **kwargs)
                 ex_t = time.time() - ex_t
-                if cfg.PARAMS['task_timeout'] > 0:
+                if use_timeout:
                     signal.alarm(0)
                 if task_name != 'gdir_to_tar':
                     gdir.log(task_name, task_time=ex_t)
@@ -497,6 +998,7 @@ class entity_task(object):
             return out
 
         _entity_task.__dict__['is_entity_task'] = True
+        _entity_task.__dict__['io_bound'] = self.io_bound
         return _entity_task
 
 
@@ -586,24 +1088,304 @@ def demo_glacier_id(key):
     return None
 
 
+def group_gdirs_by_tile(gdirs, tile_size=10):
+    """Groups glacier directories per hemisphere and lon-lat tile.
+
+    Useful for tasks reading the same gridded data for many glaciers at
+    once, while keeping the size of the data read in memory bounded.
+
+    Parameters
+    ----------
+    gdirs : list of :py:class:`oggm.GlacierDirectory` objects
+        the glacier directories to group
+    tile_size : float
+        the size of the tiles (in degrees)
+
+    Returns
+    -------
+    a list of lists of glacier directories
+    """
+
+    groups = OrderedDict()
+    for gdir in gdirs:
+        key = (gdir.hemisphere,
+               int(np.floor(gdir.cenlon / tile_size)),
+               int(np.floor(gdir.cenlat / tile_size)))
+        groups.setdefault(key, []).append(gdir)
+    return list(groups.values())
+
+
+# Lock for the threads of a process writing to the same container
+_run_output_container_lock = threading.Lock()
+# Index of the run output containers: {path: (mtime, size, {key: time})}
+_run_output_index = dict()
+# The latest run output of each key: {key: (path, time)}, and when it was
+# computed. It is recomputed after a few seconds or for unknown keys
+_run_output_latest = dict()
+_run_output_latest_time = 0.
+_RUN_OUTPUT_INDEX_TTL = 5.
+
+# The in-memory LRU cache of the (uncompressed) pickle files, shared by all
+# glacier directories of the process: {path: (mtime_ns, size, bytes)}
+_pickle_cache = OrderedDict()
+_pickle_cache_nbytes = 0
+_pickle_cache_lock = threading.Lock()
+
+# The netCDF library is not thread-safe: the threads reading the run outputs
+# have to take turns for the netCDF files (the zarr stores are fine)
+_netcdf_read_lock = threading.Lock()
+
+
+def _get_cached_pickle(fp):
+    """The cached pickle bytes, if the file didn't change since then."""
+
+    global _pickle_cache_nbytes
+    with _pickle_cache_lock:
+        if fp not in _pickle_cache:
+            return None
+        mtime, size, data = _pickle_cache[fp]
+        try:
+            st = os.stat(fp)
+        except OSError:
+            st = None
+        if st is None or (st.st_mtime_ns, st.st_size) != (mtime, size):
+            # The disk is authoritative
+            del _pickle_cache[fp]
+            _pickle_cache_nbytes -= len(data)
+            return None
+        _pickle_cache.move_to_end(fp)
+        return data
+
+
+def _uncache_pickle(fp):
+    """Remove a file from the pickle cache."""
+
+    global _pickle_cache_nbytes
+    with _pickle_cache_lock:
+        v = _pickle_cache.pop(fp, None)
+        if v is not None:
+            _pickle_cache_nbytes -= len(v[2])
+
+
+def _cache_pickle(fp, data):
+    """Add the pickle bytes to the cache and remove the oldest ones."""
+
+    global _pickle_cache_nbytes
+    _uncache_pickle(fp)
+    maxsize = cfg.PARAMS['gdir_pickle_cache_size'] * 1e6
+    if len(data) > maxsize:
+        return
+    st = os.stat(fp)
+    with _pickle_cache_lock:
+        _pickle_cache[fp] = (st.st_mtime_ns, st.st_size, data)
+        _pickle_cache_nbytes += len(data)
+        while _pickle_cache_nbytes > maxsize:
+            _, v = _pickle_cache.popitem(last=False)
+            _pickle_cache_nbytes -= len(v[2])
+
+
+def _copy_nc_group(src, dst):
+    """Recursively copies a netCDF group (dims, variables, attributes)."""
+
+    dst.setncatts({k: src.getncattr(k) for k in src.ncattrs()})
+    for name, dim in src.dimensions.items():
+        dst.createDimension(name, None if dim.isunlimited() else len(dim))
+    for name, var in src.variables.items():
+        attrs = {k: var.getncattr(k) for k in var.ncattrs()}
+        filters = var.filters() or {}
+        v = dst.createVariable(name, var.datatype, var.dimensions,
+                               fill_value=attrs.pop('_FillValue', None),
+                               zlib=filters.get('zlib', False),
+                               complevel=filters.get('complevel', 4))
+        v.setncatts(attrs)
+        if var.size > 0:
+            v[...] = var[...]
+    for name, grp in src.groups.items():
+        _copy_nc_group(grp, dst.createGroup(name))
+
+
+def _get_run_output_containers():
+    """The paths of the run output containers in the working directory."""
+    return sorted(glob.glob(os.path.join(cfg.PATHS['working_dir'],
+                                         'run_outputs', 'run_outputs*.nc')))
+
+
+def _get_run_output_index(key=None):
+    """Which container holds which run outputs (the latest written wins).
+
+    The containers are only scanned again if the index is older than a
+    few seconds, or if ``key`` is not in the index.
+
+    Returns
+    -------
+    a dict of {key: (path, time written)}
+    """
+    global _run_output_latest, _run_output_latest_time
+
+    if (time.time() - _run_output_latest_time < _RUN_OUTPUT_INDEX_TTL and
+            (key is None or key in _run_output_latest)):
+        return _run_output_latest
+
+    latest = dict()
+    paths = _get_run_output_containers()
+    for path in paths:
+        st = os.stat(path)
+        entry = _run_output_index.get(path)
+        if entry is None or entry[:2] != (st.st_mtime_ns, st.st_size):
+            with ncDataset(path) as nc:
+                keys = {k: g.getncattr('written_at')
+                        for k, g in nc.groups.items()}
+            entry = (st.st_mtime_ns, st.st_size, keys)
+            _run_output_index[path] = entry
+        for k, t in entry[2].items():
+            if k not in latest or t >= latest[k][1]:
+                latest[k] = (path, t)
+    for path in list(_run_output_index):
+        if path not in paths:
+            del _run_output_index[path]
+    _run_output_latest = latest
+    _run_output_latest_time = time.time()
+    return latest
+
+
+def add_to_run_output_container(key, files):
+    """Moves run output files into this process' run output container.
+
+    The container is a netCDF file in the ``run_outputs`` directory of the
+    working directory, shared by all glaciers run by the same process.
+    The files are stored in the group ``key/name``, with the same groups
+    and variables as the original file, and the files are deleted.
+
+    Parameters
+    ----------
+    key : str
+        the key of the run outputs (usually rgi_id + filesuffix)
+    files : dict
+        the files to move, keyed by their name (e.g. 'model_run')
+    """
+
+    odir = mkdir(os.path.join(cfg.PATHS['working_dir'], 'run_outputs'))
+    with _run_output_container_lock:
+        # One file per process, but a key can only be written once per file
+        k = 0
+        while True:
+            path = os.path.join(odir, 'run_outputs_{}_{}_{}.nc'.format(
+                platform.node(), os.getpid(), k))
+            if not os.path.exists(path):
+                break
+            with ncDataset(path) as nc:
+                if key not in nc.groups:
+                    break
+            k += 1
+
+        mode = 'a' if os.path.exists(path) else 'w'
+        written_at = time.time()
+        with ncDataset(path, mode, format='NETCDF4') as nc:
+            grp = nc.createGroup(key)
+            grp.setncattr('written_at', written_at)
+            for name, fpath in files.items():
+                if fpath is None or not os.path.exists(fpath):
+                    continue
+                with ncDataset(fpath) as src:
+                    _copy_nc_group(src, grp.createGroup(name))
+        _run_output_latest[key] = (path, written_at)
+    for fpath in files.values():
+        if fpath is not None and os.path.exists(fpath):
+            os.remove(fpath)
+
+
+def merge_run_output_containers(delete=True):
+    """Merges the run output containers of all processes into one file.
+
+    Only the latest outputs of each glacier and filesuffix are kept. The
+    merged file is ``run_outputs/run_outputs.nc`` in the working directory.
+
+    Parameters
+    ----------
+    delete : bool
+        delete the per-process containers once merged
+
+    Returns
+    -------
+    the path to the merged container
+    """
+
+    odir = os.path.join(cfg.PATHS['working_dir'], 'run_outputs')
+    path = os.path.join(odir, 'run_outputs.nc')
+    global _run_output_latest_time
+
+    # Force a new scan of the containers
+    _run_output_latest_time = 0.
+    index = _get_run_output_index()
+    if not index:
+        return None
+
+    tmp_path = path + '.tmp'
+    with ncDataset(tmp_path, 'w', format='NETCDF4') as nc:
+        for key in sorted(index):
+            with ncDataset(index[key][0]) as src:
+                _copy_nc_group(src.groups[key], nc.createGroup(key))
+
+    os.replace(tmp_path, path)
+    if delete:
+        for fpath in _get_run_output_containers():
+            if fpath != path:
+                os.remove(fpath)
+    _run_output_latest_time = 0.
+    return path
+
+
+def get_run_output_location(gdir, filename, filesuffix=''):
+    """Where to find a run output file of a glacier directory.
+
+    The run outputs are either in the glacier directory (the default), or
+    in a run output container (see cfg.PARAMS['run_output_container']).
+
+    Parameters
+    ----------
+    gdir : :py:class:`oggm.GlacierDirectory`
+        the glacier directory
+    filename : str
+        'model_run' or 'model_diagnostics'
+    filesuffix : str
+        the filesuffix of the run
+
+    Returns
+    -------
+    (path, group) : the file to open, and the netCDF group in this file
+    where the output is stored (None for the root group)
+    """
+
+    path = gdir.get_filepath(filename, filesuffix=filesuffix)
+    if not os.path.exists(path):
+        key = gdir.rgi_id + (filesuffix or '')
+        latest = _get_run_output_index(key).get(key)
+        if latest is not None:
+            return latest[0], key + '/' + filename
+    return path, None
+
+
 class compile_to_netcdf(object):
     """Decorator for common compiling NetCDF files logic.
 
     All compile_* tasks can be optimized the same way, by using temporary
-    files and merging them afterwards.
+    files and merging them afterwards. Tasks which can write their output
+    file chunk by chunk themselves (``incremental=True``) are instead given
+    the chunk size as ``tmp_file_size`` keyword argument.
     """
 
-    def __init__(self, log):
+    def __init__(self, log, incremental=False):
         """Decorator syntax: ``@compile_to_netcdf(log, n_tmp_files=1000)``
 
         Parameters
         ----------
         log: logger
             module logger
-        tmp_file_size: int
-            number of glacier directories per temporary files
+        incremental: bool
+            whether the task handles the large number of glaciers itself
         """
         self.log = log
+        self.incremental = incremental
 
     def __call__(self, task_func):
         """Decorate."""
@@ -611,7 +1393,7 @@ class compile_to_netcdf(object):
         @wraps(task_func)
         def _compile_to_netcdf(gdirs, filesuffix='', input_filesuffix='',
                                output_filesuffix='', path=True,
-                               tmp_file_size=1000,
+                               tmp_file_size=1000, output_format=None,
                                **kwargs):
 
             # Check input
@@ -625,6 +1407,8 @@ class compile_to_netcdf(object):
             if not output_filesuffix:
                 output_filesuffix = input_filesuffix
 
+            output_format = get_output_format(output_format)
+
             gdirs = tolist(gdirs)
 
             hemisphere = [gd.hemisphere for gd in gdirs]
@@ -641,6 +1425,7 @@ class compile_to_netcdf(object):
                                    output_filesuffix=output_filesuffix + '_sh',
                                    path=True,
                                    tmp_file_size=tmp_file_size,
+                                   output_format=output_format,
                                    **kwargs)
                 _gdirs = [gd for gd in gdirs if gd.hemisphere == 'nh']
                 _compile_to_netcdf(_gdirs,
@@ -648,6 +1433,7 @@ class compile_to_netcdf(object):
                                    output_filesuffix=output_filesuffix + '_nh',
                                    path=True,
                                    tmp_file_size=tmp_file_size,
+                                   output_format=output_format,
                                    **kwargs)
                 return
 
@@ -655,13 +1441,32 @@ class compile_to_netcdf(object):
             output_base = task_name.replace('compile_', '')
 
             if path is True:
+                ext = '.zarr' if output_format == 'zarr' else '.nc'
                 path = os.path.join(cfg.PATHS['working_dir'],
-                                    output_base + output_filesuffix + '.nc')
+                                    output_base + output_filesuffix + ext)
 
             self.log.info('Applying %s on %d gdirs.',
                           task_name, len(gdirs))
 
             # Run the task
+            if self.incremental:
+                return task_func(gdirs, input_filesuffix=input_filesuffix,
+                                 path=path, tmp_file_size=tmp_file_size,
+                                 output_format=output_format, **kwargs)
+
+            if output_format == 'zarr' and path:
+                # Zarr stores can grow along rgi_id: no temporary files
+                ds = None
+                for i in range(0, len(gdirs), tmp_file_size):
+                    ds = task_func(gdirs[i: i + tmp_file_size],
+                                   input_filesuffix=input_filesuffix,
+                                   path=False, **kwargs)
+                    if i == 0:
+                        ds.to_zarr(path, mode='w')
+                    else:
+                        ds.to_zarr(path, append_dim='rgi_id')
+                return ds if len(gdirs) <= tmp_file_size else None
+
             # If small gdir size, no need for temporary files
             if len(gdirs) < tmp_file_size or not path:
                 return task_func(gdirs, input_filesuffix=input_filesuffix,
@@ -704,11 +1509,86 @@ class compile_to_netcdf(object):
         return _compile_to_netcdf
 
 
-@compile_to_netcdf(log)
+# Variables of the model diagnostics files which are compiled:
+# (name in the diagnostics file, name in the compiled file, description,
+# units, always available)
+_RUN_OUTPUT_VARS = [
+    ('volume_m3', 'volume', 'Total glacier volume', 'm 3', True),
+    ('area_m2', 'area', 'Total glacier area', 'm 2', True),
+    ('length_m', 'length', 'Glacier length', 'm', True),
+    ('ela_m', 'ela', 'Glacier Equilibrium Line Altitude (ELA)', 'm a.s.l',
+     True),
+    ('calving_m3', 'calving', 'Total calving volume since simulation start',
+     'm3', False),
+    ('calving_rate_myr', 'calving_rate', 'Instantaneous calving rate',
+     'm yr-1', False),
+    ('volume_bsl_m3', 'volume_bsl', 'Total glacier volume below sea level',
+     'm3', False),
+    ('volume_bwl_m3', 'volume_bwl', 'Total glacier volume below water level',
+     'm3', False),
+]
+
+
+def _read_run_diagnostics(gdir, input_filesuffix=''):
+    """Reads the model diagnostics of a glacier as a dict of arrays.
+
+    Returns None if the file can't be read (e.g. if the run failed). This
+    is safe to call from several threads.
+    """
+    try:
+        ppath, group = get_run_output_location(gdir, 'model_diagnostics',
+                                               filesuffix=input_filesuffix)
+        if ppath.endswith('.zarr'):
+            grp = zarr.open_group(ppath, mode='r')
+            return {vn: grp[dn][:] for dn, vn, _, _, _
+                    in _RUN_OUTPUT_VARS if dn in grp}
+        with _netcdf_read_lock, ncDataset(ppath) as nc:
+            grp = nc if group is None else nc[group]
+            return {vn: grp.variables[dn][:] for dn, vn, _, _, _
+                    in _RUN_OUTPUT_VARS if dn in grp.variables}
+    except BaseException:
+        return None
+
+
+def _iter_run_diagnostics(gdirs, n_times, input_filesuffix='',
+                          chunk_size=1000):
+    """Reads the model diagnostics of the gdirs by chunks, in parallel.
+
+    Yields the index of the first glacier of the chunk and a dict of
+    (n_times, n_glaciers_in_chunk) arrays. The variables which are not
+    always available are only in the dict if at least one glacier has them.
+    The files are read in a pool of threads: this is I/O bound, and it
+    spares sending the gdirs to the worker processes and the arrays back.
+    """
+    from oggm.workflow import execute_entity_task
+    for i0 in range(0, len(gdirs), chunk_size):
+        out = execute_entity_task(_read_run_diagnostics,
+                                  gdirs[i0:i0 + chunk_size],
+                                  executor='thread',
+                                  input_filesuffix=input_filesuffix)
+        data = dict()
+        for _, vn, _, _, always in _RUN_OUTPUT_VARS:
+            if always or any(d is not None and vn in d for d in out):
+                data[vn] = np.zeros((n_times, len(out))) * np.NaN
+        for i, diag in enumerate(out):
+            for vn, val in (diag or {}).items():
+                data[vn][:, i] = val
+        yield i0, data
+
+
+@compile_to_netcdf(log, incremental=True)
 def compile_run_output(gdirs, path=True, input_filesuffix='',
-                       use_compression=True):
+                       use_compression=True, tmp_file_size=1000,
+                       output_format=None):
     """Merge the output of the model runs of several gdirs into one file.
 
+    The diagnostics files are read in parallel (if multiprocessing is
+    activated), by chunks of ``tmp_file_size`` glaciers. When there are
+    more glaciers than that, the chunks are written to the output file as
+    they come, instead of being compiled in memory first. With the Zarr
+    format, the variables are chunked by ``tmp_file_size`` glaciers, so
+    that they can be read lazily glacier chunk by glacier chunk.
+
     Parameters
     ----------
     gdirs : list of :py:class:`oggm.GlacierDirectory` objects
@@ -720,11 +1600,15 @@ def compile_run_output(gdirs, path=True, input_filesuffix='',
         the filesuffix of the files to be compiled
     use_compression : bool
         use zlib compression on the output netCDF files
+    tmp_file_size : int
+        number of glaciers read (and written) at once
+    output_format : str
+        'netcdf' or 'zarr' (see :py:func:`get_output_format`)
 
     Returns
     -------
     ds : :py:class:`xarray.Dataset`
-        compiled output
+        compiled output (None if it was written by chunks)
     """
 
     # Get the dimensions of all this
@@ -736,16 +1620,16 @@ def compile_run_output(gdirs, path=True, input_filesuffix='',
         if i >= len(gdirs):
             raise RuntimeError('Found no valid glaciers!')
         try:
-            ppath = gdirs[i].get_filepath('model_diagnostics',
-                                          filesuffix=input_filesuffix)
-            with xr.open_dataset(ppath) as ds_diag:
+            ppath, group = get_run_output_location(
+                gdirs[i], 'model_diagnostics', filesuffix=input_filesuffix)
+            with xr.open_dataset(ppath, group=group) as ds_diag:
                 ds_diag.time.values
             break
         except BaseException:
             i += 1
 
     # OK found it, open it and prepare the output
-    with xr.open_dataset(ppath) as ds_diag:
+    with xr.open_dataset(ppath, group=group) as ds_diag:
         time = ds_diag.time.values
         yrs = ds_diag.hydro_year.values
         months = ds_diag.hydro_month.values
@@ -776,80 +1660,78 @@ def compile_run_output(gdirs, path=True, input_filesuffix='',
         ds['calendar_month'].attrs['description'] = 'Calendar month'
 
     shape = (len(time), len(rgi_ids))
-    # These variables are always available
-    vol = np.zeros(shape)
-    area = np.zeros(shape)
-    length = np.zeros(shape)
-    ela = np.zeros(shape)
-    # These are not
-    calving_m3 = None
-    calving_rate_myr = None
-    volume_bsl_m3 = None
-    volume_bwl_m3 = None
-    for i, gdir in enumerate(gdirs):
+    chunks = _iter_run_diagnostics(gdirs, len(time),
+                                   input_filesuffix=input_filesuffix,
+                                   chunk_size=tmp_file_size)
+
+    output_format = get_output_format(output_format)
+    if path and len(gdirs) >= tmp_file_size:
+        # Write the coordinates, then fill the variables chunk by chunk
+        if output_format == 'zarr':
+            ds.to_zarr(path, mode='w')
+            store = zarr.open_group(path, mode='a')
+        else:
+            ds.to_netcdf(path)
+            store = netCDF4.Dataset(path, 'a')
+        created = []
         try:
-            ppath = gdir.get_filepath('model_diagnostics',
-                                      filesuffix=input_filesuffix)
-            with xr.open_dataset(ppath) as ds_diag:
-                vol[:, i] = ds_diag.volume_m3.values
-                area[:, i] = ds_diag.area_m2.values
-                length[:, i] = ds_diag.length_m.values
-                ela[:, i] = ds_diag.ela_m.values
-                if 'calving_m3' in ds_diag:
-                    if calving_m3 is None:
-                        calving_m3 = np.zeros(shape) * np.NaN
-                    calving_m3[:, i] = ds_diag.calving_m3.values
-                if 'calving_rate_myr' in ds_diag:
-                    if calving_rate_myr is None:
-                        calving_rate_myr = np.zeros(shape) * np.NaN
-                    calving_rate_myr[:, i] = ds_diag.calving_rate_myr.values
-                if 'volume_bsl_m3' in ds_diag:
-                    if volume_bsl_m3 is None:
-                        volume_bsl_m3 = np.zeros(shape) * np.NaN
-                    volume_bsl_m3[:, i] = ds_diag.volume_bsl_m3.values
-                if 'volume_bwl_m3' in ds_diag:
-                    if volume_bwl_m3 is None:
-                        volume_bwl_m3 = np.zeros(shape) * np.NaN
-                    volume_bwl_m3[:, i] = ds_diag.volume_bwl_m3.values
-        except BaseException:
-            vol[:, i] = np.NaN
-            area[:, i] = np.NaN
-            length[:, i] = np.NaN
-            ela[:, i] = np.NaN
-
-    ds['volume'] = (('time', 'rgi_id'), vol)
-    ds['volume'].attrs['description'] = 'Total glacier volume'
-    ds['volume'].attrs['units'] = 'm 3'
-    ds['area'] = (('time', 'rgi_id'), area)
-    ds['area'].attrs['description'] = 'Total glacier area'
-    ds['area'].attrs['units'] = 'm 2'
-    ds['length'] = (('time', 'rgi_id'), length)
-    ds['length'].attrs['description'] = 'Glacier length'
-    ds['length'].attrs['units'] = 'm'
-    ds['ela'] = (('time', 'rgi_id'), ela)
-    ds['ela'].attrs['description'] = 'Glacier Equilibrium Line Altitude (ELA)'
-    ds['ela'].attrs['units'] = 'm a.s.l'
-    if calving_m3 is not None:
-        ds['calving'] = (('time', 'rgi_id'), calving_m3)
-        ds['calving'].attrs['description'] = ('Total calving volume since '
-                                              'simulation start')
-        ds['calving'].attrs['units'] = 'm3'
-    if calving_rate_myr is not None:
-        ds['calving_rate'] = (('time', 'rgi_id'), calving_rate_myr)
-        ds['calving_rate'].attrs['description'] = 'Instantaneous calving rate'
-        ds['calving_rate'].attrs['units'] = 'm yr-1'
-    if volume_bsl_m3 is not None:
-        ds['volume_bsl'] = (('time', 'rgi_id'), volume_bsl_m3)
-        ds['volume_bsl'].attrs['description'] = ('Total glacier volume below '
-                                                 'sea level')
-        ds['volume_bsl'].attrs['units'] = 'm3'
-    if volume_bwl_m3 is not None:
-        ds['volume_bwl'] = (('time', 'rgi_id'), volume_bwl_m3)
-        ds['volume_bwl'].attrs['description'] = ('Total glacier volume below '
-                                                 'water level')
-        ds['volume_bwl'].attrs['units'] = 'm3'
+            for i0, data in chunks:
+                i1 = i0 + data['volume'].shape[1]
+                for _, vn, desc, units, always in _RUN_OUTPUT_VARS:
+                    if vn not in data:
+                        continue
+                    if vn not in created:
+                        dtype = 'float32' if always else 'float64'
+                        chunksizes = (len(time), tmp_file_size)
+                        if output_format == 'zarr':
+                            kw = dict()
+                            if not (always and use_compression):
+                                kw['compressor'] = None
+                            v = store.full(vn, np.NaN, shape=shape,
+                                           chunks=chunksizes, dtype=dtype,
+                                           **kw)
+                            v.attrs['_ARRAY_DIMENSIONS'] = ['time',
+                                                            'rgi_id']
+                            v.attrs['description'] = desc
+                            v.attrs['units'] = units
+                        else:
+                            v = store.createVariable(
+                                vn, dtype, ('time', 'rgi_id'),
+                                fill_value=np.NaN, chunksizes=chunksizes,
+                                zlib=always and use_compression,
+                                complevel=5)
+                            v.description = desc
+                            v.units = units
+                        created.append(vn)
+                    store[vn][:, i0:i1] = data[vn]
+        finally:
+            if output_format == 'zarr':
+                zarr.consolidate_metadata(path)
+            else:
+                store.close()
+        return None
 
-    if path:
+    data = dict()
+    for i0, _data in chunks:
+        i1 = i0 + _data['volume'].shape[1]
+        for vn, val in _data.items():
+            if vn not in data:
+                data[vn] = np.zeros(shape) * np.NaN
+            data[vn][:, i0:i1] = val
+
+    for _, vn, desc, units, _ in _RUN_OUTPUT_VARS:
+        if vn in data:
+            ds[vn] = (('time', 'rgi_id'), data[vn])
+            ds[vn].attrs['description'] = desc
+            ds[vn].attrs['units'] = units
+
+    if path and output_format == 'zarr':
+        enc_var = {'dtype': 'float32'}
+        if not use_compression:
+            enc_var['compressor'] = None
+        encoding = {v: enc_var for v in ['volume', 'area', 'length', 'ela']}
+        ds.to_zarr(path, mode='w', encoding=encoding)
+    elif path:
         enc_var = {'dtype': 'float32'}
         if use_compression:
             enc_var['complevel'] = 5
@@ -1021,8 +1903,10 @@ def compile_task_log(gdirs, task_names=[], filesuffix='', path=True,
     for gdir in gdirs:
         d = OrderedDict()
         d['rgi_id'] = gdir.rgi_id
+        # Read the log file only once per glacier
+        idx = gdir._get_task_log_index()
         for task_name in task_names:
-            ts = gdir.get_task_status(task_name)
+            ts = None if idx is None else idx['status'].get(task_name)
             if ts is None:
                 ts = ''
             d[task_name] = ts.replace(',', ' ')
@@ -1070,8 +1954,10 @@ def compile_task_time(gdirs, task_names=[], filesuffix='', path=True,
     for gdir in gdirs:
         d = OrderedDict()
         d['rgi_id'] = gdir.rgi_id
+        # Read the log file only once per glacier
+        idx = gdir._get_task_log_index()
         for task_name in task_names:
-            d[task_name] = gdir.get_task_time(task_name)
+            d[task_name] = None if idx is None else idx['time'].get(task_name)
         out_df.append(d)
 
     out = pd.DataFrame(out_df).set_index('rgi_id')
@@ -1833,8 +2719,12 @@ class GlacierDirectory(object):
         # Also transform the intersects if necessary
         gdf = cfg.PARAMS['intersects_gdf']
         if len(gdf) > 0:
-            gdf = gdf.loc[((gdf.RGIId_1 == self.rgi_id) |
-                           (gdf.RGIId_2 == self.rgi_id))]
+            if isinstance(gdf, SharedDataFrame):
+                gdf = gdf.to_dataframe((gdf['RGIId_1'] == self.rgi_id) |
+                                       (gdf['RGIId_2'] == self.rgi_id))
+            else:
+                gdf = gdf.loc[((gdf.RGIId_1 == self.rgi_id) |
+                               (gdf.RGIId_2 == self.rgi_id))]
             if len(gdf) > 0:
                 gdf = salem.transform_geopandas(gdf, to_crs=proj_out)
                 if hasattr(gdf.crs, 'srs'):
@@ -1944,6 +2834,16 @@ class GlacierDirectory(object):
                 return self.get_filepath('climate_monthly', delete=delete,
                                          filesuffix=filesuffix)
 
+        if (filename in ['model_run', 'model_diagnostics'] and
+                not os.path.exists(out)):
+            # The run output might have been written in the zarr format
+            zout = os.path.splitext(out)[0] + '.zarr'
+            if os.path.exists(zout):
+                if delete:
+                    shutil.rmtree(zout)
+                else:
+                    return zout
+
         if delete and os.path.isfile(out):
             os.remove(out)
         return out
@@ -2035,6 +2935,13 @@ class GlacierDirectory(object):
         Returns
         -------
         An object read from the pickle
+
+        Notes
+        -----
+        If cfg.PARAMS['gdir_pickle_cache_size'] is > 0, the (uncompressed)
+        files are kept in memory after reading or writing them, and read
+        from there as long as the file on disk didn't change. The cache
+        size is shared by all glacier directories of the process.
         """
 
         # Some deprecations
@@ -2045,8 +2952,20 @@ class GlacierDirectory(object):
                     else cfg.PARAMS['use_compression'])
         _open = gzip.open if use_comp else open
         fp = self.get_filepath(filename, filesuffix=filesuffix)
+
+        use_cache = cfg.PARAMS['gdir_pickle_cache_size'] > 0
+        if use_cache:
+            data = _get_cached_pickle(fp)
+            if data is not None:
+                return pickle.loads(data)
+
         with _open(fp, 'rb') as f:
-            out = pickle.load(f)
+            if use_cache:
+                data = f.read()
+                out = pickle.loads(data)
+                _cache_pickle(fp, data)
+            else:
+                out = pickle.load(f)
 
         return out
 
@@ -2069,8 +2988,17 @@ class GlacierDirectory(object):
                     else cfg.PARAMS['use_compression'])
         _open = gzip.open if use_comp else open
         fp = self.get_filepath(filename, filesuffix=filesuffix)
-        with _open(fp, 'wb') as f:
-            pickle.dump(var, f, protocol=-1)
+
+        if cfg.PARAMS['gdir_pickle_cache_size'] > 0:
+            # Write-through
+            data = pickle.dumps(var, protocol=-1)
+            with _open(fp, 'wb') as f:
+                f.write(data)
+            _cache_pickle(fp, data)
+        else:
+            _uncache_pickle(fp)
+            with _open(fp, 'wb') as f:
+                pickle.dump(var, f, protocol=-1)
 
     def read_json(self, filename, filesuffix=''):
         """Reads a JSON file located in the directory.
@@ -2552,6 +3480,58 @@ class GlacierDirectory(object):
         if count == 5:
             log.warning('Could not write to logfile: ' + line)
 
+    def _get_task_log_index(self):
+        """The last status and time of each task found in the log file.
+
+        The log file is parsed only once: afterwards, only the lines which
+        have been appended since the last call are read.
+
+        Returns
+        -------
+        a dict with the keys 'status' and 'time' (dicts of task name to
+        last status and time) and 'error' (the first error message), None
+        if there is no log file
+        """
+
+        try:
+            st = os.stat(self.logfile)
+        except OSError:
+            return None
+
+        idx = self.__dict__.get('_task_log_index')
+        fid = (st.st_dev, st.st_ino)
+        if idx is None or idx['fid'] != fid or st.st_size < idx['offset']:
+            # New or replaced log file: parse from the start
+            idx = dict(fid=fid, offset=0, status=dict(), time=dict(),
+                       error=None)
+            self._task_log_index = idx
+
+        if st.st_size == idx['offset']:
+            return idx
+
+        with open(self.logfile, 'rb') as logfile:
+            logfile.seek(idx['offset'])
+            data = logfile.read()
+
+        # Incomplete lines are read the next time
+        data = data[:data.rfind(b'\n') + 1]
+        idx['offset'] += len(data)
+        for line in data.decode().splitlines():
+            if idx['error'] is None and 'SUCCESS' not in line:
+                idx['error'] = line
+            if ';' not in line:
+                continue
+            sline = line.split(';')
+            task_name = sline[1]
+            idx['status'][task_name] = sline[-1]
+            if 'ERROR' in sline[-1] or 'time:' not in line:
+                idx['time'][task_name] = None
+            else:
+                tt = line.split('time:')[-1].split(';')[0]
+                idx['time'][task_name] = float(tt)
+
+        return idx
+
     def get_task_status(self, task_name):
         """Opens this directory's log file to check for a task's outcome.
 
@@ -2566,19 +3546,10 @@ class GlacierDirectory(object):
         None if the task was not run yet
         """
 
-        if not os.path.isfile(self.logfile):
-            return None
-
-        with open(self.logfile) as logfile:
-            lines = logfile.readlines()
-
-        lines = [l.replace('\n', '') for l in lines
-                 if ';' in l and (task_name == l.split(';')[1])]
-        if lines:
-            # keep only the last log
-            return lines[-1].split(';')[-1]
-        else:
+        idx = self._get_task_log_index()
+        if idx is None:
             return None
+        return idx['status'].get(task_name)
 
     def get_task_time(self, task_name):
         """Opens this directory's log file to check for a task's run time.
@@ -2594,23 +3565,10 @@ class GlacierDirectory(object):
         None if the task was not run yet, or if it errored
         """
 
-        if not os.path.isfile(self.logfile):
-            return None
-
-        with open(self.logfile) as logfile:
-            lines = logfile.readlines()
-
-        lines = [l.replace('\n', '') for l in lines
-                 if task_name == l.split(';')[1]]
-        if lines:
-            line = lines[-1]
-            # Last log is message
-            if 'ERROR' in line.split(';')[-1] or 'time:' not in line:
-                return None
-            # Get the time
-            return float(line.split('time:')[-1].split(';')[0])
-        else:
+        idx = self._get_task_log_index()
+        if idx is None:
             return None
+        return idx['time'].get(task_name)
 
     def get_error_log(self):
         """Reads the directory's log file to find the invalid task (if any).
@@ -2620,22 +3578,13 @@ class GlacierDirectory(object):
         The first error message in this log, None if all good
         """
 
-        if not os.path.isfile(self.logfile):
+        idx = self._get_task_log_index()
+        if idx is None:
             return None
+        return idx['error']
 
-        with open(self.logfile) as logfile:
-            lines = logfile.readlines()
 
-        for l in lines:
-            if 'SUCCESS' in l:
-                continue
-            return l.replace('\n', '')
-
-        # OK all good
-        return None
-
-
-@entity_task(log)
+@entity_task(log, io_bound=True)
 def copy_to_basedir(gdir, base_dir=None, setup='run'):
     """Copies the glacier directories and their content to a new location.
 
@@ -2821,7 +3770,7 @@ def initialize_merged_gdir(main, tribs=[], glcdf=None,
     return merged
 
 
-@entity_task(log)
+@entity_task(log, io_bound=True)
 def gdir_to_tar(gdir, base_dir=None, delete=True):
     """Writes the content of a glacier directory to a tar file.
 
@@ -1,11 +1,17 @@
 """Wrappers for the single tasks, multi processor handling."""
 # Built ins
+import atexit
 import logging
 import os
+import tempfile
+import time
+import warnings
 from shutil import rmtree
+from collections import OrderedDict
 from collections.abc import Sequence
 # External libs
 import multiprocessing
+from multiprocessing.pool import ThreadPool
 import numpy as np
 import pandas as pd
 from scipy import optimize as optimization
@@ -28,6 +34,18 @@ log = logging.getLogger(__name__)
 
 # Multiprocessing Pool
 _mp_pool = None
+# Where the pool's shared inputs are written
+_mp_shared_dir = None
+
+
+def _remove_mp_shared_dir():
+    global _mp_shared_dir
+    if _mp_shared_dir is not None:
+        rmtree(_mp_shared_dir, ignore_errors=True)
+        _mp_shared_dir = None
+
+
+atexit.register(_remove_mp_shared_dir)
 
 
 def _init_pool_globals(_cfg_contents, global_lock):
@@ -37,7 +55,7 @@ def _init_pool_globals(_cfg_contents, global_lock):
 
 def init_mp_pool(reset=False):
     """Necessary because at import time, cfg might be uninitialized"""
-    global _mp_pool
+    global _mp_pool, _mp_shared_dir
     if _mp_pool and not reset:
         return _mp_pool
 
@@ -45,13 +63,18 @@ def init_mp_pool(reset=False):
     if _mp_pool and reset:
         _mp_pool.terminate()
         _mp_pool = None
+    _remove_mp_shared_dir()
 
     if cfg.PARAMS['use_mp_spawn']:
         mp = multiprocessing.get_context('spawn')
     else:
         mp = multiprocessing
 
-    cfg_contents = cfg.pack_config()
+    # The large read-only inputs are shared between processes
+    if cfg.PARAMS['mp_shared_inputs']:
+        _mp_shared_dir = tempfile.mkdtemp(prefix='shared_',
+                                          dir=utils.gettempdir())
+    cfg_contents = cfg.pack_config(shared_dir=_mp_shared_dir)
     global_lock = mp.Manager().Lock()
 
     mpp = cfg.PARAMS['mp_processes']
@@ -90,6 +113,92 @@ class _pickle_copier(object):
             return call_func(gdir, **self.out_kwargs)
 
 
+class _chunk_runner(object):
+    """Pickleable callable running a chunk of (index, gdir) in a worker."""
+
+    def __init__(self, pc):
+        self.pc = pc
+
+    def __call__(self, chunk):
+        return [(i, self.pc(gdir)) for i, gdir in chunk]
+
+
+def _estimate_task_cost(task_name, gdir):
+    """Expected cost of a task on a glacier directory (arbitrary units).
+
+    This is the time the task needed the last time it ran (if available),
+    otherwise the glacier area.
+    """
+    if isinstance(gdir, Sequence) and not isinstance(gdir, str):
+        gdir = gdir[0]
+    try:
+        cost = gdir.get_task_time(task_name)
+        if cost is None:
+            cost = gdir.rgi_area_km2
+    except Exception:
+        cost = None
+    if cost is None or not np.isfinite(cost):
+        cost = 1.
+    return max(cost, 1e-3)
+
+
+def _get_balanced_chunks(task_name, gdirs, n_workers, n_chunks_per_worker=4):
+    """Sorts the glaciers by expected cost and bins them into chunks.
+
+    The most expensive glaciers come first (and alone), the cheaper ones
+    are grouped in chunks of decreasing cost ("guided" scheduling).
+
+    Returns
+    -------
+    a list of chunks, each being a list of (index, gdir) tuples
+    """
+    costs = np.array([_estimate_task_cost(task_name, gdir)
+                      for gdir in gdirs])
+    remaining = np.sum(costs)
+    # The chunks shouldn't become too small at the end of the list either
+    min_cost = remaining / (4 * n_chunks_per_worker * n_workers)
+    chunks = []
+    chunk = []
+    chunk_cost = 0.
+    target = 0.
+    for i in np.argsort(-costs, kind='stable'):
+        if not chunk:
+            target = max(remaining / (n_chunks_per_worker * n_workers),
+                         min_cost)
+        chunk.append((i, gdirs[i]))
+        chunk_cost += costs[i]
+        if chunk_cost >= target:
+            chunks.append(chunk)
+            remaining -= chunk_cost
+            chunk = []
+            chunk_cost = 0.
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def _balanced_map(mppool, pc, task_name, gdirs, n_workers=None):
+    """Runs pc on the gdirs in chunks, in any order, and sorts the results.
+    """
+
+    if n_workers is None:
+        n_workers = cfg.PARAMS['mp_processes']
+    chunks = _get_balanced_chunks(task_name, gdirs, n_workers)
+
+    out = [None] * len(gdirs)
+    n_done = 0
+    n_report = len(gdirs) / 10
+    for res in mppool.imap_unordered(_chunk_runner(pc), chunks):
+        for i, r in res:
+            out[i] = r
+        n_done += len(res)
+        if n_done >= n_report:
+            log.workflow('%s: %d of %d glaciers done', task_name, n_done,
+                         len(gdirs))
+            n_report += len(gdirs) / 10
+    return out
+
+
 def reset_multiprocessing():
     """Reset multiprocessing state
 
@@ -100,10 +209,11 @@ def reset_multiprocessing():
     if _mp_pool:
         _mp_pool.terminate()
         _mp_pool = None
+    _remove_mp_shared_dir()
     cfg.CONFIG_MODIFIED = False
 
 
-def execute_entity_task(task, gdirs, **kwargs):
+def execute_entity_task(task, gdirs, executor=None, **kwargs):
     """Execute a task on gdirs.
 
     If you asked for multiprocessing, it will do it.
@@ -117,6 +227,24 @@ def execute_entity_task(task, gdirs, **kwargs):
          the entity task to apply
     gdirs : list of :py:class:`oggm.GlacierDirectory` objects
         the glacier directories to process
+    executor : str
+        how to run the task with multiprocessing: 'process' (in the pool
+        of processes or on the MPI workers), 'thread' (in a pool of
+        cfg.PARAMS['mp_threads'] threads of the main process, for the
+        tasks dominated by file I/O or compression) or 'serial'. The
+        default is 'thread' for the tasks declared with
+        ``entity_task(..., io_bound=True)`` and 'process' for all others.
+        Without multiprocessing, the tasks are run serially, and with MPI
+        they are always sent to the MPI workers (unless 'serial').
+
+    Notes
+    -----
+    With multiprocessing, cfg.PARAMS['mp_scheduling'] decides how the
+    glaciers are distributed to the workers: 'ordered' sends them one by one
+    in the list order, 'balanced' sends the most expensive ones first (based
+    on the duration of the previous run of the task, or on the glacier area)
+    and groups the cheap ones in chunks. The output is in the order of the
+    ``gdirs`` list in both cases.
     """
 
     # Should be iterable
@@ -131,18 +259,314 @@ def execute_entity_task(task, gdirs, **kwargs):
     if task.__dict__.get('global_task', False):
         return task(gdirs, **kwargs)
 
+    if executor is None:
+        executor = 'thread' if task.__dict__.get('io_bound') else 'process'
+
     pc = _pickle_copier(task, kwargs)
+    return _map_over_gdirs(pc, gdirs, _get_task_name(task, kwargs),
+                           executor=executor)
+
+
+def _get_task_name(task, kwargs):
+    """The name under which the task is logged in the glacier directory."""
+    task_name = task.__name__
+    fsuffix = (kwargs.get('filesuffix', False) or
+               kwargs.get('output_filesuffix', False))
+    if fsuffix:
+        task_name += fsuffix
+    return task_name
+
+
+def _get_n_threads():
+    """Number of threads for the I/O bound tasks."""
+    n_threads = cfg.PARAMS['mp_threads']
+    if n_threads <= 0:
+        n_threads = 2 * cfg.PARAMS['mp_processes']
+    return n_threads
+
+
+def _map_over_gdirs(pc, gdirs, task_name, executor='process'):
+    """Apply pc to all gdirs, with MPI or multiprocessing if asked for."""
+
+    scheduling = cfg.PARAMS['mp_scheduling']
+    if scheduling not in ['ordered', 'balanced']:
+        raise InvalidParamsError("PARAMS['mp_scheduling'] should be one "
+                                 "of `ordered` or `balanced`, got: "
+                                 "{}".format(scheduling))
+    if executor not in ['process', 'thread', 'serial']:
+        raise InvalidParamsError("executor should be one of `process`, "
+                                 "`thread` or `serial`, got: "
+                                 "{}".format(executor))
+
+    if executor == 'serial':
+        return [pc(gdir) for gdir in gdirs]
 
     if _have_ogmpi:
         if ogmpi.OGGM_MPI_COMM is not None:
-            return ogmpi.mpi_master_spin_tasks(pc, gdirs)
+            chunks = None
+            if scheduling == 'balanced':
+                chunks = _get_balanced_chunks(task_name, gdirs,
+                                              ogmpi.OGGM_MPI_SIZE)
+            return ogmpi.mpi_master_spin_tasks(pc, gdirs, chunks=chunks)
 
+    if not cfg.PARAMS['use_multiprocessing']:
+        return [pc(gdir) for gdir in gdirs]
+
+    if executor == 'thread':
+        # The threads share the config and the lock of the main process
+        n_threads = _get_n_threads()
+        with ThreadPool(n_threads) as pool:
+            if scheduling == 'balanced':
+                return _balanced_map(pool, pc, task_name, gdirs,
+                                     n_workers=n_threads)
+            return pool.map(pc, gdirs, chunksize=1)
+
+    mppool = init_mp_pool(cfg.CONFIG_MODIFIED)
+    if scheduling == 'balanced':
+        return _balanced_map(mppool, pc, task_name, gdirs)
+    return mppool.map(pc, gdirs, chunksize=1)
+
+
+class _pipeline_runner(object):
+    """Pickleable callable running a chain of entity tasks on a gdir."""
+
+    def __init__(self, tasks):
+        self.tasks = tasks
+
+    def __call__(self, gdir):
+        out = None
+        for task, kwargs in self.tasks:
+            out = task(gdir, **kwargs)
+        return out
+
+
+def execute_pipeline(gdirs, tasks):
+    """Execute a chain of tasks on gdirs, one glacier at a time.
+
+    Unlike calling :py:func:`execute_entity_task` for each task, the entity
+    tasks are all applied to a glacier within the same worker (process or
+    MPI node) before going to the next glacier: there is no need to wait
+    for all glaciers to be done with a task before starting the next one.
+    Global tasks (e.g. ``compute_ref_t_stars``) are still applied to all
+    glaciers at once, i.e. they wait for all previous tasks to be done.
+
+    The tasks are logged in the glacier directories as usual. Set
+    cfg.PARAMS['gdir_pickle_cache_size'] to keep the pickle files in memory
+    from one task to the next.
+
+    Parameters
+    ----------
+    gdirs : list of :py:class:`oggm.GlacierDirectory` objects
+        the glacier directories to process
+    tasks : list
+         the list of tasks to apply, in order. Optionally, each list element
+         can be a tuple, with the first element being the task, and the
+         second element a dict that will be passed to the task function as
+         ``**kwargs``.
+
+    Returns
+    -------
+    the output of the last task of the pipeline
+    """
+
+    # Should be iterable
+    gdirs = utils.tolist(gdirs)
+
+    if len(gdirs) == 0:
+        return
+
+    # Split the pipeline at the global tasks
+    stages = []
+    for task in tasks:
+        kwargs = {}
+        if isinstance(task, Sequence):
+            task, kwargs = task
+        if task.__dict__.get('global_task', False):
+            stages.append((task, kwargs))
+        elif stages and isinstance(stages[-1], list):
+            stages[-1].append((task, kwargs))
+        else:
+            stages.append([(task, kwargs)])
+
+    out = None
+    for stage in stages:
+        if not isinstance(stage, list):
+            task, kwargs = stage
+            log.workflow('Execute global task %s on %d glaciers',
+                         task.__name__, len(gdirs))
+            out = task(gdirs, **kwargs)
+            continue
+
+        log.workflow('Execute pipeline %s on %d glaciers',
+                     ', '.join(task.__name__ for task, _ in stage),
+                     len(gdirs))
+        pc = _pipeline_runner(stage)
+        io_bound = all(task.__dict__.get('io_bound') for task, _ in stage)
+        out = _map_over_gdirs(pc, gdirs, _get_task_name(*stage[0]),
+                              executor='thread' if io_bound else 'process')
+
+    return out
+
+
+class _batched_model_runner(object):
+    """Pickleable callable running a chunk of glaciers in one batch."""
+
+    def __init__(self, task, kwargs):
+        self.task = task
+        self.kwargs = kwargs
+
+    def _log_error(self, gdir, task_name, err):
+        """Same as the entity task decorator when a task fails."""
+        gdir.log(task_name, err=err)
+        utils.pipe_log(gdir, task_name, err=err)
+        log.error('%s occurred during task %s on %s: %s',
+                  type(err).__name__, task_name, gdir.rgi_id, str(err))
+        if not cfg.PARAMS['continue_on_error']:
+            raise err
+
+    def __call__(self, gdirs):
+
+        kwargs = self.kwargs.copy()
+        reset = kwargs.pop('reset', None)
+        if reset is None:
+            reset = not cfg.PARAMS['auto_skip_task']
+        print_log = kwargs.pop('print_log', True)
+
+        task_name = self.task.__name__
+        fsuffix = (kwargs.get('filesuffix', False) or
+                   kwargs.get('output_filesuffix', False))
+        if fsuffix:
+            task_name += fsuffix
+
+        # Prepare the models. We call the undecorated task, so that the
+        # task status is logged only once the model has run
+        batch = []
+        task_time = dict()
+        for gdir in gdirs:
+            s = gdir.get_task_status(task_name)
+            if not reset and s and ('SUCCESS' in s):
+                continue
+            if print_log:
+                log.info('(%s) %s', gdir.rgi_id, task_name)
+            ex_t = time.time()
+            try:
+                self.task.__wrapped__(gdir, batch=batch, **kwargs)
+            except Exception as err:
+                self._log_error(gdir, task_name, err)
+                continue
+            task_time[gdir.rgi_id] = time.time() - ex_t
+
+        # Glaciers with different time bounds are run in separate batches,
+        # and the ones which can't be batched are run alone
+        groups = OrderedDict()
+        for b in batch:
+            m = b['model']
+            if (type(m) is not flowline.FluxBasedModel or m.do_calving or
+                    m.sf_func is not None):
+                key = id(b)
+            else:
+                key = (m.yr, b['ye'], b['store_monthly_step'])
+            groups.setdefault(key, []).append(b)
+
+        out = dict()
+        for key, items in groups.items():
+            ex_t = time.time()
+            with warnings.catch_warnings():
+                # For operational runs we ignore the warnings
+                warnings.filterwarnings('ignore', category=RuntimeWarning)
+                if isinstance(key, tuple):
+                    bm = flowline.BatchedFluxBasedModel([b['model']
+                                                         for b in items])
+                    bm.run_until_and_store(key[1],
+                                           run_paths=[b['run_path']
+                                                      for b in items],
+                                           diag_paths=[b['diag_path']
+                                                       for b in items],
+                                           store_monthly_step=key[2])
+                    errors = bm.errors
+                else:
+                    b = items[0]
+                    try:
+                        b['model'].run_until_and_store(
+                            b['ye'], run_path=b['run_path'],
+                            diag_path=b['diag_path'],
+                            store_monthly_step=b['store_monthly_step'])
+                        errors = [None]
+                    except Exception as err:
+                        errors = [err]
+            # The run time is shared equally between the glaciers
+            ex_t = (time.time() - ex_t) / len(items)
+
+            for b, err in zip(items, errors):
+                gdir = b['gdir']
+                if err is None and b.get('container_key') is not None:
+                    utils.add_to_run_output_container(
+                        b['container_key'],
+                        {'model_run': b['run_path'],
+                         'model_diagnostics': b['diag_path']})
+                if err is None:
+                    gdir.log(task_name,
+                             task_time=task_time[gdir.rgi_id] + ex_t)
+                    out[gdir.rgi_id] = b['model']
+                else:
+                    self._log_error(gdir, task_name, err)
+
+        return [out.get(gdir.rgi_id) for gdir in gdirs]
+
+
+def execute_batched_model_run(task, gdirs, batch_size=100, **kwargs):
+    """Run a dynamical model task on many glaciers at once.
+
+    This is an alternative to ``execute_entity_task`` for the tasks relying
+    on :py:func:`oggm.core.flowline.robust_model_run` (e.g.
+    ``run_random_climate``, ``run_constant_climate``,
+    ``run_from_climate_data``). The glaciers are run in batches with the
+    :py:class:`oggm.core.flowline.BatchedFluxBasedModel`, which is much
+    faster than running them one by one when there are many small glaciers.
+    The outputs are the same as with ``execute_entity_task``.
+
+    If you asked for multiprocessing, the batches are distributed over
+    the processes.
+
+    Parameters
+    ----------
+    task : function
+         the entity task to apply
+    gdirs : list of :py:class:`oggm.GlacierDirectory` objects
+        the glacier directories to process
+    batch_size : int
+        the number of glaciers to run together. Glaciers are sorted by
+        area before being split into batches, so that the glaciers run
+        together have a similar size.
+
+    Returns
+    -------
+    the list of models (None for the glaciers which failed)
+    """
+
+    # Should be iterable
+    gdirs = utils.tolist(gdirs)
+
+    if len(gdirs) == 0:
+        return
+
+    log.workflow('Execute batched model run %s on %d glaciers',
+                 task.__name__, len(gdirs))
+
+    order = np.argsort([gdir.rgi_area_km2 for gdir in gdirs], kind='stable')
+    chunks = [[gdirs[i] for i in order[i0:i0+batch_size]]
+              for i0 in range(0, len(gdirs), batch_size)]
+
+    runner = _batched_model_runner(task, kwargs)
     if cfg.PARAMS['use_multiprocessing']:
         mppool = init_mp_pool(cfg.CONFIG_MODIFIED)
-        out = mppool.map(pc, gdirs, chunksize=1)
+        res = mppool.map(runner, chunks, chunksize=1)
     else:
-        out = [pc(gdir) for gdir in gdirs]
+        res = [runner(chunk) for chunk in chunks]
 
+    out = [None] * len(gdirs)
+    for i, model in zip(order, [m for r in res for m in r]):
+        out[i] = model
     return out
 
 
@@ -355,7 +779,10 @@ def init_glacier_regions(rgidf=None, *, reset=False, force=False,
                                                        version=rgi_version)
                 cfg.set_intersects_db(fp)
 
+            # Extracting the tar files is mostly I/O
+            executor = 'thread' if from_tar else 'process'
             gdirs = execute_entity_task(utils.GlacierDirectory, entities,
+                                        executor=executor,
                                         reset=reset,
                                         from_tar=from_tar,
                                         delete_tar=delete_tar)
@@ -503,7 +930,10 @@ def init_glacier_directories(rgidf=None, *, reset=False, force=False,
                     # List of str
                     pass
 
+            # Extracting the tar files is mostly I/O
+            executor = 'thread' if from_tar else 'process'
             gdirs = execute_entity_task(utils.GlacierDirectory, entities,
+                                        executor=executor,
                                         reset=reset,
                                         from_tar=from_tar,
                                         delete_tar=delete_tar)
@@ -532,8 +962,7 @@ def gis_prepro_tasks(gdirs):
         tasks.catchment_width_geom,
         tasks.catchment_width_correction
     ]
-    for task in task_list:
-        execute_entity_task(task, gdirs)
+    execute_pipeline(gdirs, task_list)
 
 
 def climate_tasks(gdirs):
@@ -546,15 +975,15 @@ def climate_tasks(gdirs):
     """
 
     # Process climate data
-    execute_entity_task(tasks.process_climate_data, gdirs)
+    task_list = [tasks.process_climate_data]
 
     # Then, calibration?
     if cfg.PARAMS['run_mb_calibration']:
-        tasks.compute_ref_t_stars(gdirs)
+        task_list.append(tasks.compute_ref_t_stars)
 
     # Mustar and the apparent mass-balance
-    execute_entity_task(tasks.local_t_star, gdirs)
-    execute_entity_task(tasks.mu_star_calibration, gdirs)
+    task_list += [tasks.local_t_star, tasks.mu_star_calibration]
+    execute_pipeline(gdirs, task_list)
 
 
 def inversion_tasks(gdirs):
@@ -577,16 +1006,16 @@ def inversion_tasks(gdirs):
                 gdirs_nc.append(gd)
 
         if gdirs_nc:
-            execute_entity_task(tasks.prepare_for_inversion, gdirs_nc)
-            execute_entity_task(tasks.mass_conservation_inversion, gdirs_nc)
-            execute_entity_task(tasks.filter_inversion_output, gdirs_nc)
+            execute_pipeline(gdirs_nc, [tasks.prepare_for_inversion,
+                                        tasks.mass_conservation_inversion,
+                                        tasks.filter_inversion_output])
 
         if gdirs_c:
             execute_entity_task(tasks.find_inversion_calving, gdirs_c)
     else:
-        execute_entity_task(tasks.prepare_for_inversion, gdirs)
-        execute_entity_task(tasks.mass_conservation_inversion, gdirs)
-        execute_entity_task(tasks.filter_inversion_output, gdirs)
+        execute_pipeline(gdirs, [tasks.prepare_for_inversion,
+                                 tasks.mass_conservation_inversion,
+                                 tasks.filter_inversion_output])
 
 
 def calibrate_inversion_from_consensus_estimate(gdirs, ignore_missing=False):